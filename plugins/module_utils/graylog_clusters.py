@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Fan-out of one module run to several Graylog clusters.
+#
+# Modules split their main() into run(module, endpoint), which logs in, runs the action
+# against one cluster and returns the usual result dict. run_on_clusters() calls it once per
+# entry of the clusters option, concurrently, and exits with the per cluster results. Without
+# clusters it runs once against endpoint.
+#
+# endpoint, and every entry of clusters, is a host or the list of the nodes of one cluster,
+# as in the modules managing a single cluster, see register_nodes().
+#
+# Each cluster gets a ClusterModule wrapping the AnsibleModule, its fail_json() raises
+# instead of exiting, so a failing cluster doesn't stop the others.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import register_nodes
+
+
+class ClusterFailure(Exception):
+
+    def __init__(self, result):
+        super(ClusterFailure, self).__init__(result.get('msg'))
+        self.result = result
+
+
+class ClusterModule(object):
+
+    def __init__(self, module, endpoint):
+        self._module = module
+        self.endpoint = endpoint
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def fail_json(self, **kwargs):
+        raise ClusterFailure(kwargs)
+
+
+def cluster_name(endpoint):
+
+    if isinstance(endpoint, (list, tuple)):
+        return ",".join(endpoint)
+
+    return endpoint
+
+
+def run_on_clusters(module, run):
+
+    endpoints = module.params['clusters'] or [module.params['endpoint'] or ""]
+
+    # A single cluster keeps the plain result and the module's own failures
+    if len(endpoints) == 1:
+        module.exit_json(**run(module, register_nodes(endpoints[0])))
+
+    def run_one(endpoint):
+        try:
+            result = run(ClusterModule(module, endpoint), register_nodes(endpoint))
+            result['failed'] = False
+        except ClusterFailure as e:
+            result = dict(e.result)
+            result['failed'] = True
+        except Exception as e:
+            result = {'failed': True, 'msg': "Fail: %s" % e}
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=len(endpoints))
+    try:
+        results = [result for result in executor.map(run_one, endpoints)]
+    finally:
+        executor.shutdown(wait=True)
+
+    uresp = {}
+    uresp['clusters'] = dict((cluster_name(endpoint), result) for endpoint, result in zip(endpoints, results))
+    uresp['changed'] = len([result for result in results if result.get('changed')]) > 0
+
+    failed = [cluster_name(endpoint) for endpoint, result in zip(endpoints, results) if result['failed']]
+    uresp['failed_clusters'] = failed
+    if len(failed) > 0:
+        module.fail_json(msg="Fail: %d of %d clusters failed: %s" % (len(failed), len(endpoints), ", ".join(failed)), **uresp)
+
+    module.exit_json(**uresp)
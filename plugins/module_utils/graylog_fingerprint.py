@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Content fingerprints of the desired state of Graylog objects.
+#
+# The fingerprint is stored with the object, at the end of its description, or in a local
+# JSON state file, keyed by endpoint, for objects without a description. It records what was
+# last applied: objects can be changed outside of Ansible, so they are still compared with
+# their current state before being skipped.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+
+UNCHANGED = "OK (unchanged)"
+
+MARKER_REGEX = re.compile(r'\s*\[fingerprint:([0-9a-f]{16})\]\s*$')
+
+
+def fingerprint(desired):
+
+    canonical = json.dumps(desired, sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def read_fingerprint(description):
+
+    if description is None:
+        return None
+
+    match = MARKER_REGEX.search(description)
+    if match is None:
+        return None
+
+    return match.group(1)
+
+
+def strip_fingerprint(description):
+
+    if description is None:
+        return None
+
+    return MARKER_REGEX.sub('', description)
+
+
+def with_fingerprint(description, value):
+
+    description = strip_fingerprint(description) or ""
+    if description != "":
+        description += " "
+
+    return description + "[fingerprint:" + value + "]"
+
+
+def load_state(path):
+
+    if path is None or not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".graylog-state-")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.rename(tmp, path)
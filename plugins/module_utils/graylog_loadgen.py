@@ -0,0 +1,547 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Synthetic GELF and syslog traffic for the capacity tests of Graylog inputs.
+#
+# Each worker process encodes and sends its share of the target rate, pacing itself against
+# the time its next message is due, and keeps a reservoir of send latencies. Drops are
+# measured by comparing what was sent with what arrived, either on a local stand-in receiver
+# (Receiver) or with the incomingMessages counter of the Graylog input.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import socket
+import ssl
+import struct
+import threading
+import time
+import zlib
+
+from ansible.module_utils.six import string_types
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url
+
+
+LATENCY_SAMPLES = 10000
+
+GELF_CHUNK_MAGIC = b'\x1e\x0f'
+
+GELF_CHUNK_HEADER = 12
+
+GELF_MAX_CHUNKS = 128
+
+SYSLOG_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def render(template, fields):
+
+    # Formats the strings of a template (str, dict or list) with the per message fields
+    if isinstance(template, dict):
+        return dict((key, render(value, fields)) for key, value in template.items())
+    if isinstance(template, list):
+        return [render(value, fields) for value in template]
+    if isinstance(template, string_types):
+        return template.format(**fields)
+
+    return template
+
+
+def compress(data, compression):
+
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    if compression == 'zlib':
+        return zlib.compress(data)
+
+    return data
+
+
+def gelf_chunks(data, chunk_size):
+
+    # A datagram bigger than chunk_size is split into numbered chunks sharing a random message id
+    if len(data) <= chunk_size:
+        return [data]
+
+    size = chunk_size - GELF_CHUNK_HEADER
+    count = (len(data) + size - 1) // size
+    if count > GELF_MAX_CHUNKS:
+        raise ValueError("GELF message of %d bytes needs more than %d chunks of %d bytes" % (len(data), GELF_MAX_CHUNKS, chunk_size))
+
+    message_id = os.urandom(8)
+    return [GELF_CHUNK_MAGIC + message_id + struct.pack('BB', index, count) + data[index * size:(index + 1) * size]
+            for index in range(count)]
+
+
+class Clock(object):
+
+    # Timestamps only change once a second, format them once
+    def __init__(self):
+        self.second = None
+        self.values = {}
+
+    def update(self):
+        now = time.time()
+        second = int(now)
+        if second != self.second:
+            self.second = second
+            utc = datetime.datetime.utcfromtimestamp(second)
+            self.values = {
+                'rfc3164': "%s %2d %s" % (SYSLOG_MONTHS[utc.month - 1], utc.day, utc.strftime("%H:%M:%S")),
+                'rfc5424': utc.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+        return now
+
+
+class GelfEncoder(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.padding = "x" * max(config['message_size'], 0)
+
+    def encode(self, fields, clock):
+        message = {
+            'version': "1.1",
+            'host': self.config['source'],
+            'short_message': "load test message {seq} from worker {worker} ".format(**fields) + self.padding,
+            'timestamp': round(fields['now'], 3),
+            'level': 6,
+            '_loadgen_seq': fields['seq'],
+            '_loadgen_worker': fields['worker']
+        }
+        message.update(render(self.config['template'] or {}, fields))
+        data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+        protocol = self.config['protocol']
+        if protocol == 'UDP':
+            return gelf_chunks(compress(data, self.config['compression']), self.config['chunk_size'])
+        if protocol == 'TCP':
+            return [data + b'\0']
+        return [compress(data, self.config['compression'])]
+
+
+class SyslogEncoder(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.priority = "<%d>" % (config['facility'] * 8 + config['severity'])
+        self.padding = "x" * max(config['message_size'], 0)
+
+    def encode(self, fields, clock):
+        text = render(self.config['template'], fields) if self.config['template'] else \
+            "load test message {seq} from worker {worker} ".format(**fields) + self.padding
+        config = self.config
+        if config['format'] == 'rfc5424':
+            timestamp = "%s.%03dZ" % (clock.values['rfc5424'], int(fields['now'] * 1000) % 1000)
+            line = "%s1 %s %s %s %d %s - %s" % (self.priority, timestamp, config['source'], config['app_name'], fields['pid'],
+                                               config['msg_id'], text)
+        else:
+            line = "%s%s %s %s[%d]: %s" % (self.priority, clock.values['rfc3164'], config['source'], config['app_name'],
+                                          fields['pid'], text)
+        data = line.encode('utf-8')
+
+        if config['protocol'] == 'UDP':
+            return [data]
+        if config['framing'] == 'octet_counting':
+            return [("%d " % len(data)).encode('ascii') + data]
+        if config['framing'] == 'null':
+            return [data + b'\0']
+        return [data + b'\n']
+
+
+ENCODERS = {'gelf': GelfEncoder, 'syslog': SyslogEncoder}
+
+
+class Sender(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.sock = None
+        self.http = None
+
+    def connect(self):
+        config = self.config
+        if config['protocol'] == 'UDP':
+            self.sock = socket.socket(socket.AF_INET6 if ':' in config['host'] else socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((config['host'], config['port']))
+            return
+        if config['protocol'] == 'HTTP':
+            from ansible.module_utils.six.moves import http_client
+            if config['tls']:
+                self.http = http_client.HTTPSConnection(config['host'], config['port'], timeout=config['timeout'], context=self.tls_context())
+            else:
+                self.http = http_client.HTTPConnection(config['host'], config['port'], timeout=config['timeout'])
+            return
+
+        self.sock = socket.create_connection((config['host'], config['port']), timeout=config['timeout'])
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if config['tls']:
+            self.sock = self.tls_context().wrap_socket(self.sock, server_hostname=config['host'])
+
+    def tls_context(self):
+        context = ssl.create_default_context()
+        if not self.config['validate_certs']:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def send(self, frames):
+        if self.sock is None and self.http is None:
+            self.connect()
+        if self.http is not None:
+            headers = {'Content-Type': "application/json"}
+            if self.config['compression'] != 'none':
+                headers['Content-Encoding'] = "gzip" if self.config['compression'] == 'gzip' else "deflate"
+            self.http.request('POST', self.config['path'], body=frames[0], headers=headers)
+            response = self.http.getresponse()
+            response.read()
+            if response.status not in [200, 202]:
+                raise IOError("HTTP %d" % response.status)
+            return
+        if self.config['protocol'] == 'UDP':
+            for frame in frames:
+                self.sock.send(frame)
+            return
+        self.sock.sendall(b''.join(frames))
+
+    def close(self):
+        for connection in [self.sock, self.http]:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+        self.sock = None
+        self.http = None
+
+
+def run_worker(config):
+
+    # Runs in a worker process, sends config['count'] messages (or until config['deadline']) at config['rate']
+    encoder = ENCODERS[config['kind']](config)
+    sender = Sender(config)
+    clock = Clock()
+    rng = random.Random()
+    latencies = []
+    sent = 0
+    sent_bytes = 0
+    errors = 0
+    last_error = None
+    fields = {'worker': config['worker'], 'pid': os.getpid(), 'host': config['source']}
+
+    started = clock.update()
+    while True:
+        now = clock.update()
+        if config['count'] is not None and sent + errors >= config['count']:
+            break
+        if config['deadline'] is not None and now >= config['deadline']:
+            break
+
+        # Pace against the time the next message is due, sleeping only when more than a millisecond ahead
+        if config['rate'] > 0:
+            due = started + (sent + errors) / config['rate']
+            if due - now > 0.001:
+                time.sleep(due - now)
+                now = clock.update()
+
+        fields['seq'] = sent + errors
+        fields['now'] = now
+        fields['random'] = rng.randint(0, 999999)
+        try:
+            frames = encoder.encode(fields, clock)
+            before = time.time()
+            sender.send(frames)
+            latency = time.time() - before
+        except (IOError, OSError, ValueError, socket.error) as e:
+            errors += 1
+            last_error = "%s" % e
+            sender.close()
+            continue
+
+        sent += 1
+        sent_bytes += sum(len(frame) for frame in frames)
+        if len(latencies) < LATENCY_SAMPLES:
+            latencies.append(latency)
+        else:
+            slot = rng.randint(0, sent - 1)
+            if slot < LATENCY_SAMPLES:
+                latencies[slot] = latency
+
+    elapsed = time.time() - started
+    sender.close()
+
+    return {'worker': config['worker'], 'sent': sent, 'bytes': sent_bytes, 'errors': errors, 'last_error': last_error,
+            'elapsed': elapsed, 'latencies': latencies}
+
+
+def percentile(values, ratio):
+
+    if len(values) == 0:
+        return None
+
+    return values[min(len(values) - 1, int(ratio * len(values)))]
+
+
+def run(config, workers, rate, duration, count):
+
+    # Splits the rate and the message count over the workers, returns their merged report
+    configs = []
+    deadline = time.time() + duration if count is None else None
+    for worker in range(workers):
+        worker_config = dict(config)
+        worker_config['worker'] = worker
+        worker_config['rate'] = float(rate) / workers if rate else 0
+        worker_config['count'] = (count // workers + (1 if worker < count % workers else 0)) if count is not None else None
+        worker_config['deadline'] = deadline
+        configs.append(worker_config)
+
+    started = time.time()
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(run_worker, configs)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - started
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    sent = sum(result['sent'] for result in results)
+    sent_bytes = sum(result['bytes'] for result in results)
+
+    report = {}
+    report['target_rate'] = rate
+    report['sent'] = sent
+    report['bytes'] = sent_bytes
+    report['errors'] = sum(result['errors'] for result in results)
+    report['last_error'] = ([result['last_error'] for result in results if result['last_error']] or [None])[0]
+    report['elapsed'] = round(elapsed, 3)
+    report['messages_per_second'] = round(sent / elapsed, 1) if elapsed > 0 else 0
+    report['megabytes_per_second'] = round(sent_bytes / elapsed / 1048576, 3) if elapsed > 0 else 0
+    report['latency_ms'] = {
+        'p50': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p95': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        'p99': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'max': round(latencies[-1] * 1000, 3) if latencies else None
+    }
+    report['workers'] = [{'worker': result['worker'], 'sent': result['sent'], 'errors': result['errors'],
+                          'messages_per_second': round(result['sent'] / result['elapsed'], 1) if result['elapsed'] > 0 else 0}
+                         for result in results]
+
+    return report
+
+
+class Receiver(object):
+
+    # Local stand-in for a Graylog input, counts the complete messages it receives
+    def __init__(self, kind, protocol, framing):
+        self.kind = kind
+        self.protocol = protocol
+        self.framing = framing
+        self.received = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.chunks = {}
+        self.running = True
+        self.server = None
+
+        if protocol == 'HTTP':
+            self.start_http()
+            return
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if protocol == 'UDP' else socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if protocol == 'UDP':
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1048576)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.sock.settimeout(0.2)
+        if protocol == 'TCP':
+            self.sock.listen(64)
+        self.start(self.serve_udp if protocol == 'UDP' else self.serve_tcp)
+
+    def start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def count(self, messages, size):
+        with self.lock:
+            self.received += messages
+            self.bytes += size
+
+    def serve_udp(self):
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except (OSError, socket.error):
+                break
+            if self.kind == 'gelf' and data[:2] == GELF_CHUNK_MAGIC:
+                message_id = data[2:10]
+                parts = self.chunks.setdefault(message_id, set())
+                parts.add(ord(data[10:11]))
+                if len(parts) < ord(data[11:12]):
+                    self.count(0, len(data))
+                    continue
+                del self.chunks[message_id]
+            self.count(1, len(data))
+
+    def serve_tcp(self):
+        while self.running:
+            try:
+                connection, address = self.sock.accept()
+            except socket.timeout:
+                continue
+            except (OSError, socket.error):
+                break
+            self.start(self.read_tcp, connection)
+
+    def read_tcp(self, connection):
+        connection.settimeout(0.2)
+        pending = b''
+        delimiter = b'\n' if self.framing == 'newline' else b'\0'
+        while self.running:
+            try:
+                data = connection.recv(262144)
+            except socket.timeout:
+                continue
+            except (OSError, socket.error):
+                break
+            if not data:
+                break
+            if self.framing == 'octet_counting':
+                pending += data
+                messages = 0
+                while True:
+                    space = pending.find(b' ')
+                    if space < 0:
+                        break
+                    length = int(pending[:space])
+                    if len(pending) < space + 1 + length:
+                        break
+                    pending = pending[space + 1 + length:]
+                    messages += 1
+                self.count(messages, len(data))
+            else:
+                self.count(data.count(delimiter), len(data))
+        connection.close()
+
+    def start_http(self):
+        from ansible.module_utils.six.moves import BaseHTTPServer, socketserver
+        receiver = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                receiver.count(1, len(body))
+                self.send_response(202)
+                self.send_header('Content-Length', "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        self.start(self.server.serve_forever)
+
+    def wait(self, expected, timeout):
+        # Waits for the expected messages, or until nothing arrived for a second
+        deadline = time.time() + timeout
+        last = -1
+        while time.time() < deadline and self.received < expected:
+            if self.received == last:
+                break
+            last = self.received
+            time.sleep(1)
+        return self.received
+
+    def close(self):
+        self.running = False
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        else:
+            self.sock.close()
+
+
+def input_received(module, endpoint, headers, input_id):
+
+    # Total of the incomingMessages meter of a Graylog input over all the nodes
+    url = endpoint + "/api/system/inputs/" + input_id
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    graylog_input = json.loads(response.read())
+    name = graylog_input['type'] + "." + input_id + ".incomingMessages"
+
+    url = endpoint + "/api/cluster/metrics/multiple"
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=json.dumps({'metrics': [name]}))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    total = 0
+    nodes = json.loads(response.read())
+    for node_id in nodes:
+        for metric in (nodes[node_id] or {}).get('metrics', []):
+            if metric['full_name'] == name:
+                total += metric['metric']['rate']['total']
+
+    return total
+
+
+def measure(module, config, endpoint=None, headers=None):
+
+    # Runs the load against the local receiver or the configured target and adds the delivery figures
+    params = module.params
+    receiver = None
+    if params['local_receiver']:
+        receiver = Receiver(config['kind'], config['protocol'], config.get('framing'))
+        config['host'] = "127.0.0.1"
+        config['port'] = receiver.port
+        config['tls'] = False
+
+    before = None
+    if receiver is None and params['input_id'] is not None:
+        before = input_received(module, endpoint, headers, params['input_id'])
+
+    try:
+        report = run(config, max(1, params['workers']), params['rate'], params['duration'], params['count'])
+
+        if receiver is not None:
+            received = receiver.wait(report['sent'], params['drain_timeout'])
+        elif before is not None:
+            # Input meters are refreshed as messages are processed, give them drain_timeout to catch up
+            deadline = time.time() + params['drain_timeout']
+            received = input_received(module, endpoint, headers, params['input_id']) - before
+            while received < report['sent'] and time.time() < deadline:
+                time.sleep(1)
+                received = input_received(module, endpoint, headers, params['input_id']) - before
+        else:
+            received = None
+    finally:
+        if receiver is not None:
+            receiver.close()
+
+    report['target'] = "%s:%d/%s" % (config['host'], config['port'], config['protocol'])
+    report['received'] = received
+    report['dropped'] = max(report['sent'] - received, 0) if received is not None else None
+    report['drop_rate'] = round(float(report['dropped']) / report['sent'], 5) if received is not None and report['sent'] > 0 else None
+
+    return report
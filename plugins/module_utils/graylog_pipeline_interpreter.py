@@ -0,0 +1,711 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Client side interpreter for a subset of the Graylog processing pipeline language.
+#
+# Rules are parsed with graylog_pipeline_rules and compiled once into Python closures, then
+# run over messages (dicts) stage by stage with the semantics of the server: in each stage
+# the conditions of all the rules are evaluated before the actions of the matching ones, the
+# match mode of the stage decides whether the pipeline goes on, and a dropped message stops
+# being processed after the stage. Functions outside of the supported set raise
+# UnsupportedFunction when the rule is compiled.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import datetime
+import json
+import re
+import time
+
+from ansible.module_utils.six import string_types
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_pipeline_rules import RuleSyntaxError, parse_pipeline, parse_rule
+
+
+class UnsupportedFunction(Exception):
+    pass
+
+
+class EvaluationError(Exception):
+    pass
+
+
+GROK_PATTERNS = {
+    'USERNAME': r'[a-zA-Z0-9._-]+',
+    'USER': r'%{USERNAME}',
+    'INT': r'(?:[+-]?(?:[0-9]+))',
+    'BASE10NUM': r'(?:[+-]?(?:[0-9]+(?:\.[0-9]+)?|\.[0-9]+))',
+    'NUMBER': r'(?:%{BASE10NUM})',
+    'BASE16NUM': r'(?:0[xX]?[0-9a-fA-F]+)',
+    'POSINT': r'\b(?:[1-9][0-9]*)\b',
+    'NONNEGINT': r'\b(?:[0-9]+)\b',
+    'WORD': r'\b\w+\b',
+    'NOTSPACE': r'\S+',
+    'SPACE': r'\s*',
+    'DATA': r'.*?',
+    'GREEDYDATA': r'.*',
+    'QUOTEDSTRING': r'(?:"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')',
+    'UUID': r'[A-Fa-f0-9]{8}-(?:[A-Fa-f0-9]{4}-){3}[A-Fa-f0-9]{12}',
+    'MAC': r'(?:[A-Fa-f0-9]{2}[:-]){5}[A-Fa-f0-9]{2}',
+    'IPV4': r'(?<![0-9])(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9]{1,2})\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9]{1,2})(?![0-9])',
+    'IPV6': r'(?:[0-9A-Fa-f]{0,4}:){2,7}(?:[0-9A-Fa-f]{1,4}|(?:[0-9]{1,3}\.){3}[0-9]{1,3})?',
+    'IP': r'(?:%{IPV6}|%{IPV4})',
+    'HOSTNAME': r'\b(?:[0-9A-Za-z][0-9A-Za-z-]{0,62})(?:\.(?:[0-9A-Za-z][0-9A-Za-z-]{0,62}))*\.?\b',
+    'IPORHOST': r'(?:%{IP}|%{HOSTNAME})',
+    'HOSTPORT': r'%{IPORHOST}:%{POSINT}',
+    'LOGLEVEL': r'(?:[Aa]lert|ALERT|[Tt]race|TRACE|[Dd]ebug|DEBUG|[Nn]otice|NOTICE|[Ii]nfo|INFO|[Ww]arn?(?:ing)?|WARN?(?:ING)?|'
+                r'[Ee]rr?(?:or)?|ERR?(?:OR)?|[Cc]rit?(?:ical)?|CRIT?(?:ICAL)?|[Ff]atal|FATAL|[Ss]evere|SEVERE|EMERG(?:ENCY)?|[Ee]merg(?:ency)?)',
+    'YEAR': r'(?:\d\d){1,2}',
+    'MONTHNUM': r'(?:0?[1-9]|1[0-2])',
+    'MONTHDAY': r'(?:(?:0[1-9])|(?:[12][0-9])|(?:3[01])|[1-9])',
+    'MONTH': r'\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\b',
+    'HOUR': r'(?:2[0123]|[01]?[0-9])',
+    'MINUTE': r'(?:[0-5][0-9])',
+    'SECOND': r'(?:(?:[0-5]?[0-9]|60)(?:[:.,][0-9]+)?)',
+    'TIME': r'(?<![0-9])%{HOUR}:%{MINUTE}(?::%{SECOND})(?![0-9])',
+    'ISO8601_TIMEZONE': r'(?:Z|[+-]%{HOUR}(?::?%{MINUTE}))',
+    'TIMESTAMP_ISO8601': r'%{YEAR}-%{MONTHNUM}-%{MONTHDAY}[T ]%{HOUR}:?%{MINUTE}(?::?%{SECOND})?%{ISO8601_TIMEZONE}?',
+    'SYSLOGTIMESTAMP': r'%{MONTH} +%{MONTHDAY} %{TIME}',
+    'PROG': r'[\x21-\x5a\x5c\x5e-\x7e]+',
+    'SYSLOGPROG': r'%{PROG:program}(?:\[%{POSINT:pid}\])?',
+    'SYSLOGHOST': r'%{IPORHOST}',
+    'URIPROTO': r'[A-Za-z][A-Za-z0-9+\-.]*',
+    'URIPATH': r'(?:/[A-Za-z0-9$.+!*\'(){},~:;=@#%&_\-]*)+',
+    'URIPARAM': r'\?[A-Za-z0-9$.+!*\'|(){},~@#%&/=:;_?\-\[\]<>]*',
+}
+
+JAVA_NAMED_GROUP = re.compile(r'\(\?<(?=[A-Za-z])')
+
+GROK_REFERENCE = re.compile(r'%\{(\w+)(?::([^:}]+))?(?::(\w+))?\}')
+
+
+class Grok(object):
+
+    # One compiled grok pattern, the capture names are kept aside as they are not valid Python group names
+
+    def __init__(self, pattern, patterns, only_named_captures):
+        self.captures = []
+
+        def capture(match):
+            name, field, conversion = match.groups()
+            inner = expand_grok(patterns, name)
+            if field is None and only_named_captures:
+                return "(?:%s)" % inner
+            self.captures.append((field or name, conversion))
+            return "(?P<g%d>%s)" % (len(self.captures) - 1, inner)
+
+        self.regex = re.compile(GROK_REFERENCE.sub(capture, java_regex(pattern)), re.DOTALL)
+
+    def match(self, value):
+
+        match = self.regex.search(value)
+        if match is None:
+            return {}
+
+        result = {}
+        for index, (name, conversion) in enumerate(self.captures):
+            captured = match.group("g%d" % index)
+            if captured is None:
+                continue
+            if conversion == 'int':
+                captured = int(captured)
+            elif conversion in ['float', 'double']:
+                captured = float(captured)
+            result[name] = captured
+
+        return result
+
+
+def expand_grok(patterns, name):
+
+    # The captures of the nested patterns are not returned
+    def reference(match):
+        if match.group(1) not in patterns:
+            raise EvaluationError("unknown grok pattern %s" % match.group(1))
+        return "(?:%s)" % patterns[match.group(1)]
+
+    expanded = reference(GROK_REFERENCE.match("%{" + name + "}"))
+    for depth in range(20):
+        previous, expanded = expanded, GROK_REFERENCE.sub(reference, expanded)
+        if previous == expanded:
+            return expanded
+
+    raise EvaluationError("grok pattern %s nests too deep" % name)
+
+
+def java_regex(pattern):
+
+    # Java names groups with (?<name>...), Python with (?P<name>...)
+    return JAVA_NAMED_GROUP.sub("(?P<", pattern)
+
+
+def java_string(value):
+
+    if value is None:
+        return None
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+
+    return "%s" % value
+
+
+def truthy(value):
+
+    return value is True
+
+
+class Context(object):
+
+    def __init__(self, message):
+        self.message = message
+        self.variables = {}
+        self.dropped = False
+        self.streams = []
+
+
+# name: [(parameter, default value, required)]
+FUNCTION_PARAMETERS = {
+    'has_field': [('field', None, True), ('message', None, False)],
+    'set_field': [('field', None, True), ('value', None, True), ('prefix', "", False), ('suffix', "", False), ('message', None, False)],
+    'set_fields': [('fields', None, True), ('prefix', "", False), ('suffix', "", False), ('message', None, False)],
+    'remove_field': [('field', None, True), ('message', None, False)],
+    'rename_field': [('old_field', None, True), ('new_field', None, True), ('message', None, False)],
+    'drop_message': [('message', None, False)],
+    'route_to_stream': [('id', None, False), ('name', None, False), ('message', None, False), ('remove_from_default', False, False)],
+    'to_string': [('value', None, True), ('default', "", False)],
+    'to_long': [('value', None, True), ('default', 0, False)],
+    'to_double': [('value', None, True), ('default', 0.0, False)],
+    'to_bool': [('value', None, True)],
+    'to_map': [('value', None, True)],
+    'is_null': [('value', None, True)],
+    'is_not_null': [('value', None, True)],
+    'is_string': [('value', None, True)],
+    'is_number': [('value', None, True)],
+    'is_bool': [('value', None, True)],
+    'contains': [('value', None, True), ('search', None, True), ('ignore_case', False, False)],
+    'starts_with': [('value', None, True), ('prefix', None, True), ('ignore_case', False, False)],
+    'ends_with': [('value', None, True), ('suffix', None, True), ('ignore_case', False, False)],
+    'lowercase': [('value', None, True), ('locale', None, False)],
+    'uppercase': [('value', None, True), ('locale', None, False)],
+    'capitalize': [('value', None, True)],
+    'abbreviate': [('value', None, True), ('width', None, True)],
+    'substring': [('value', None, True), ('start', None, True), ('end', None, False)],
+    'concat': [('first', None, True), ('second', None, True)],
+    'split': [('pattern', None, True), ('value', None, True), ('limit', 0, False)],
+    'regex': [('pattern', None, True), ('value', None, True), ('group_names', None, False)],
+    'regex_replace': [('pattern', None, True), ('value', None, True), ('replacement', None, True), ('replace_all', True, False)],
+    'grok': [('pattern', None, True), ('value', None, True), ('only_named_captures', False, False)],
+    'key_value': [('value', None, True), ('delimiters', " ", False), ('kv_delimiters', "=", False), ('ignore_empty_values', True, False),
+                  ('allow_dup_keys', True, False), ('handle_dup_keys', "take_first", False), ('trim_key_chars', "", False),
+                  ('trim_value_chars', "", False)],
+    'parse_json': [('value', None, True)],
+    'cidr_match': [('cidr', None, True), ('ip', None, True)],
+    'to_ip': [('ip', None, True)],
+    'now': [('timezone', None, False)],
+    'debug': [('value', None, True)],
+}
+
+
+def to_long(value, default):
+
+    try:
+        return int(float(value)) if not isinstance(value, bool) else default
+    except (TypeError, ValueError):
+        return default
+
+
+def to_double(value, default):
+
+    try:
+        return float(value) if not isinstance(value, bool) else default
+    except (TypeError, ValueError):
+        return default
+
+
+def key_value(args):
+
+    value = java_string(args['value']) or ""
+    result = {}
+    pairs = re.split("[" + re.escape(args['delimiters']) + "]", value)
+    for pair in pairs:
+        parts = re.split("[" + re.escape(args['kv_delimiters']) + "]", pair, 1)
+        if len(parts) != 2:
+            continue
+        key = parts[0].strip(args['trim_key_chars']) if args['trim_key_chars'] else parts[0]
+        item = parts[1].strip(args['trim_value_chars']) if args['trim_value_chars'] else parts[1]
+        if item == "" and args['ignore_empty_values']:
+            continue
+        if key in result:
+            if not args['allow_dup_keys']:
+                raise EvaluationError("duplicate key %s in key_value" % key)
+            if args['handle_dup_keys'] == "take_last":
+                result[key] = item
+            elif args['handle_dup_keys'] not in ["take_first", "take_last"]:
+                result[key] = result[key] + args['handle_dup_keys'] + item
+            continue
+        result[key] = item
+
+    return result
+
+
+def cidr_match(cidr, ip):
+
+    import ipaddress
+    try:
+        return ipaddress.ip_address(u"%s" % ip) in ipaddress.ip_network(u"%s" % cidr, strict=False)
+    except ValueError:
+        return False
+
+
+class Compiler(object):
+
+    def __init__(self, grok_patterns=None):
+        self.patterns = dict(GROK_PATTERNS)
+        self.patterns.update(dict((name, java_regex(pattern)) for name, pattern in (grok_patterns or {}).items()))
+        self.regexes = {}
+        self.groks = {}
+
+    def regex(self, pattern):
+        if pattern not in self.regexes:
+            self.regexes[pattern] = re.compile(java_regex(pattern), re.DOTALL)
+        return self.regexes[pattern]
+
+    def grok(self, pattern, only_named_captures):
+        key = (pattern, bool(only_named_captures))
+        if key not in self.groks:
+            self.groks[key] = Grok(pattern, self.patterns, only_named_captures)
+        return self.groks[key]
+
+    def compile_rule(self, source):
+        return self.compile_node(parse_rule(source))
+
+    def compile_node(self, node):
+        when = self.expression(node['when'])
+        then = [self.statement(statement) for statement in node['then']]
+        return {'name': node['name'], 'when': when, 'then': then}
+
+    def statement(self, node):
+        if node['type'] == 'let':
+            name = node['name']
+            value = self.expression(node['value'])
+
+            def let(ctx):
+                ctx.variables[name] = value(ctx)
+            return let
+        return self.expression(node)
+
+    def expression(self, node):
+        kind = node['type']
+
+        if kind == 'literal':
+            value = node['value']
+            return lambda ctx: value
+        if kind == 'variable':
+            name = node['name']
+
+            def variable(ctx):
+                if name not in ctx.variables:
+                    raise EvaluationError("undeclared variable %s" % name)
+                return ctx.variables[name]
+            return variable
+        if kind == 'message_field':
+            name = node['name']
+            return lambda ctx: ctx.message.get(name)
+        if kind == 'field':
+            target = self.expression(node['object'])
+            name = node['name']
+
+            def field(ctx):
+                value = target(ctx)
+                return value.get(name) if isinstance(value, dict) else None
+            return field
+        if kind == 'index':
+            target = self.expression(node['object'])
+            index = self.expression(node['index'])
+
+            def item(ctx):
+                value = target(ctx)
+                key = index(ctx)
+                if isinstance(value, dict):
+                    return value.get(key if key in value else java_string(key))
+                if isinstance(value, list) and isinstance(key, int) and -len(value) <= key < len(value):
+                    return value[key]
+                return None
+            return item
+        if kind == 'array':
+            items = [self.expression(item) for item in node['items']]
+            return lambda ctx: [item(ctx) for item in items]
+        if kind == 'map':
+            entries = [(key, self.expression(value)) for key, value in node['entries']]
+            return lambda ctx: dict((key, value(ctx)) for key, value in entries)
+        if kind == 'not':
+            value = self.expression(node['value'])
+            return lambda ctx: not truthy(value(ctx))
+        if kind == 'negate':
+            value = self.expression(node['value'])
+            return lambda ctx: -value(ctx)
+        if kind == 'and':
+            left, right = self.expression(node['left']), self.expression(node['right'])
+            return lambda ctx: truthy(left(ctx)) and truthy(right(ctx))
+        if kind == 'or':
+            left, right = self.expression(node['left']), self.expression(node['right'])
+            return lambda ctx: truthy(left(ctx)) or truthy(right(ctx))
+        if kind == 'compare':
+            return self.compare(node)
+        if kind == 'arithmetic':
+            return self.arithmetic(node)
+        if kind == 'call':
+            return self.call(node)
+
+        raise EvaluationError("unsupported expression %s" % kind)
+
+    def compare(self, node):
+        left, right = self.expression(node['left']), self.expression(node['right'])
+        operator = node['operator']
+
+        def compare(ctx):
+            a, b = left(ctx), right(ctx)
+            if operator == '==':
+                return a == b
+            if operator == '!=':
+                return a != b
+            if not isinstance(a, (int, float)) or not isinstance(b, (int, float)) or isinstance(a, bool) or isinstance(b, bool):
+                return False
+            if operator == '<':
+                return a < b
+            if operator == '<=':
+                return a <= b
+            if operator == '>':
+                return a > b
+            return a >= b
+        return compare
+
+    def arithmetic(self, node):
+        left, right = self.expression(node['left']), self.expression(node['right'])
+        operator = node['operator']
+
+        def arithmetic(ctx):
+            a, b = left(ctx), right(ctx)
+            if not isinstance(a, (int, float)) or not isinstance(b, (int, float)):
+                raise EvaluationError("%s needs numbers, got %s and %s" % (operator, java_string(a), java_string(b)))
+            if operator == '+':
+                return a + b
+            if operator == '-':
+                return a - b
+            if operator == '*':
+                return a * b
+            if b == 0:
+                raise EvaluationError("division by zero")
+            # Java integer division and remainder truncate toward zero
+            if isinstance(a, int) and isinstance(b, int):
+                quotient = abs(a) // abs(b) * (1 if (a >= 0) == (b >= 0) else -1)
+                return quotient if operator == '/' else a - quotient * b
+            return a / b if operator == '/' else a % b
+        return arithmetic
+
+    def arguments(self, node):
+        name = node['name']
+        parameters = FUNCTION_PARAMETERS[name]
+        compiled = {}
+        if len(node['args']) > len(parameters):
+            raise EvaluationError("too many arguments in call to %s" % name)
+        for (parameter, default, required), arg in zip(parameters, node['args']):
+            compiled[parameter] = self.expression(arg)
+        for parameter, arg in node['named'].items():
+            if parameter not in [item[0] for item in parameters]:
+                raise EvaluationError("unknown parameter %s in call to %s" % (parameter, name))
+            compiled[parameter] = self.expression(arg)
+        for parameter, default, required in parameters:
+            if required and parameter not in compiled:
+                raise EvaluationError("missing parameter %s in call to %s" % (parameter, name))
+
+        defaults = dict((parameter, default) for parameter, default, required in parameters)
+
+        def evaluate(ctx):
+            args = dict(defaults)
+            for parameter, value in compiled.items():
+                args[parameter] = value(ctx)
+            return args
+        return evaluate
+
+    def call(self, node):
+        name = node['name']
+        if name not in FUNCTION_PARAMETERS:
+            raise UnsupportedFunction("function %s (line %d) is not supported by the local interpreter" % (name, node['line']))
+        arguments = self.arguments(node)
+        implementation = getattr(self, 'function_' + name)
+        return lambda ctx: implementation(ctx, arguments(ctx))
+
+    def function_has_field(self, ctx, args):
+        return args['field'] in ctx.message and ctx.message[args['field']] is not None
+
+    def function_set_field(self, ctx, args):
+        if args['value'] is not None:
+            ctx.message[(args['prefix'] or "") + args['field'] + (args['suffix'] or "")] = args['value']
+
+    def function_set_fields(self, ctx, args):
+        for key, value in (args['fields'] or {}).items():
+            if value is not None:
+                ctx.message[(args['prefix'] or "") + key + (args['suffix'] or "")] = value
+
+    def function_remove_field(self, ctx, args):
+        ctx.message.pop(args['field'], None)
+
+    def function_rename_field(self, ctx, args):
+        if args['old_field'] in ctx.message:
+            ctx.message[args['new_field']] = ctx.message.pop(args['old_field'])
+
+    def function_drop_message(self, ctx, args):
+        ctx.dropped = True
+
+    def function_route_to_stream(self, ctx, args):
+        stream = args['id'] or args['name']
+        if stream not in ctx.streams:
+            ctx.streams.append(stream)
+
+    def function_to_string(self, ctx, args):
+        return java_string(args['value']) if args['value'] is not None else args['default']
+
+    def function_to_long(self, ctx, args):
+        return to_long(args['value'], args['default'])
+
+    def function_to_double(self, ctx, args):
+        return to_double(args['value'], args['default'])
+
+    def function_to_bool(self, ctx, args):
+        return args['value'] is True or java_string(args['value']) == "true"
+
+    def function_to_map(self, ctx, args):
+        return args['value'] if isinstance(args['value'], dict) else {}
+
+    def function_is_null(self, ctx, args):
+        return args['value'] is None
+
+    def function_is_not_null(self, ctx, args):
+        return args['value'] is not None
+
+    def function_is_string(self, ctx, args):
+        return isinstance(args['value'], string_types)
+
+    def function_is_number(self, ctx, args):
+        return isinstance(args['value'], (int, float)) and not isinstance(args['value'], bool)
+
+    def function_is_bool(self, ctx, args):
+        return isinstance(args['value'], bool)
+
+    def function_contains(self, ctx, args):
+        value, search = java_string(args['value']) or "", java_string(args['search']) or ""
+        if args['ignore_case']:
+            value, search = value.lower(), search.lower()
+        return search in value
+
+    def function_starts_with(self, ctx, args):
+        value, prefix = java_string(args['value']) or "", java_string(args['prefix']) or ""
+        if args['ignore_case']:
+            value, prefix = value.lower(), prefix.lower()
+        return value.startswith(prefix)
+
+    def function_ends_with(self, ctx, args):
+        value, suffix = java_string(args['value']) or "", java_string(args['suffix']) or ""
+        if args['ignore_case']:
+            value, suffix = value.lower(), suffix.lower()
+        return value.endswith(suffix)
+
+    def function_lowercase(self, ctx, args):
+        return (java_string(args['value']) or "").lower()
+
+    def function_uppercase(self, ctx, args):
+        return (java_string(args['value']) or "").upper()
+
+    def function_capitalize(self, ctx, args):
+        value = java_string(args['value']) or ""
+        return value[:1].upper() + value[1:]
+
+    def function_abbreviate(self, ctx, args):
+        value, width = java_string(args['value']) or "", int(args['width'])
+        return value if len(value) <= width else value[:max(width - 3, 1)] + "..."
+
+    def function_substring(self, ctx, args):
+        value = java_string(args['value']) or ""
+        end = args['end'] if args['end'] is not None else len(value)
+        return value[int(args['start']):int(end)]
+
+    def function_concat(self, ctx, args):
+        return (java_string(args['first']) or "") + (java_string(args['second']) or "")
+
+    def function_split(self, ctx, args):
+        limit = int(args['limit'] or 0)
+        parts = self.regex(args['pattern']).split(java_string(args['value']) or "", max(limit - 1, 0))
+        # Like String.split, trailing empty strings are removed without a limit
+        while limit == 0 and len(parts) > 0 and parts[-1] == "":
+            parts.pop()
+        return parts
+
+    def function_regex(self, ctx, args):
+        match = self.regex(args['pattern']).search(java_string(args['value']) or "")
+        if match is None:
+            return {'matches': False}
+        names = args['group_names'] or []
+        result = {'matches': True}
+        for index, group in enumerate(match.groups()):
+            result[names[index] if index < len(names) else "%d" % index] = group
+        return result
+
+    def function_regex_replace(self, ctx, args):
+        # Java replacements use $1, Python \1
+        replacement = re.sub(r'\$(\d+)', r'\\\1', args['replacement'])
+        return self.regex(args['pattern']).sub(replacement, java_string(args['value']) or "", 0 if args['replace_all'] else 1)
+
+    def function_grok(self, ctx, args):
+        return self.grok(args['pattern'], args['only_named_captures']).match(java_string(args['value']) or "")
+
+    def function_key_value(self, ctx, args):
+        return key_value(args)
+
+    def function_parse_json(self, ctx, args):
+        try:
+            return json.loads(java_string(args['value']) or "")
+        except ValueError:
+            return None
+
+    def function_cidr_match(self, ctx, args):
+        return cidr_match(args['cidr'], args['ip'])
+
+    def function_to_ip(self, ctx, args):
+        return java_string(args['ip'])
+
+    def function_now(self, ctx, args):
+        return datetime.datetime.utcnow().isoformat() + "Z"
+
+    def function_debug(self, ctx, args):
+        return None
+
+
+class RuleStats(object):
+
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.errors = 0
+        self.when_time = 0.0
+        self.then_time = 0.0
+        self.last_error = None
+
+    def result(self, name):
+        return {
+            'rule': name,
+            'evaluations': self.evaluations,
+            'matches': self.matches,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'when_ms': round(self.when_time * 1000, 3),
+            'then_ms': round(self.then_time * 1000, 3),
+            'total_ms': round((self.when_time + self.then_time) * 1000, 3),
+            'ns_per_evaluation': int((self.when_time + self.then_time) * 1e9 / self.evaluations) if self.evaluations else 0
+        }
+
+
+class Interpreter(object):
+
+    def __init__(self, rules, pipelines, grok_patterns=None):
+        # rules and pipelines are lists of sources, a pipeline referencing a missing rule is an error
+        self.pipelines = [parse_pipeline(source) for source in pipelines]
+        used = set(name for pipeline in self.pipelines for stage in pipeline['stages'] for name in stage['rules'])
+
+        # Only the rules of the pipelines are compiled, the others may call functions that aren't supported
+        compiler = Compiler(grok_patterns)
+        self.rules = {}
+        syntax_errors = []
+        for source in rules:
+            try:
+                node = parse_rule(source)
+            except RuleSyntaxError as e:
+                syntax_errors.append(e)
+                continue
+            if node['name'] in used:
+                self.rules[node['name']] = compiler.compile_node(node)
+        for name in used:
+            # The rule that failed to parse is most likely the missing one
+            if name not in self.rules and len(syntax_errors) > 0:
+                raise syntax_errors[0]
+        self.stats = dict((name, RuleStats()) for name in self.rules)
+        self.messages = 0
+        self.dropped = 0
+
+        # { stage: [(pipeline, stage node)] }, stages of the same number run together
+        self.stages = {}
+        for pipeline in self.pipelines:
+            for stage in pipeline['stages']:
+                for name in stage['rules']:
+                    if name not in self.rules:
+                        raise EvaluationError("pipeline %s references the unknown rule %s" % (pipeline['name'], name))
+                self.stages.setdefault(stage['stage'], []).append((pipeline, stage))
+        self.stage_numbers = sorted(self.stages)
+        self.stage_counts = dict(((pipeline['name'], stage['stage']), {'entered': 0, 'passed': 0})
+                                 for pipeline in self.pipelines for stage in pipeline['stages'])
+
+    def when(self, rule, ctx):
+        stats = self.stats[rule['name']]
+        stats.evaluations += 1
+        started = time.time()
+        try:
+            matched = truthy(rule['when'](ctx))
+        except Exception as e:
+            stats.errors += 1
+            stats.last_error = "%s" % e
+            matched = False
+        stats.when_time += time.time() - started
+        if matched:
+            stats.matches += 1
+        return matched
+
+    def then(self, rule, ctx):
+        stats = self.stats[rule['name']]
+        started = time.time()
+        try:
+            for statement in rule['then']:
+                statement(ctx)
+        except Exception as e:
+            stats.errors += 1
+            stats.last_error = "%s" % e
+        stats.then_time += time.time() - started
+
+    def process(self, message):
+
+        self.messages += 1
+        ctx = Context(message)
+        stopped = set()
+        for number in self.stage_numbers:
+            for pipeline, stage in self.stages[number]:
+                if pipeline['name'] in stopped:
+                    continue
+                counts = self.stage_counts[(pipeline['name'], number)]
+                counts['entered'] += 1
+                rules = [self.rules[name] for name in stage['rules']]
+                matched = [rule for rule in rules if self.when(rule, ctx)]
+                for rule in matched:
+                    self.then(rule, ctx)
+                if stage['match'] == 'all' and len(matched) < len(rules) or \
+                        stage['match'] == 'either' and len(matched) == 0 and len(rules) > 0:
+                    stopped.add(pipeline['name'])
+                else:
+                    counts['passed'] += 1
+            if ctx.dropped:
+                self.dropped += 1
+                return None
+
+        if len(ctx.streams) > 0:
+            message['streams'] = ctx.streams
+
+        return message
+
+    def result(self):
+        rules = [self.stats[name].result(name) for name in self.stats]
+        rules.sort(key=lambda rule: rule['total_ms'], reverse=True)
+        stages = [{'pipeline': key[0], 'stage': key[1], 'entered': counts['entered'], 'passed': counts['passed']}
+                  for key, counts in sorted(self.stage_counts.items())]
+        return {'messages': self.messages, 'dropped': self.dropped, 'rules': rules, 'stages': stages}
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Client side parser for the Graylog processing pipeline language.
+#
+# It follows the grammar of the server (RuleLang.g4) closely enough to reject the same
+# syntax errors, so sources can be checked without a round trip to the Graylog API.
+# Function names and argument types are not checked, that needs the server.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import re
+
+
+KEYWORDS = ['all', 'either', 'pass', 'and', 'or', 'not', 'pipeline', 'rule', 'during', 'stage', 'when',
+            'then', 'end', 'let', 'match', 'true', 'false']
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<whitespace>[ \t\r\n\f]+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<float>[0-9]+\.[0-9]+(?:[eE][+-]?[0-9]+)?|[0-9]+[eE][+-]?[0-9]+)
+  | (?P<integer>0[xX][0-9a-fA-F]+|[0-9]+)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<char>'(?:[^'\\]|\\.)')
+  | (?P<message>\$message)
+  | (?P<identifier>[a-zA-Z_][a-zA-Z0-9_]*|`[^`]+`)
+  | (?P<operator>&&|\|\||==|!=|<=|>=|[<>!+\-*/%.,;:=()\[\]{}])
+''', re.VERBOSE | re.DOTALL)
+
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+
+class RuleSyntaxError(Exception):
+
+    def __init__(self, message, line, column):
+        super(RuleSyntaxError, self).__init__("line %d:%d %s" % (line, column, message))
+        self.message = message
+        self.line = line
+        self.column = column
+
+
+def unescape(text):
+
+    result = []
+    i = 0
+    while i < len(text):
+        if text[i] == '\\' and i + 1 < len(text):
+            if text[i + 1] == 'u' and i + 5 < len(text):
+                result.append(chr(int(text[i + 2:i + 6], 16)))
+                i += 6
+                continue
+            result.append(ESCAPES.get(text[i + 1], text[i + 1]))
+            i += 2
+            continue
+        result.append(text[i])
+        i += 1
+
+    return "".join(result)
+
+
+def tokenize(source):
+
+    tokens = []
+    position = 0
+    line = 1
+    line_start = 0
+
+    while position < len(source):
+        match = TOKEN_REGEX.match(source, position)
+        if match is None:
+            raise RuleSyntaxError("token recognition error at: '%s'" % source[position], line, position - line_start)
+
+        kind = match.lastgroup
+        text = match.group(kind)
+        column = position - line_start
+
+        if kind == 'identifier' and text.lower() in KEYWORDS:
+            kind = 'keyword'
+            text = text.lower()
+
+        if kind not in ['whitespace', 'comment']:
+            tokens.append((kind, text, line, column))
+
+        newlines = text.count('\n')
+        if newlines > 0:
+            line += newlines
+            line_start = position + text.rindex('\n') + 1
+        position = match.end()
+
+    tokens.append(('eof', '<EOF>', line, position - line_start))
+
+    return tokens
+
+
+class Parser(object):
+
+    def __init__(self, source):
+        self.tokens = tokenize(source)
+        self.index = 0
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+
+    def error(self, message, token=None):
+        if token is None:
+            token = self.peek()
+        raise RuleSyntaxError(message, token[2], token[3])
+
+    def check(self, kind, text=None, offset=0):
+        token = self.peek(offset)
+        return token[0] == kind and (text is None or token[1] == text)
+
+    def accept(self, kind, text=None):
+        if self.check(kind, text):
+            token = self.peek()
+            self.index += 1
+            return token
+        return None
+
+    def expect(self, kind, text=None):
+        token = self.accept(kind, text)
+        if token is None:
+            found = self.peek()
+            self.error("mismatched input '%s' expecting %s" % (found[1], "'%s'" % text if text else kind), found)
+        return token
+
+    def string(self):
+        return unescape(self.expect('string')[1][1:-1])
+
+    def identifier(self, allow_keyword=False):
+        if allow_keyword and self.check('keyword'):
+            return self.expect('keyword')[1]
+        token = self.expect('identifier')
+        return token[1].strip('`')
+
+    # rule "name" when <expression> then <statement>* end
+    def rule(self):
+        start = self.expect('keyword', 'rule')
+        node = {'type': 'rule', 'name': self.string(), 'line': start[2]}
+        self.expect('keyword', 'when')
+        node['when'] = self.expression()
+        self.expect('keyword', 'then')
+        node['then'] = []
+        while not self.check('keyword', 'end'):
+            if self.check('eof'):
+                self.error("missing 'end' at '<EOF>'")
+            statement = self.statement()
+            if statement is not None:
+                node['then'].append(statement)
+        self.expect('keyword', 'end')
+        return node
+
+    # pipeline "name" (stage <n> match (all|either|pass) (rule "name" ;?)*)+ end
+    def pipeline(self):
+        self.expect('keyword', 'pipeline')
+        node = {'type': 'pipeline', 'name': self.string(), 'stages': []}
+        while self.check('keyword', 'stage'):
+            self.expect('keyword', 'stage')
+            negative = self.accept('operator', '-') is not None
+            stage = int(self.expect('integer')[1], 0)
+            self.expect('keyword', 'match')
+            modifier = self.peek()
+            if not (modifier[0] == 'keyword' and modifier[1] in ['all', 'either', 'pass']):
+                self.error("mismatched input '%s' expecting {'all', 'either', 'pass'}" % modifier[1], modifier)
+            self.index += 1
+            rules = []
+            while self.accept('keyword', 'rule'):
+                rules.append(self.string())
+                self.accept('operator', ';')
+            node['stages'].append({'stage': -stage if negative else stage, 'match': modifier[1], 'rules': rules})
+        if len(node['stages']) == 0:
+            self.error("missing 'stage' at '%s'" % self.peek()[1])
+        self.expect('keyword', 'end')
+        return node
+
+    def statement(self):
+        if self.accept('operator', ';'):
+            return None
+        if self.accept('keyword', 'let'):
+            name = self.identifier()
+            self.expect('operator', '=')
+            node = {'type': 'let', 'name': name, 'value': self.expression()}
+            self.expect('operator', ';')
+            return node
+        token = self.peek()
+        if not (token[0] == 'identifier' and self.check('operator', '(', 1)):
+            self.error("extraneous input '%s' expecting function call or 'let'" % token[1], token)
+        node = self.call()
+        self.expect('operator', ';')
+        return node
+
+    def expression(self):
+        return self.logical_or()
+
+    def logical_or(self):
+        node = self.logical_and()
+        while self.accept('keyword', 'or') or self.accept('operator', '||'):
+            node = {'type': 'or', 'left': node, 'right': self.logical_and()}
+        return node
+
+    def logical_and(self):
+        node = self.equality()
+        while self.accept('keyword', 'and') or self.accept('operator', '&&'):
+            node = {'type': 'and', 'left': node, 'right': self.equality()}
+        return node
+
+    def equality(self):
+        node = self.comparison()
+        while self.check('operator', '==') or self.check('operator', '!='):
+            operator = self.expect('operator')[1]
+            node = {'type': 'compare', 'operator': operator, 'left': node, 'right': self.comparison()}
+        return node
+
+    def comparison(self):
+        node = self.additive()
+        while self.peek()[0] == 'operator' and self.peek()[1] in ['<', '<=', '>', '>=']:
+            operator = self.expect('operator')[1]
+            node = {'type': 'compare', 'operator': operator, 'left': node, 'right': self.additive()}
+        return node
+
+    def additive(self):
+        node = self.multiplicative()
+        while self.peek()[0] == 'operator' and self.peek()[1] in ['+', '-']:
+            operator = self.expect('operator')[1]
+            node = {'type': 'arithmetic', 'operator': operator, 'left': node, 'right': self.multiplicative()}
+        return node
+
+    def multiplicative(self):
+        node = self.unary()
+        while self.peek()[0] == 'operator' and self.peek()[1] in ['*', '/', '%']:
+            operator = self.expect('operator')[1]
+            node = {'type': 'arithmetic', 'operator': operator, 'left': node, 'right': self.unary()}
+        return node
+
+    def unary(self):
+        if self.accept('keyword', 'not') or self.accept('operator', '!'):
+            return {'type': 'not', 'value': self.unary()}
+        if self.accept('operator', '-'):
+            return {'type': 'negate', 'value': self.unary()}
+        if self.accept('operator', '+'):
+            return self.unary()
+        return self.postfix()
+
+    def postfix(self):
+        node = self.primary()
+        while True:
+            if self.accept('operator', '.'):
+                node = {'type': 'field', 'object': node, 'name': self.identifier(allow_keyword=True)}
+            elif self.accept('operator', '['):
+                node = {'type': 'index', 'object': node, 'index': self.expression()}
+                self.expect('operator', ']')
+            else:
+                return node
+
+    def primary(self):
+        token = self.peek()
+        kind, text = token[0], token[1]
+
+        if kind == 'operator' and text == '(':
+            self.index += 1
+            node = self.expression()
+            self.expect('operator', ')')
+            return node
+        if kind == 'integer':
+            self.index += 1
+            return {'type': 'literal', 'value': int(text, 0)}
+        if kind == 'float':
+            self.index += 1
+            return {'type': 'literal', 'value': float(text)}
+        if kind == 'string':
+            return {'type': 'literal', 'value': self.string()}
+        if kind == 'char':
+            self.index += 1
+            return {'type': 'literal', 'value': unescape(text[1:-1])}
+        if kind == 'keyword' and text in ['true', 'false']:
+            self.index += 1
+            return {'type': 'literal', 'value': text == 'true'}
+        if kind == 'message':
+            self.index += 1
+            self.expect('operator', '.')
+            return {'type': 'message_field', 'name': self.identifier(allow_keyword=True)}
+        if kind == 'identifier':
+            if self.check('operator', '(', 1):
+                return self.call()
+            self.index += 1
+            return {'type': 'variable', 'name': text.strip('`')}
+        if kind == 'operator' and text == '[':
+            self.index += 1
+            items = []
+            if not self.check('operator', ']'):
+                items.append(self.expression())
+                while self.accept('operator', ','):
+                    items.append(self.expression())
+            self.expect('operator', ']')
+            return {'type': 'array', 'items': items}
+        if kind == 'operator' and text == '{':
+            self.index += 1
+            entries = []
+            if not self.check('operator', '}'):
+                entries.append(self.map_entry())
+                while self.accept('operator', ','):
+                    entries.append(self.map_entry())
+            self.expect('operator', '}')
+            return {'type': 'map', 'entries': entries}
+
+        self.error("mismatched input '%s' expecting expression" % text, token)
+
+    def map_entry(self):
+        key = self.identifier() if self.check('identifier') else self.string()
+        self.expect('operator', ':')
+        return (key, self.expression())
+
+    # name(arg, ...) or name(param: arg, ...), positional and named arguments can't be mixed
+    def call(self):
+        token = self.expect('identifier')
+        node = {'type': 'call', 'name': token[1], 'args': [], 'named': {}, 'line': token[2]}
+        self.expect('operator', '(')
+        if not self.check('operator', ')'):
+            while True:
+                if self.check('identifier') and self.check('operator', ':', 1):
+                    name = self.identifier()
+                    self.expect('operator', ':')
+                    if name in node['named']:
+                        self.error("duplicate argument '%s' in call to %s" % (name, node['name']))
+                    node['named'][name] = self.expression()
+                else:
+                    node['args'].append(self.expression())
+                if not self.accept('operator', ','):
+                    break
+            if len(node['args']) > 0 and len(node['named']) > 0:
+                self.error("mixed positional and named arguments in call to %s" % node['name'], token)
+        self.expect('operator', ')')
+        return node
+
+    def end(self):
+        token = self.peek()
+        if token[0] != 'eof':
+            self.error("extraneous input '%s' expecting <EOF>" % token[1], token)
+
+
+def parse_rule(source):
+    parser = Parser(source)
+    node = parser.rule()
+    parser.end()
+    return node
+
+
+def parse_pipeline(source):
+    parser = Parser(source)
+    node = parser.pipeline()
+    parser.end()
+    return node
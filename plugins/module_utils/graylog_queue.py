@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Deferred writes, queued in a local file and applied at once by graylog_flush.
+#
+# Every write to a stream or a pipeline makes Graylog reload its stream router or pipeline
+# interpreter. With a queue_file, the write actions append the request to the file instead
+# of sending it, and the queue is coalesced before it is applied:
+#
+#   * the updates of an object are merged, the values given last win
+#   * an object created and deleted in the same queue is never sent, nor are the writes
+#     that refer to it
+#   * a delete drops the other writes to the same object, and those below it, such as its rules
+#   * of several set requests (pause/resume, connections) only the last one is kept
+#
+# An object created in the queue has no id yet, its create returns a placeholder that later
+# tasks use as the id. Placeholders are replaced by the real ids as the creates are applied.
+#
+# Updates only hold the values given to the module. When they are applied the object is read
+# first and left alone if it already has those values.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import fcntl
+import json
+import uuid
+from collections import OrderedDict
+
+from ansible.module_utils.six import string_types
+from ansible.module_utils.six.moves.urllib.parse import urlsplit
+
+
+QUEUED = "Queued"
+
+REF_PREFIX = "queued-"
+
+
+def is_ref(value):
+
+    return isinstance(value, string_types) and value.startswith(REF_PREFIX)
+
+
+def enqueue(module, kind, op, method, url, payload=None, ref=None, id_field='id', keys=None):
+
+    if op == 'create':
+        ref = REF_PREFIX + uuid.uuid4().hex[:12]
+
+    entry = {
+        'kind': kind,
+        'op': op,
+        'method': method,
+        'url': url,
+        'payload': payload,
+        'ref': ref
+    }
+    if op == 'create':
+        entry['id_field'] = id_field
+    if keys is not None:
+        entry['keys'] = keys
+
+    with open(module.params['queue_file'], 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    content = {'queued': True, 'op': op, 'id': ref}
+    content[id_field] = ref
+
+    return 202, QUEUED, json.dumps(content), url
+
+
+def read_entries(f):
+
+    f.seek(0)
+
+    return [json.loads(line) for line in f if line.strip() != ""]
+
+
+def write_entries(f, entries):
+
+    f.seek(0)
+    f.truncate()
+    for entry in entries:
+        f.write(json.dumps(entry, sort_keys=True) + "\n")
+    f.flush()
+
+
+def segments(url):
+
+    return urlsplit(url).path.split('/')
+
+
+def values(value):
+
+    # The strings of a payload, ids are always whole values
+    if isinstance(value, dict):
+        return [item for key in value for item in values(value[key])]
+    if isinstance(value, list):
+        return [item for element in value for item in values(element)]
+    if isinstance(value, string_types):
+        return [value]
+    return []
+
+
+def substitute(value, ids):
+
+    if isinstance(value, dict):
+        return dict((key, substitute(value[key], ids)) for key in value)
+    if isinstance(value, list):
+        return [substitute(element, ids) for element in value]
+    if isinstance(value, string_types):
+        return ids.get(value, value)
+    return value
+
+
+def targets(entry, refs):
+
+    return entry['ref'] in refs or len(refs.intersection(segments(entry['url']))) > 0
+
+
+def refers_to(entry, refs):
+
+    return targets(entry, refs) or len(refs.intersection(values(entry['payload']))) > 0
+
+
+def placeholders(entry):
+
+    # The placeholders an entry needs resolved before it can be sent, its own one aside for a create
+    used = set(segment for segment in segments(entry['url']) if is_ref(segment))
+    used.update(value for value in values(entry['payload']) if is_ref(value))
+    if entry['op'] != 'create' and is_ref(entry['ref']):
+        used.add(entry['ref'])
+
+    return used
+
+
+def order(entries):
+
+    # Moves the entries using a placeholder after the create defining it, the others keep their order
+    created = set(entry['ref'] for entry in entries if entry['op'] == 'create')
+    defined = set()
+    ordered = []
+    waiting = []
+
+    def ready(entry):
+        return len((placeholders(entry) & created) - defined) == 0
+
+    for entry in entries:
+        if not ready(entry):
+            waiting.append(entry)
+            continue
+        ordered.append(entry)
+        if entry['op'] == 'create':
+            defined.add(entry['ref'])
+        while True:
+            released = [queued for queued in waiting if ready(queued)]
+            if len(released) == 0:
+                break
+            for queued in released:
+                waiting.remove(queued)
+                ordered.append(queued)
+                if queued['op'] == 'create':
+                    defined.add(queued['ref'])
+
+    return ordered + waiting
+
+
+def under(entry, urls):
+
+    return len([url for url in urls if entry['url'].startswith(url + "/")]) > 0
+
+
+def coalesce(entries):
+
+    # Returns the entries to apply, every one after the creates of the placeholders it uses
+    objects = OrderedDict()
+    dropped_refs = set()
+
+    # Entries keep their queue position, a merged update the one of the write it was merged into
+    for position, entry in enumerate(entries):
+        ops = objects.setdefault((entry['kind'], entry['ref']), [])
+        last = ops[-1][1] if len(ops) > 0 else None
+
+        if entry['op'] == 'delete':
+            if len([queued for index, queued in ops if queued['op'] == 'create']) > 0:
+                dropped_refs.add(entry['ref'])
+                del ops[:]
+            else:
+                ops[:] = [(position, entry)]
+        elif entry['op'] == 'update' and last is not None and last['op'] in ['create', 'update']:
+            merged = dict(last)
+            merged['payload'] = dict(last['payload'] or {})
+            merged['payload'].update(entry['payload'] or {})
+            merged['merged'] = last.get('merged', 1) + 1
+            ops[-1] = (ops[-1][0], merged)
+        elif entry['op'] == 'set' and last is not None and last['op'] == 'set':
+            entry = dict(entry)
+            entry['merged'] = last.get('merged', 1) + 1
+            ops[-1] = (position, entry)
+        else:
+            ops.append((position, entry))
+
+    coalesced = [entry for position, entry in sorted(item for ops in objects.values() for item in ops)]
+
+    # The writes to an object that is never created go with it
+    while True:
+        dependents = [entry for entry in coalesced if refers_to(entry, dropped_refs)]
+        if len(dependents) == 0:
+            break
+        dropped_refs.update(entry['ref'] for entry in dependents if is_ref(entry['ref']))
+        coalesced = [entry for entry in coalesced if not refers_to(entry, dropped_refs)]
+
+    # As are the other writes to a deleted object, and the writes below it, deletes of its rules included
+    deletes = [entry for entry in coalesced if entry['op'] == 'delete']
+    deleted = set(entry['ref'] for entry in deletes)
+    deleted_urls = [entry['url'].rstrip('/') for entry in deletes]
+    coalesced = [entry for entry in coalesced if not under(entry, deleted_urls)
+                 and (entry['op'] == 'delete' or not targets(entry, deleted))]
+
+    return order(coalesced)
+
+
+def resolve(entry, ids):
+
+    # Replaces the placeholders of the applied creates by the real ids
+    entry = dict(entry)
+    entry['url'] = "/".join(ids.get(segment, segment) for segment in entry['url'].split('/'))
+    entry['payload'] = substitute(entry['payload'], ids)
+    entry['ref'] = ids.get(entry['ref'], entry['ref'])
+
+    return entry
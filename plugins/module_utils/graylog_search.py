@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Message searches against the Graylog universal search API.
+#
+# Offset pagination stops at the index.max_result_window of Elasticsearch (10000 by default),
+# so large result sets are walked by time instead: messages are sorted by timestamp, each
+# page starts at the timestamp of the last message of the previous one, and the messages
+# of that timestamp already returned are skipped. Pages are handed over as they arrive so
+# memory stays bounded by the page size.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import datetime
+import json
+import time
+
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url
+
+
+DOWNLOAD_CHUNK = 1048576
+
+
+def iso_time(value):
+
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + "%03dZ" % (value.microsecond // 1000)
+
+
+def time_range(range_seconds, from_time, to_time):
+
+    # A relative range is pinned to absolute times once, so that all the pages see the same window
+    if from_time is not None:
+        return from_time, to_time or iso_time(datetime.datetime.utcnow())
+
+    now = datetime.datetime.utcnow()
+    return iso_time(now - datetime.timedelta(seconds=range_seconds)), iso_time(now)
+
+
+def build_query(query, streams):
+
+    query = query or "*"
+    if streams:
+        query = "(%s) AND streams:(%s)" % (query, " OR ".join(streams))
+
+    return query
+
+
+def search(module, endpoint, headers, query, from_time, to_time, limit, offset=0, fields=None, timeout=60):
+
+    # Returns the search result and the round trip time in seconds
+    params = [('query', query), ('from', from_time), ('to', to_time), ('limit', limit), ('offset', offset),
+              ('sort', "timestamp:asc"), ('decorate', "false")]
+    if fields:
+        params.append(('fields', ",".join(fields)))
+
+    url = endpoint + "/api/search/universal/absolute?" + urlencode(params)
+
+    started = time.time()
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET', timeout=timeout)
+    content = response.read() if info['status'] == 200 else None
+    elapsed = time.time() - started
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info.get('body'))))
+
+    return json.loads(content), elapsed
+
+
+def paginate(module, endpoint, headers, query, from_time, to_time, page_size, limit=None, fields=None, timeout=60):
+
+    # Yields lists of messages in timestamp order
+    cursor = from_time
+    offset = 0
+    seen = set()
+    returned = 0
+
+    if fields:
+        # The cursor needs the id and timestamp of every message
+        fields = list(fields) + [field for field in ['_id', 'timestamp'] if field not in fields]
+
+    while limit is None or returned < limit:
+        size = page_size if limit is None else min(page_size, limit - returned + len(seen))
+        result, elapsed = search(module, endpoint, headers, query, cursor, to_time, size, offset, fields, timeout)
+        messages = [item['message'] for item in result.get('messages', [])]
+        if len(messages) == 0:
+            break
+
+        page = [message for message in messages if message.get('_id') not in seen]
+        if limit is not None:
+            page = page[:limit - returned]
+        if len(page) > 0:
+            returned += len(page)
+            yield page
+
+        last = messages[-1].get('timestamp')
+        if last == cursor:
+            # The whole page shares one timestamp, move through it by offset
+            offset += len(messages)
+            seen.update(message.get('_id') for message in messages)
+        else:
+            cursor = last
+            offset = 0
+            seen = set(message.get('_id') for message in messages if message.get('timestamp') == last)
+
+        if len(messages) < size:
+            break
+
+
+def download(module, url, headers, path, method='GET', data=None, timeout=600):
+
+    # Copies a streamed export response to path chunk by chunk, returns the number of bytes and lines
+    response, info = fetch_url(module=module, url=url, headers=headers, method=method, data=data, timeout=timeout)
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info.get('body'))))
+
+    size = 0
+    lines = 0
+    with open(path, 'wb') as f:
+        while True:
+            chunk = response.read(DOWNLOAD_CHUNK)
+            if not chunk:
+                break
+            f.write(chunk)
+            size += len(chunk)
+            lines += chunk.count(b'\n')
+
+    return size, lines
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Latency summaries of the timings the benchmark and test actions collect.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+def summarize(values):
+
+    # Latency summary, in milliseconds, of durations given in seconds
+    if len(values) == 0:
+        return None
+
+    ordered = sorted(values)
+
+    def at(ratio):
+        return round(ordered[min(len(ordered) - 1, int(ratio * len(ordered)))] * 1000, 3)
+
+    return {
+        'min': round(ordered[0] * 1000, 3),
+        'p50': at(0.5),
+        'p95': at(0.95),
+        'p99': at(0.99),
+        'max': round(ordered[-1] * 1000, 3),
+        'mean': round(sum(ordered) * 1000 / len(ordered), 3)
+    }
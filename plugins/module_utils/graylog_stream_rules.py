@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Stream rules as evaluated by the Graylog stream router.
+#
+# analyze() estimates what each stream costs the router and reports the patterns that make
+# it expensive: regexes that backtrack or scan the whole value, duplicate or redundant rules,
+# streams with identical predicates. Costs are relative units, an exact match being 1.
+#
+# route() evaluates the rules offline over a batch of messages the way the router does. Each
+# distinct rule is evaluated once per batch over the column of its field, regexes are compiled
+# once, and the result is a bitset of the matching messages that the streams combine with
+# & (AND) or | (OR).
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import re
+import time
+
+
+EXACT = 1
+REGEX = 2
+GREATER = 3
+SMALLER = 4
+PRESENCE = 5
+CONTAINS = 6
+ALWAYS_MATCH = 7
+MATCH_INPUT = 8
+
+RULE_TYPE_NAMES = {
+    EXACT: "exact",
+    REGEX: "regex",
+    GREATER: "greater",
+    SMALLER: "smaller",
+    PRESENCE: "presence",
+    CONTAINS: "contains",
+    ALWAYS_MATCH: "always_match",
+    MATCH_INPUT: "match_input"
+}
+
+RULE_COSTS = {
+    EXACT: 1,
+    REGEX: 5,
+    GREATER: 1,
+    SMALLER: 1,
+    PRESENCE: 1,
+    CONTAINS: 2,
+    ALWAYS_MATCH: 0,
+    MATCH_INPUT: 1
+}
+
+# A quantified group whose content is itself quantified, ie: (a+)+, (\w*\s?)*, (x{2,})+
+NESTED_QUANTIFIER_REGEX = re.compile(r'\((?:[^()\\]|\\.)*?(?<!\\)[+*}](?:[^()\\]|\\.)*\)[+*{]')
+
+REGEX_METACHARACTERS = re.compile(r'(?<!\\)[.^$*+?()\[\]{}|]|\\[dDwWsSbB]')
+
+
+class UnsupportedRegex(Exception):
+
+    def __init__(self, stream, rule, error):
+        super(UnsupportedRegex, self).__init__("stream %s (%s) rule %s: regex %s can't be evaluated locally, Python doesn't support it: %s"
+                                               % (stream.get('title'), stream.get('id'), rule.get('id'), rule.get('value'), error))
+        self.stream = stream
+        self.rule = rule
+
+
+def rule_key(rule):
+
+    return (rule.get('field'), int(rule.get('type', EXACT)), rule.get('value'), bool(rule.get('inverted', False)))
+
+
+def regex_issues(pattern):
+
+    # [(kind, extra cost, message)], Graylog runs Matcher.find() so patterns match anywhere in the value
+    # Graylog compiles Java regexes, a pattern Python rejects (\p{L}, possessive quantifiers) may still be valid
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return [('unchecked_regex', 0, "regex can't be checked locally, Python doesn't support it: %s" % e)]
+
+    issues = []
+
+    if NESTED_QUANTIFIER_REGEX.search(pattern):
+        issues.append(('catastrophic_backtracking', 100,
+                       "nested quantifiers can backtrack exponentially on values that almost match"))
+
+    wildcards = len(re.findall(r'(?<!\\)\.[*+]', pattern))
+    if pattern.startswith('.*') or pattern.startswith('^.*'):
+        issues.append(('leading_wildcard', 5, "a leading .* is implied by the partial match and only adds backtracking"))
+    elif wildcards > 1:
+        issues.append(('multiple_wildcards', 5 * (wildcards - 1), "%d .* wildcards backtrack polynomially" % wildcards))
+    elif not pattern.startswith('^') and not pattern.startswith('\\A'):
+        issues.append(('unanchored', 5, "unanchored regex is tried at every position of the value, anchor it with ^ if possible"))
+
+    # A literal only matches the same messages as an exact rule when fully anchored, and as a contains
+    # rule when not anchored at all, a prefix or suffix regex has no cheaper equivalent
+    starts = pattern.startswith('^')
+    ends = pattern.endswith('$')
+    body = pattern[1 if starts else 0:len(pattern) - 1 if ends else len(pattern)]
+    if REGEX_METACHARACTERS.search(body) is None and starts == ends:
+        issues.append(('literal_regex', 0, "regex without metacharacters, %s rule is cheaper"
+                       % ("an exact" if starts else "a contains")))
+
+    return issues
+
+
+def rule_cost(rule):
+
+    rule_type = int(rule.get('type', EXACT))
+    cost = RULE_COSTS.get(rule_type, 1)
+    issues = []
+    if rule_type == REGEX:
+        issues = regex_issues(rule.get('value') or "")
+        cost += sum([issue[1] for issue in issues])
+
+    return cost, issues
+
+
+def finding(stream, rule, kind, cost, message):
+
+    result = {'stream_id': stream.get('id'), 'stream': stream.get('title'), 'kind': kind, 'cost': cost, 'msg': message}
+    if rule is not None:
+        result['rule_id'] = rule.get('id')
+        result['field'] = rule.get('field')
+        result['type'] = RULE_TYPE_NAMES.get(int(rule.get('type', EXACT)), rule.get('type'))
+        result['value'] = rule.get('value')
+
+    return result
+
+
+def analyze(streams):
+
+    findings = []
+    costs = []
+    predicates = {}
+
+    for stream in streams:
+        rules = stream.get('rules') or []
+        stream_cost = 0
+        seen = {}
+        fields = {}
+
+        for rule in rules:
+            cost, issues = rule_cost(rule)
+            stream_cost += cost
+            for kind, extra, message in issues:
+                findings.append(finding(stream, rule, kind, cost, message))
+
+            key = rule_key(rule)
+            if key in seen:
+                findings.append(finding(stream, rule, 'duplicate_rule', cost, "same rule as %s" % seen[key].get('id')))
+            seen[key] = rule
+            fields.setdefault(rule.get('field'), []).append(rule)
+
+        # A presence rule is implied by any other positive rule on the same field when all must match
+        if stream.get('matching_type', 'AND') == 'AND':
+            for field, field_rules in fields.items():
+                positives = [rule for rule in field_rules if not rule.get('inverted') and int(rule.get('type', EXACT)) not in [PRESENCE, ALWAYS_MATCH, MATCH_INPUT]]
+                for rule in field_rules:
+                    if int(rule.get('type', EXACT)) == PRESENCE and not rule.get('inverted') and len(positives) > 0:
+                        findings.append(finding(stream, rule, 'redundant_rule', RULE_COSTS[PRESENCE],
+                                                "presence of %s is implied by the other rules on that field" % field))
+
+        regexes = [rule for rule in rules if int(rule.get('type', EXACT)) == REGEX and not rule.get('inverted')]
+        if stream.get('matching_type') == 'OR' and len(regexes) > 2:
+            findings.append(finding(stream, None, 'matching_type', sum([rule_cost(rule)[0] for rule in regexes]),
+                                    "%d regex rules in an OR stream, one alternation per field is evaluated once" % len(regexes)))
+        if len(rules) > 1 and len([rule for rule in rules if int(rule.get('type', EXACT)) == ALWAYS_MATCH]) > 0:
+            findings.append(finding(stream, None, 'matching_type', 0,
+                                    "with an always match rule in an OR stream the other rules are evaluated for nothing"
+                                    if stream.get('matching_type') == 'OR' else
+                                    "an always match rule does nothing next to other rules in an AND stream"))
+
+        predicate = (stream.get('matching_type', 'AND'), tuple(sorted([repr(key) for key in seen])))
+        if len(rules) > 0:
+            predicates.setdefault(predicate, []).append(stream)
+
+        costs.append({'id': stream.get('id'), 'title': stream.get('title'), 'rules': len(rules), 'cost': stream_cost,
+                      'disabled': stream.get('disabled', False)})
+
+    for same in predicates.values():
+        if len(same) > 1:
+            for stream in same[1:]:
+                findings.append(finding(stream, None, 'duplicate_stream', 0,
+                                        "same rules and matching type as stream %s (%s)" % (same[0].get('title'), same[0].get('id'))))
+
+    findings.sort(key=lambda item: item['cost'], reverse=True)
+    costs.sort(key=lambda item: item['cost'], reverse=True)
+
+    return {
+        'streams': len(streams),
+        'rules': sum([stream['rules'] for stream in costs]),
+        'total_cost': sum([stream['cost'] for stream in costs if not stream['disabled']]),
+        'stream_costs': costs,
+        'findings': findings
+    }
+
+
+def to_string(value):
+
+    # Field values as Java's toString() renders them
+    if value is None:
+        return None
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+
+    return "%s" % value
+
+
+def to_number(value):
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def bitset(flags):
+
+    # Message i is bit i
+    return int("".join(flags)[::-1] or "0", 2)
+
+
+def rule_flags(rule, strings, values):
+
+    rule_type = int(rule.get('type', EXACT))
+    inverted = bool(rule.get('inverted', False))
+    value = rule.get('value')
+    # A missing field doesn't match, so it matches the inverted rules, but for the numeric ones
+    hit, miss = ('0', '1') if inverted else ('1', '0')
+
+    if rule_type == ALWAYS_MATCH:
+        return ['1'] * len(strings)
+    if rule_type == PRESENCE:
+        return [miss if item is None else hit for item in strings]
+    if rule_type == EXACT or rule_type == MATCH_INPUT:
+        return [miss if item is None else (hit if item == value else miss) for item in strings]
+    if rule_type == CONTAINS:
+        return [miss if item is None else (hit if value in item else miss) for item in strings]
+    if rule_type == REGEX:
+        search = re.compile(value, re.DOTALL).search
+        return [miss if item is None else (hit if search(item) else miss) for item in strings]
+    if rule_type in [GREATER, SMALLER]:
+        limit = to_number(value)
+        numbers = [to_number(item) for item in values]
+        if limit is None:
+            return ['0'] * len(strings)
+        if rule_type == GREATER:
+            return ['0' if number is None else (hit if number > limit else miss) for number in numbers]
+        return ['0' if number is None else (hit if number < limit else miss) for number in numbers]
+
+    return ['0'] * len(strings)
+
+
+def popcount(bits):
+
+    return bin(bits).count('1')
+
+
+def first_bits(bits, count, offset):
+
+    flags = bin(bits)[2:][::-1]
+    positions = []
+    index = flags.find('1')
+    while index != -1 and len(positions) < count:
+        positions.append(offset + index)
+        index = flags.find('1', index + 1)
+
+    return positions
+
+
+class RoutingStats(object):
+
+    def __init__(self, streams, sample_matches):
+        self.streams = [stream for stream in streams]
+        self.sample_matches = sample_matches
+        self.messages = 0
+        self.default_stream = 0
+        self.unrouted = 0
+        self.matches = dict((stream.get('id') or stream.get('title'), 0) for stream in self.streams)
+        self.samples = dict((stream.get('id') or stream.get('title'), []) for stream in self.streams)
+        self.rules = {}
+        self.field_time = 0.0
+
+    def rule_stats(self, rule):
+        key = rule_key(rule)
+        if key not in self.rules:
+            self.rules[key] = {'field': rule.get('field'), 'type': RULE_TYPE_NAMES.get(key[1], key[1]), 'value': rule.get('value'),
+                               'inverted': key[3], 'streams': [], 'matches': 0, 'time': 0.0}
+        return self.rules[key]
+
+    def result(self):
+        rules = []
+        for stats in self.rules.values():
+            rule = dict(stats)
+            rule['time_ms'] = round(stats['time'] * 1000, 3)
+            rule['ns_per_message'] = int(stats['time'] * 1e9 / self.messages) if self.messages else 0
+            del rule['time']
+            rules.append(rule)
+        rules.sort(key=lambda rule: rule['time_ms'], reverse=True)
+
+        streams = []
+        for stream in self.streams:
+            id = stream.get('id') or stream.get('title')
+            streams.append({'id': stream.get('id'), 'title': stream.get('title'), 'matches': self.matches[id],
+                            'samples': self.samples[id]})
+        streams.sort(key=lambda stream: stream['matches'], reverse=True)
+
+        return {
+            'messages': self.messages,
+            'streams': streams,
+            'default_stream': self.default_stream,
+            'unrouted': self.unrouted,
+            'rules': rules,
+            'field_extraction_ms': round(self.field_time * 1000, 3)
+        }
+
+
+def route(streams, messages, stats):
+
+    # Routes one batch of messages (dicts) and adds the counts to stats
+    count = len(messages)
+    everything = (1 << count) - 1
+    offset = stats.messages
+    stats.messages += count
+
+    started = time.time()
+    values = {}
+    strings = {}
+    for stream in streams:
+        for rule in stream.get('rules') or []:
+            field = 'gl2_source_input' if int(rule.get('type', EXACT)) == MATCH_INPUT else rule.get('field')
+            if field not in values:
+                values[field] = [message.get(field) for message in messages]
+                strings[field] = [to_string(value) for value in values[field]]
+    stats.field_time += time.time() - started
+
+    results = {}
+    for stream in streams:
+        for rule in stream.get('rules') or []:
+            key = rule_key(rule)
+            rule_stat = stats.rule_stats(rule)
+            if stream.get('title') not in rule_stat['streams']:
+                rule_stat['streams'].append(stream.get('title'))
+            if key in results:
+                continue
+            field = 'gl2_source_input' if key[1] == MATCH_INPUT else key[0]
+            started = time.time()
+            try:
+                results[key] = bitset(rule_flags(rule, strings[field], values[field]))
+            except re.error as e:
+                raise UnsupportedRegex(stream, rule, e)
+            rule_stat['time'] += time.time() - started
+            rule_stat['matches'] += popcount(results[key])
+
+    routed = 0
+    removed = 0
+    for stream in streams:
+        rules = stream.get('rules') or []
+        if len(rules) == 0:
+            continue
+        if stream.get('matching_type', 'AND') == 'OR':
+            bits = 0
+            for rule in rules:
+                bits |= results[rule_key(rule)]
+        else:
+            bits = everything
+            for rule in rules:
+                bits &= results[rule_key(rule)]
+
+        id = stream.get('id') or stream.get('title')
+        stats.matches[id] += popcount(bits)
+        if len(stats.samples[id]) < stats.sample_matches:
+            stats.samples[id] += first_bits(bits, stats.sample_matches - len(stats.samples[id]), offset)
+        routed |= bits
+        if stream.get('remove_matches_from_default_stream'):
+            removed |= bits
+
+    stats.default_stream += count - popcount(removed)
+    stats.unrouted += count - popcount(routed)
+
+    return stats
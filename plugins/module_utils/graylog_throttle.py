@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Client side throttling of the requests sent to a Graylog cluster.
+#
+# rate_limit caps the requests per second to each cluster with a token bucket shared by all
+# the threads of the module run. With pressure_check, writes first look at the journal and
+# buffer utilization of the cluster nodes: above half the limits the rate is halved, above
+# the limits writes wait until the cluster has caught up, up to pressure_timeout seconds.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import threading
+import time
+
+
+PRESSURE_CACHE = 5
+
+PRESSURE_METRICS = [
+    "org.graylog2.journal.utilization-ratio",
+    "org.graylog2.buffers.input.usage",
+    "org.graylog2.buffers.input.size",
+    "org.graylog2.buffers.process.usage",
+    "org.graylog2.buffers.process.size",
+    "org.graylog2.buffers.output.usage",
+    "org.graylog2.buffers.output.size"
+]
+
+BUCKETS = {}
+
+PRESSURE = {}
+
+LOCK = threading.Lock()
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, slowdown=1.0):
+
+        while True:
+            with self.lock:
+                now = time.time()
+                rate = self.rate / slowdown
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / rate
+            time.sleep(wait)
+
+
+class Pressure(object):
+
+    def __init__(self):
+        self.checked = 0
+        self.journal = None
+        self.buffers = None
+        self.lock = threading.Lock()
+
+
+def gauge(metric):
+
+    if metric is None or metric['type'] != "gauge":
+        return None
+
+    return metric['metric']['value']
+
+
+def read_pressure(module, base, headers, send):
+
+    response, info = send(module, base + "/api/cluster/metrics/multiple", headers=headers, method='POST',
+                          data=json.dumps({'metrics': PRESSURE_METRICS}))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info.get('body'))))
+
+    journal = 0.0
+    buffers = 0.0
+    nodes = json.loads(response.read())
+    for node_id in nodes:
+        if nodes[node_id] is None:
+            continue
+        metrics = dict((metric['full_name'], metric) for metric in nodes[node_id]['metrics'])
+        ratio = gauge(metrics.get("org.graylog2.journal.utilization-ratio"))
+        if ratio is not None:
+            journal = max(journal, ratio * 100)
+        for buffer in ['input', 'process', 'output']:
+            usage = gauge(metrics.get("org.graylog2.buffers." + buffer + ".usage"))
+            size = gauge(metrics.get("org.graylog2.buffers." + buffer + ".size"))
+            if usage is not None and size:
+                buffers = max(buffers, 100.0 * usage / size)
+
+    return journal, buffers
+
+
+def pressure_slowdown(module, base, headers, send):
+
+    # Returns how much slower than rate_limit writes should go, waits while the cluster is over the limits
+    params = module.params
+    with LOCK:
+        pressure = PRESSURE.setdefault(base, Pressure())
+
+    deadline = time.time() + params.get('pressure_timeout', 300)
+    delay = 1
+    with pressure.lock:
+        while True:
+            if time.time() - pressure.checked > PRESSURE_CACHE:
+                pressure.journal, pressure.buffers = read_pressure(module, base, headers, send)
+                pressure.checked = time.time()
+
+            journal_ratio = pressure.journal / params.get('max_journal_utilization', 50)
+            buffer_ratio = pressure.buffers / params.get('max_buffer_utilization', 80)
+            if journal_ratio < 1 and buffer_ratio < 1:
+                return 2.0 if max(journal_ratio, buffer_ratio) >= 0.5 else 1.0
+
+            if time.time() + delay > deadline:
+                module.fail_json(msg="Fail: cluster under load for more than %d seconds, journal utilization %.1f%%, buffer utilization %.1f%%"
+                                 % (params.get('pressure_timeout', 300), pressure.journal, pressure.buffers))
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+            pressure.checked = 0
+
+
+def throttle(module, base, headers, method, send, reads):
+
+    params = getattr(module, 'params', {})
+
+    # The login request has no Authorization header yet and can't read the metrics
+    slowdown = 1.0
+    if params.get('pressure_check') and method not in reads and 'Authorization' in (headers or {}):
+        slowdown = pressure_slowdown(module, base, headers, send)
+
+    if params.get('rate_limit'):
+        with LOCK:
+            bucket = BUCKETS.setdefault(base, TokenBucket(params['rate_limit']))
+        bucket.take(slowdown)
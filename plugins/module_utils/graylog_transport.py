@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Fan-out of many Graylog API requests.
+#
+# fetch_urls() sends a list of requests with bounded concurrency and returns the
+# (response, info) pairs fetch_url() would have returned, in the same order, so the
+# callers keep their usual status checks and response.read() handling.
+#
+# Two transports are available:
+#   threads  fetch_url() in a thread pool, no extra dependency
+#   asyncio  one aiohttp session whose connection pool is shared by all the requests,
+#            for fan-outs to hundreds or thousands of objects
+#
+# An endpoint can also be the list of the nodes of one cluster. register_nodes() keeps a
+# NodePool for it and fetch_url(), which modules import instead of the Ansible one, sends
+# the requests addressed to the first node to the healthy ones: reads in turn, writes to
+# the leader, and on a connection error to the next healthy node. fetch_urls() does the same
+# with both transports. Node health is checked once per module run.
+#
+# Every request goes through throttle() first, see graylog_throttle.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils.basic import missing_required_lib
+from ansible.module_utils.six.moves.urllib.parse import urlsplit, urlunsplit
+from ansible.module_utils import urls
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_throttle import throttle
+
+try:
+    import asyncio
+    import aiohttp
+    HAS_AIOHTTP = True
+    AIOHTTP_IMPORT_ERROR = None
+except ImportError:
+    HAS_AIOHTTP = False
+    AIOHTTP_IMPORT_ERROR = traceback.format_exc()
+
+
+TRANSPORTS = ['threads', 'asyncio']
+
+HEALTH_TIMEOUT = 2
+
+READ_METHODS = ['GET', 'HEAD', 'OPTIONS']
+
+NODE_POOLS = {}
+
+
+class BufferedResponse(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class NodePool(object):
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.lock = threading.Lock()
+        self.healthy = None
+        self.leader = None
+        self.next = 0
+
+    def check_health(self, module, scheme):
+
+        # /api/system/lbstatus needs no authentication and answers DEAD on a node being shut down
+        def check(node):
+            response, info = urls.fetch_url(module=module, url=scheme + "://" + node + "/api/system/lbstatus",
+                                            timeout=HEALTH_TIMEOUT, method='GET')
+            return info['status'] == 200
+
+        executor = ThreadPoolExecutor(max_workers=len(self.nodes))
+        try:
+            alive = [result for result in executor.map(check, self.nodes)]
+        finally:
+            executor.shutdown(wait=True)
+
+        return [node for node, ok in zip(self.nodes, alive) if ok]
+
+    def find_leader(self, module, scheme, headers):
+
+        for node in self.healthy:
+            response, info = urls.fetch_url(module=module, url=scheme + "://" + node + "/api/system", headers=headers,
+                                            timeout=HEALTH_TIMEOUT, method='GET')
+            if info['status'] != 200:
+                continue
+            system = json.loads(response.read())
+            if system.get('is_leader', system.get('is_master')):
+                return node
+
+        return None
+
+    def candidates(self, module, scheme, headers, method):
+
+        with self.lock:
+            if self.healthy is None:
+                self.healthy = self.check_health(module, scheme)
+                # Nothing answered the health check, still try every node rather than none
+                if len(self.healthy) == 0:
+                    self.healthy = self.nodes[:]
+            # Unauthenticated requests (the session login) can't look up the leader, any node takes them
+            if method in READ_METHODS or 'Authorization' not in (headers or {}):
+                start = self.next % len(self.healthy)
+                self.next += 1
+                return self.healthy[start:] + self.healthy[:start]
+            if self.leader is None:
+                self.leader = self.find_leader(module, scheme, headers)
+            # No node claimed the leadership, try them in turn and look it up again on the next write
+            if self.leader is None:
+                return self.healthy[:]
+            return [self.leader] + [node for node in self.healthy if node != self.leader]
+
+    def mark_down(self, node):
+
+        with self.lock:
+            if node in self.healthy and len(self.healthy) > 1:
+                self.healthy.remove(node)
+            if self.leader == node:
+                self.leader = None
+
+    def fetch(self, module, url, headers=None, method='GET', data=None, timeout=10):
+
+        parts = urlsplit(url)
+        for node in self.candidates(module, parts.scheme, headers, method):
+            node_url = urlunsplit((parts.scheme, node) + tuple(parts[2:]))
+            response, info = urls.fetch_url(module=module, url=node_url, headers=headers, timeout=timeout, method=method, data=data)
+            if info['status'] != -1:
+                return response, info
+            self.mark_down(node)
+            # A write that timed out may have been applied, only retry it when the connection failed
+            if method not in READ_METHODS and 'timed out' in str(info.get('msg')):
+                return response, info
+
+        return response, info
+
+
+def register_nodes(endpoint):
+
+    # endpoint is a host, returned as is, or the list of the nodes of one cluster
+    if not isinstance(endpoint, (list, tuple)):
+        return endpoint
+
+    NODE_POOLS[endpoint[0]] = NodePool([node for node in endpoint])
+
+    return endpoint[0]
+
+
+def fetch_url(module, url, headers=None, method='GET', data=None, timeout=10):
+
+    parts = urlsplit(url)
+    throttle(module, parts.scheme + "://" + parts.netloc, headers, method, send, READ_METHODS)
+
+    return send(module, url, headers=headers, method=method, data=data, timeout=timeout)
+
+
+def send(module, url, headers=None, method='GET', data=None, timeout=10):
+
+    pool = NODE_POOLS.get(urlsplit(url).netloc)
+    if pool is None:
+        return urls.fetch_url(module=module, url=url, headers=headers, timeout=timeout, method=method, data=data)
+
+    return pool.fetch(module, url, headers=headers, method=method, data=data, timeout=timeout)
+
+
+def fetch_urls(module, requests, headers, concurrency=4, transport='threads', timeout=10):
+
+    # requests is a list of dicts with url, and optionally method (GET by default) and data
+    if len(requests) == 0:
+        return []
+
+    concurrency = max(1, concurrency)
+
+    if transport == 'asyncio':
+        if not HAS_AIOHTTP:
+            module.fail_json(msg=missing_required_lib('aiohttp'), exception=AIOHTTP_IMPORT_ERROR)
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(fetch_all(module, requests, headers, concurrency, timeout))
+        finally:
+            loop.close()
+
+    def fetch_one(request):
+        return fetch_url(module=module, url=request['url'], headers=headers, timeout=timeout,
+                         method=request.get('method', 'GET'), data=request.get('data'))
+
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(requests)))
+    try:
+        return [result for result in executor.map(fetch_one, requests)]
+    finally:
+        executor.shutdown(wait=True)
+
+
+async def fetch_all(module, requests, headers, concurrency, timeout):
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=None if module.params.get('validate_certs', True) else False)
+    session_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector, headers=headers, timeout=session_timeout) as session:
+
+        async def send_one(method, url, data):
+            try:
+                async with session.request(method, url, data=data) as response:
+                    body = await response.read()
+            except asyncio.TimeoutError as e:
+                return None, {'status': -1, 'msg': "Request failed: timed out %s" % e, 'url': url, 'body': ''}
+            except aiohttp.ClientError as e:
+                return None, {'status': -1, 'msg': "Request failed: %s" % e, 'url': url, 'body': ''}
+
+            info = {'status': response.status, 'url': str(response.url)}
+            if response.status >= 400:
+                info['msg'] = "HTTP Error %d: %s" % (response.status, response.reason)
+                # fetch_url() returns the error body as text, keep the callers' str(info['body']) readable
+                info['body'] = to_text(body, errors='surrogate_or_replace')
+            else:
+                info['msg'] = "OK (%d bytes)" % len(body)
+
+            return BufferedResponse(body), info
+
+        async def fetch_one(request):
+            async with semaphore:
+                url = request['url']
+                method = request.get('method', 'GET')
+                parts = urlsplit(url)
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, throttle, module, parts.scheme + "://" + parts.netloc,
+                                           headers, method, send, READ_METHODS)
+
+                pool = NODE_POOLS.get(parts.netloc)
+                if pool is None:
+                    return await send_one(method, url, request.get('data'))
+
+                # Same fail over as NodePool.fetch(), the health checks and leader lookup block so they run aside
+                nodes = await loop.run_in_executor(None, pool.candidates, module, parts.scheme, headers, method)
+                for node in nodes:
+                    response, info = await send_one(method, urlunsplit((parts.scheme, node) + tuple(parts[2:])), request.get('data'))
+                    if info['status'] != -1:
+                        return response, info
+                    pool.mark_down(node)
+                    if method not in READ_METHODS and 'timed out' in str(info.get('msg')):
+                        return response, info
+
+                return response, info
+
+        return await asyncio.gather(*[fetch_one(request) for request in requests])
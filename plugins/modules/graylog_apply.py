@@ -0,0 +1,628 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_apply
+short_description: Apply a whole Graylog desired state document
+description:
+    - Creates or updates index sets, streams, pipeline rules, pipelines, stream connections, roles and users
+      described in a single document.
+    - The current objects are fetched once, references by name (index set of a stream, streams and pipelines
+      of a connection) are resolved to IDs from that snapshot and from the objects created during the run.
+    - Object kinds are applied in dependency order (index sets before streams, rules before pipelines,
+      streams and pipelines before connections, roles before users). The objects of kinds that do not depend
+      on each other are applied at the same time by I(workers) parallel workers.
+    - Objects are matched by title (name for roles, username for users) and only written when they differ
+      from the desired state. Objects missing from the document are left untouched.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
+    required: false
+    type: raw
+  clusters:
+    description:
+      - Endpoints of several clusters, each a host or the list of the nodes of a cluster, used instead of
+        I(endpoint).
+      - The module runs the same action against every cluster concurrently, the results are then returned by
+        cluster in C(clusters) and the clusters that failed in C(failed_clusters).
+    required: false
+    type: list
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate
+    required: false
+    default: false
+    type: bool
+  rate_limit:
+    description:
+      - Maximum number of requests per second sent to the cluster, unlimited by default.
+    required: false
+    type: float
+  pressure_check:
+    description:
+      - Check the journal and buffer utilization of the cluster nodes before writing.
+      - Above half of I(max_journal_utilization) or I(max_buffer_utilization) writes go at half I(rate_limit),
+        above the limits they wait for the cluster to catch up.
+    required: false
+    default: false
+    type: bool
+  max_journal_utilization:
+    description:
+      - Journal utilization, in percent, above which writes wait when I(pressure_check) is enabled.
+    required: false
+    default: 50
+    type: int
+  max_buffer_utilization:
+    description:
+      - Input, process or output buffer utilization, in percent, above which writes wait when I(pressure_check)
+        is enabled.
+    required: false
+    default: 80
+    type: int
+  pressure_timeout:
+    description:
+      - Seconds to wait for the cluster to get under the limits before failing.
+    required: false
+    default: 300
+    type: int
+  state:
+    description:
+      - Desired state document, a dict with any of the keys C(index_sets), C(streams), C(rules), C(pipelines),
+        C(connections), C(roles) and C(users), each a list of objects in the format of the Graylog API.
+      - Streams reference their index set with C(index_set) (title) or C(index_set_id).
+      - Connections are C(stream) (title) and C(pipelines) (list of titles).
+      - User passwords are only used when the user is created.
+    required: true
+    type: dict
+  workers:
+    description:
+      - Maximum number of objects applied at the same time.
+    required: false
+    default: 4
+    type: int
+'''
+
+EXAMPLES = '''
+- graylog_apply:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    workers: 8
+    state:
+      index_sets:
+        - title: "windows"
+          index_prefix: "windows"
+          shards: 2
+      streams:
+        - title: "Windows"
+          index_set: "windows"
+          matching_type: "AND"
+          rules:
+            - { field: "source_type", type: 1, value: "windows", inverted: false }
+      rules:
+        - title: "tag_windows"
+          source: |
+            rule "tag_windows"
+            when has_field("winlogbeat_log_name")
+            then set_field("os", "windows");
+            end
+      pipelines:
+        - title: "Windows processing"
+          source: |
+            pipeline "Windows processing"
+            stage 0 match either
+            rule "tag_windows"
+            end
+      connections:
+        - stream: "Windows"
+          pipelines: [ "Windows processing" ]
+      roles:
+        - name: "windows_readers"
+          permissions: [ "streams:read" ]
+      users:
+        - username: "jdoe"
+          full_name: "John Doe"
+          email: "jdoe@mydomain.com"
+          password: "{{ jdoe_password }}"
+          roles: [ "Reader", "windows_readers" ]
+'''
+
+RETURN = '''
+json:
+  description: Applied levels, per object results and the IDs of all the objects by kind and name
+  returned: always
+  type: dict
+  sample: {
+    "levels": [["index_sets", "rules", "roles"], ["streams", "pipelines", "users"], ["connections"]],
+    "results": [{"kind": "streams", "name": "Windows", "operation": "create", "id": "5bc7666089675c7f7d7f08d7"}],
+    "ids": {"streams": {"Windows": "5bc7666089675c7f7d7f08d7"}}
+  }
+changed:
+  description: Whether at least one object was created or updated
+  returned: always
+  type: bool
+'''
+
+
+# import module snippets
+import json
+import base64
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_clusters import run_on_clusters
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, fetch_urls
+
+
+# kind: (API path, key of the list in the GET response, name attribute, kinds it references)
+KINDS = {
+    'index_sets': ("/api/system/indices/index_sets", 'index_sets', 'title', []),
+    'streams': ("/api/streams", 'streams', 'title', ['index_sets']),
+    'rules': ("/api/system/pipelines/rule", None, 'title', []),
+    'pipelines': ("/api/system/pipelines/pipeline", None, 'title', ['rules']),
+    'connections': ("/api/system/pipelines/connections", None, 'stream_id', ['streams', 'pipelines']),
+    'roles': ("/api/roles", 'roles', 'name', []),
+    'users': ("/api/users", 'users', 'username', ['roles']),
+}
+
+INDEX_SET_DEFAULTS = {
+    'index_analyzer': "standard",
+    'shards': 4,
+    'replicas': 1,
+    'field_type_refresh_interval': 5000,
+    'rotation_strategy_class': "org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategy",
+    'rotation_strategy': {'type': "org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategyConfig", 'rotation_period': "P1D"},
+    'retention_strategy_class': "org.graylog2.indexer.retention.strategies.DeletionRetentionStrategy",
+    'retention_strategy': {'type': "org.graylog2.indexer.retention.strategies.DeletionRetentionStrategyConfig", 'max_number_of_indices': 14},
+    'index_optimization_max_num_segments': 1,
+    'index_optimization_disabled': False,
+    'writable': True
+}
+
+INDEX_SET_KEYS = ['title', 'description', 'index_analyzer', 'shards', 'replicas', 'field_type_refresh_interval',
+                  'rotation_strategy_class', 'rotation_strategy', 'retention_strategy_class', 'retention_strategy',
+                  'index_optimization_max_num_segments', 'index_optimization_disabled', 'writable']
+
+STREAM_KEYS = ['title', 'description', 'matching_type', 'remove_matches_from_default_stream', 'index_set_id']
+
+USER_KEYS = ['full_name', 'email', 'roles', 'permissions', 'timezone']
+
+
+def build_levels(kinds):
+
+    # Kahn's algorithm over the kinds present in the document, references to absent kinds
+    # are resolved from the snapshot and don't order anything
+    pending = dict((kind, set(KINDS[kind][3]) & set(kinds)) for kind in kinds)
+    levels = []
+    while len(pending) > 0:
+        level = sorted([kind for kind in pending if len(pending[kind]) == 0])
+        levels.append(level)
+        for kind in level:
+            del pending[kind]
+        for kind in pending:
+            pending[kind] -= set(level)
+
+    return levels
+
+
+def request(module, endpoint, headers, method, path, payload=None):
+
+    url = endpoint + path
+    data = None
+    if payload is not None:
+        data = module.jsonify(payload)
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), timeout=20, method=method, data=data)
+
+    if info['status'] < 200 or info['status'] >= 300:
+        raise Exception("%s %s: Status: %s, Message: %s" % (method, url, info['msg'], info.get('body')))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+    except AttributeError:
+        content = ""
+
+    if content == "":
+        return None
+
+    return json.loads(content)
+
+
+def snapshot(module, endpoint, headers, kinds):
+
+    requests = [{'url': endpoint + KINDS[kind][0]} for kind in kinds]
+    responses = fetch_urls(module, requests, json.loads(headers), module.params['workers'])
+
+    current = {}
+    for kind, (response, info) in zip(kinds, responses):
+        if info['status'] != 200:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+        objects = json.loads(to_text(response.read(), errors='surrogate_or_strict'))
+        if KINDS[kind][1] is not None:
+            objects = objects[KINDS[kind][1]]
+        current[kind] = dict((obj[KINDS[kind][2]], obj) for obj in objects)
+
+    return current
+
+
+class Context(object):
+
+    def __init__(self, module, endpoint, headers, current):
+        self.module = module
+        self.endpoint = endpoint
+        self.headers = headers
+        self.current = current
+        self.lock = threading.Lock()
+        self.ids = {}
+        for kind in current:
+            if kind == 'connections':
+                continue
+            self.ids[kind] = {}
+            for name in current[kind]:
+                self.ids[kind][name] = current[kind][name].get('id', name)
+
+    def resolve(self, kind, name):
+        with self.lock:
+            if name not in self.ids.get(kind, {}):
+                raise Exception("%s %s not found" % (kind, name))
+            return self.ids[kind][name]
+
+    def register(self, kind, name, id):
+        # Creates only planned in check mode have no id, their name stands in for it
+        if id is None:
+            id = "(planned) " + name
+        with self.lock:
+            self.ids.setdefault(kind, {})[name] = id
+
+    def request(self, method, path, payload=None):
+        if self.module.check_mode:
+            return None
+        return request(self.module, self.endpoint, self.headers, method, path, payload)
+
+
+def differs(desired, current, keys):
+
+    for key in keys:
+        if key not in desired:
+            continue
+        value = desired[key]
+        current_value = current.get(key)
+        if isinstance(value, list) and isinstance(current_value, list):
+            if sorted(value, key=json.dumps) != sorted(current_value, key=json.dumps):
+                return True
+        elif value != current_value:
+            return True
+
+    return False
+
+
+def apply_index_set(ctx, desired):
+
+    current = ctx.current['index_sets'].get(desired['title'])
+
+    if current is None:
+        payload = dict(INDEX_SET_DEFAULTS)
+        payload.update(desired)
+        payload.setdefault('creation_date', datetime.datetime.utcnow().isoformat() + 'Z')
+        created = ctx.request('POST', KINDS['index_sets'][0], payload)
+        ctx.register('index_sets', desired['title'], created['id'] if created else None)
+        return 'create'
+
+    if not differs(desired, current, INDEX_SET_KEYS):
+        return None
+
+    payload = dict((key, current.get(key)) for key in INDEX_SET_KEYS)
+    payload.update(dict((key, desired[key]) for key in INDEX_SET_KEYS if key in desired))
+    ctx.request('PUT', KINDS['index_sets'][0] + "/" + current['id'], payload)
+    return 'update'
+
+
+def stream_rule_key(rule):
+
+    return json.dumps([rule.get('field'), int(rule.get('type', 1)), rule.get('value'), bool(rule.get('inverted', False))])
+
+
+def apply_stream(ctx, desired):
+
+    desired = dict(desired)
+    if 'index_set' in desired:
+        desired['index_set_id'] = ctx.resolve('index_sets', desired.pop('index_set'))
+    rules = desired.pop('rules', None)
+
+    current = ctx.current['streams'].get(desired['title'])
+
+    if current is None:
+        if 'index_set_id' not in desired:
+            default = [obj for obj in ctx.current['index_sets'].values() if obj.get('default')] if 'index_sets' in ctx.current else []
+            if len(default) == 0:
+                raise Exception("stream %s has no index set and no default index set was found" % desired['title'])
+            desired['index_set_id'] = default[0]['id']
+        payload = dict(desired)
+        payload['rules'] = rules or []
+        created = ctx.request('POST', KINDS['streams'][0], payload)
+        stream_id = created['stream_id'] if created else None
+        ctx.register('streams', desired['title'], stream_id)
+        # Streams are created paused
+        ctx.request('POST', KINDS['streams'][0] + "/" + str(stream_id) + "/resume")
+        return 'create'
+
+    operation = None
+    if differs(desired, current, STREAM_KEYS):
+        payload = dict((key, current.get(key)) for key in STREAM_KEYS)
+        payload.update(desired)
+        ctx.request('PUT', KINDS['streams'][0] + "/" + current['id'], payload)
+        operation = 'update'
+
+    if rules is not None:
+        current_rules = dict((stream_rule_key(rule), rule) for rule in current.get('rules') or [])
+        desired_rules = dict((stream_rule_key(rule), rule) for rule in rules)
+        for key in sorted(set(desired_rules) - set(current_rules)):
+            ctx.request('POST', KINDS['streams'][0] + "/" + current['id'] + "/rules", desired_rules[key])
+            operation = 'update'
+        for key in sorted(set(current_rules) - set(desired_rules)):
+            ctx.request('DELETE', KINDS['streams'][0] + "/" + current['id'] + "/rules/" + current_rules[key]['id'])
+            operation = 'update'
+
+    return operation
+
+
+def apply_source(ctx, kind, desired):
+
+    current = ctx.current[kind].get(desired['title'])
+
+    if current is None:
+        created = ctx.request('POST', KINDS[kind][0], desired)
+        ctx.register(kind, desired['title'], created['id'] if created else None)
+        return 'create'
+
+    if not differs(desired, current, ['title', 'description', 'source']):
+        return None
+
+    payload = dict((key, current.get(key)) for key in ['title', 'description', 'source'])
+    payload.update(desired)
+    ctx.request('PUT', KINDS[kind][0] + "/" + current['id'], payload)
+    return 'update'
+
+
+def apply_connection(ctx, desired):
+
+    stream_id = ctx.resolve('streams', desired['stream'])
+    pipeline_ids = sorted([ctx.resolve('pipelines', name) for name in desired.get('pipelines') or []])
+
+    current = ctx.current['connections'].get(stream_id)
+    if current is not None and sorted(current['pipeline_ids']) == pipeline_ids:
+        return None
+
+    ctx.request('POST', KINDS['connections'][0] + "/to_stream", {'stream_id': stream_id, 'pipeline_ids': pipeline_ids})
+    return 'update' if current is not None else 'create'
+
+
+def apply_role(ctx, desired):
+
+    current = ctx.current['roles'].get(desired['name'])
+
+    if current is None:
+        payload = {'read_only': False, 'permissions': []}
+        payload.update(desired)
+        ctx.request('POST', KINDS['roles'][0], payload)
+        ctx.register('roles', desired['name'], desired['name'])
+        return 'create'
+
+    if not differs(desired, current, ['description', 'permissions', 'read_only']):
+        return None
+
+    payload = dict((key, current.get(key)) for key in ['name', 'description', 'permissions', 'read_only'])
+    payload.update(desired)
+    ctx.request('PUT', KINDS['roles'][0] + "/" + desired['name'], payload)
+    return 'update'
+
+
+def apply_user(ctx, desired):
+
+    for role in desired.get('roles') or []:
+        ctx.resolve('roles', role)
+
+    current = ctx.current['users'].get(desired['username'])
+
+    if current is None:
+        payload = {'timezone': "UTC", 'permissions': []}
+        payload.update(desired)
+        ctx.request('POST', KINDS['users'][0], payload)
+        ctx.register('users', desired['username'], desired['username'])
+        return 'create'
+
+    if not differs(desired, current, USER_KEYS):
+        return None
+
+    payload = dict((key, desired[key]) for key in USER_KEYS if key in desired)
+    ctx.request('PUT', KINDS['users'][0] + "/" + desired['username'], payload)
+    return 'update'
+
+
+def apply_object(ctx, kind, desired):
+
+    name = desired.get(KINDS[kind][2], desired.get('stream'))
+    result = {'kind': kind, 'name': name}
+
+    try:
+        if kind == 'index_sets':
+            result['operation'] = apply_index_set(ctx, desired)
+        elif kind == 'streams':
+            result['operation'] = apply_stream(ctx, desired)
+        elif kind in ['rules', 'pipelines']:
+            result['operation'] = apply_source(ctx, kind, desired)
+        elif kind == 'connections':
+            result['operation'] = apply_connection(ctx, desired)
+        elif kind == 'roles':
+            result['operation'] = apply_role(ctx, desired)
+        elif kind == 'users':
+            result['operation'] = apply_user(ctx, desired)
+    except Exception as e:
+        result['operation'] = 'failed'
+        result['msg'] = str(e)
+
+    if kind in ctx.ids and name in ctx.ids[kind]:
+        result['id'] = ctx.ids[kind][name]
+
+    return result
+
+
+def apply(module, endpoint, headers):
+
+    document = module.params['state']
+    for kind in document:
+        if kind not in KINDS:
+            module.fail_json(msg="Fail: unknown object kind %s, expected one of %s" % (kind, ", ".join(sorted(KINDS))))
+
+    kinds = [kind for kind in KINDS if document.get(kind)]
+    levels = build_levels(kinds)
+
+    # Kinds referenced by the document but not managed by it are still needed to resolve names
+    needed = set(kinds)
+    for kind in kinds:
+        needed.update(KINDS[kind][3])
+    if 'connections' in needed:
+        needed.update(['streams', 'pipelines'])
+    ctx = Context(module, endpoint, headers, snapshot(module, endpoint, headers, sorted(needed)))
+
+    results = []
+    executor = ThreadPoolExecutor(max_workers=max(1, module.params['workers']))
+    try:
+        for level in levels:
+            jobs = [(kind, desired) for kind in level for desired in document[kind]]
+            level_results = [result for result in executor.map(lambda job: apply_object(ctx, job[0], job[1]), jobs)]
+            results.extend(level_results)
+            # Later levels reference the objects of this one, stop at the first failing level
+            if len([result for result in level_results if result['operation'] == 'failed']) > 0:
+                break
+    finally:
+        executor.shutdown(wait=True)
+
+    return {'levels': levels, 'results': results, 'ids': ctx.ids}
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def run(module, endpoint):
+
+    graylog_user = module.params['graylog_user']
+    graylog_password = module.params['graylog_password']
+    allow_http = module.params['allow_http']
+
+    if allow_http == True:
+      endpoint = "http://" + endpoint
+    else:
+      endpoint = "https://" + endpoint
+
+    api_token = get_token(module, endpoint, graylog_user, graylog_password)
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+    js = apply(module, endpoint, headers)
+
+    uresp = {}
+    uresp['json'] = js
+    uresp['changed'] = len([result for result in js['results'] if result['operation'] in ['create', 'update']]) > 0
+    uresp['url'] = endpoint
+
+    failed = [result for result in js['results'] if result['operation'] == 'failed']
+    if len(failed) > 0:
+        module.fail_json(msg="Fail: %d object(s) could not be applied" % len(failed), **uresp)
+
+    return uresp
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            clusters=dict(type='list'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            rate_limit=dict(type='float'),
+            pressure_check=dict(type='bool', default=False),
+            max_journal_utilization=dict(type='int', default=50),
+            max_buffer_utilization=dict(type='int', default=80),
+            pressure_timeout=dict(type='int', default=300),
+            state=dict(type='dict', required=True),
+            workers=dict(type='int', default=4)
+        ),
+        mutually_exclusive=[['endpoint', 'clusters']],
+        supports_check_mode=True
+    )
+
+    run_on_clusters(module, run)
+
+
+if __name__ == '__main__':
+    main()
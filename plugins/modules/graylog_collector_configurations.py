@@ -20,8 +20,10 @@ options:
   endpoint:
     description:
       - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
   graylog_user:
     description:
       - Graylog privileged user username.
@@ -32,6 +34,12 @@ options:
       - Graylog privileged user password.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -44,12 +52,44 @@ options:
     required: false
     default: false
     type: bool      
+  rate_limit:
+    description:
+      - Maximum number of requests per second sent to the cluster, unlimited by default.
+    required: false
+    type: float
+  pressure_check:
+    description:
+      - Check the journal and buffer utilization of the cluster nodes before writing.
+      - Above half of I(max_journal_utilization) or I(max_buffer_utilization) writes go at half I(rate_limit),
+        above the limits they wait for the cluster to catch up.
+    required: false
+    default: false
+    type: bool
+  max_journal_utilization:
+    description:
+      - Journal utilization, in percent, above which writes wait when I(pressure_check) is enabled.
+    required: false
+    default: 50
+    type: int
+  max_buffer_utilization:
+    description:
+      - Input, process or output buffer utilization, in percent, above which writes wait when I(pressure_check)
+        is enabled.
+    required: false
+    default: 80
+    type: int
+  pressure_timeout:
+    description:
+      - Seconds to wait for the cluster to get under the limits before failing.
+    required: false
+    default: 300
+    type: int
   action:
     description:
       - Action to take against collector configuration API.
     required: false
     default: list_configurations
-    choices: [ list_configurations, query_collector_configurations ]
+    choices: [ list_configurations, query_collector_configurations, update_snippet, update_snippets ]
     type: str
   configuration_id:
     description:
@@ -81,6 +121,36 @@ options:
       - Snippet backend, ex: winlogbeat, filebeat, nxlog
     required: false
     type: str
+  snippets:
+    description:
+      - List of snippets to update with action update_snippets.
+      - Each item needs C(configuration_name), C(snippet_name) and C(snippet_source), C(backend) is optional.
+      - All configurations are fetched once, and a snippet is only sent when the SHA-256 of
+        C(snippet_source) differs from the SHA-256 of the snippet currently stored in Graylog.
+    required: false
+    type: list
+  fingerprint_file:
+    description:
+      - Local JSON file recording, by endpoint, the SHA-256 of every snippet applied with action update_snippets.
+      - Snippets are always compared with the current ones, those changed outside of Ansible since they were last
+        applied are returned with C(drifted) set.
+    required: false
+    type: path
+  concurrency:
+    description:
+      - Maximum number of snippet updates sent at the same time with action update_snippets.
+    required: false
+    default: 4
+    type: int
+  transport:
+    description:
+      - How the concurrent requests of action update_snippets are sent.
+      - C(threads) uses a thread pool, C(asyncio) shares one connection pool between all the requests and
+        requires the aiohttp python library.
+    required: false
+    default: threads
+    choices: [ threads, asyncio ]
+    type: str
 '''
 
 EXAMPLES = '''
@@ -110,6 +180,23 @@ EXAMPLES = '''
      snippet_source: |
         # filebeat or winlog beat source here
    register: configuration
+
+# Update many snippets, only the ones whose content changed are sent
+- graylog_collector_configurations:
+    action: update_snippets
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    concurrency: 8
+    fingerprint_file: "{{ playbook_dir }}/.graylog-snippets.json"
+    snippets:
+      - configuration_name: "windows-collector-configuration"
+        snippet_name: "client-x"
+        snippet_source: "{{ lookup('template', 'client-x.yml.j2') }}"
+      - configuration_name: "linux-collector-configuration"
+        snippet_name: "client-y"
+        backend: "filebeat"
+        snippet_source: "{{ lookup('template', 'client-y.yml.j2') }}"
 '''
 
 RETURN = '''
@@ -117,6 +204,10 @@ json:
   description: The JSON response from the Graylog API
   returned: always
   type: str
+changed:
+  description: Whether at least one snippet was updated (action update_snippets only)
+  returned: when action is update_snippets
+  type: bool
 status:
   description: The HTTP status code from the request
   returned: always
@@ -133,8 +224,11 @@ url:
 # import module snippets
 import json
 import base64
+import hashlib
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_fingerprint import UNCHANGED, load_state, save_state
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import TRANSPORTS, fetch_url, fetch_urls, register_nodes
 
 
 def list_configurations(module, configuration_url, headers, configuration_id, query):
@@ -241,8 +335,126 @@ def update_snippet(module, configuration_url, headers, configuration_id, snippet
     return info['status'], info['msg'], content, url
 
 
+def snippet_hash(source):
+
+    if source is None:
+        source = ""
+
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def snippet_key(configuration_url, item):
+
+    # Fingerprint file key, the endpoint is part of the url so several clusters can share the file
+    return "/".join([configuration_url, item['configuration_name'], item['snippet_name']])
+
+
+def update_snippets(module, configuration_url, headers):
+
+    url = configuration_url
+
+    state = load_state(module.params['fingerprint_file'])
+
+    unchanged = []
+    snippets = module.params['snippets']
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        configurations = json.loads(content)['configurations']
+    except AttributeError:
+        content = info.pop('body', '')
+        configurations = []
+
+    configurations_by_name = {}
+    for configuration in configurations:
+        configurations_by_name[configuration['name']] = configuration
+
+    # The configuration list only carries snippets on recent servers, fetch the configurations otherwise
+    missing = []
+    for item in snippets:
+        configuration = configurations_by_name.get(item['configuration_name'])
+        if configuration is None:
+            module.fail_json(msg="Fail: collector configuration %s not found" % item['configuration_name'])
+        if 'snippets' not in configuration and configuration not in missing:
+            missing.append(configuration)
+
+    requests = [{'url': "/".join([configuration_url, configuration['id']])} for configuration in missing]
+    responses = fetch_urls(module, requests, json.loads(headers), module.params['concurrency'], module.params['transport'])
+    for configuration, (response, info) in zip(missing, responses):
+        if info['status'] != 200:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+        configuration['snippets'] = json.loads(to_text(response.read(), errors='surrogate_or_strict'))['snippets']
+
+    pending = []
+    for item in snippets:
+        configuration = configurations_by_name[item['configuration_name']]
+
+        current = None
+        for snippet in configuration['snippets'] or []:
+            if snippet['name'] == item['snippet_name']:
+                current = snippet
+                break
+        if current is None:
+            module.fail_json(msg="Fail: snippet %s not found in collector configuration %s" % (item['snippet_name'], item['configuration_name']))
+
+        desired_hash = snippet_hash(item['snippet_source'])
+        result = {
+            'configuration_name': item['configuration_name'],
+            'snippet_name': item['snippet_name'],
+            'sha256': desired_hash
+        }
+
+        # The snippet was changed outside of Ansible since it was last applied
+        recorded = state.get(snippet_key(configuration_url, item))
+        result['drifted'] = recorded is not None and recorded != snippet_hash(current.get('snippet'))
+
+        if desired_hash == snippet_hash(current.get('snippet')) and item.get('backend') in [None, current.get('backend')]:
+            unchanged.append(result)
+            continue
+
+        payload = {}
+        payload['name'] = item['snippet_name']
+        payload['backend'] = item.get('backend') or current.get('backend')
+        payload['snippet'] = item['snippet_source']
+
+        result['url'] = "/".join([configuration_url, configuration['id'], "snippets", current['snippet_id']])
+        pending.append((result, {'url': result['url'], 'method': 'PUT', 'data': module.jsonify(payload)}))
+
+    responses = fetch_urls(module, [request for result, request in pending], json.loads(headers),
+                           module.params['concurrency'], module.params['transport'])
+
+    updated = []
+    for (result, request), (response, info) in zip(pending, responses):
+        result['status'] = info['status']
+        if info['status'] != 202:
+            result['msg'] = "Status: " + str(info['msg']) + ", Message: " + str(info.get('body'))
+        updated.append(result)
+
+    failed = [result for result in updated if result['status'] != 202]
+    if len(failed) > 0:
+        module.fail_json(msg="Fail: %d snippet update(s) failed" % len(failed), failed=failed, updated=updated)
+
+    if module.params['fingerprint_file'] is not None:
+        for result in updated + unchanged:
+            state[snippet_key(configuration_url, result)] = result['sha256']
+        save_state(module.params['fingerprint_file'], state)
+
+    content = module.jsonify({'updated': updated, 'unchanged': unchanged})
+
+    return 200, "OK", content, url
+
+
 def get_token(module, endpoint, username, password):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -274,23 +486,33 @@ def get_token(module, endpoint, username, password):
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            endpoint=dict(type='str'),
+            endpoint=dict(type='raw'),
             graylog_user=dict(type='str'),
             graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
             allow_http=dict(type='bool', required=False, default=False),
             validate_certs=dict(type='bool', required=False, default=True),
+            rate_limit=dict(type='float'),
+            pressure_check=dict(type='bool', default=False),
+            max_journal_utilization=dict(type='int', default=50),
+            max_buffer_utilization=dict(type='int', default=80),
+            pressure_timeout=dict(type='int', default=300),
             action=dict(type='str', required=False, default='list_configurations',
-                        choices=['list_configurations', 'query_collector_configurations', 'update_snippet']),
+                        choices=['list_configurations', 'query_collector_configurations', 'update_snippet', 'update_snippets']),
             configuration_id=dict(type='str'),
             configuration_name=dict(type='str'),
             configuration_tags=dict(type='list'),
             snippet_name=dict(type='str'),
             snippet_source=dict(type='str'),
-            backend=dict(type='str')
+            backend=dict(type='str'),
+            snippets=dict(type='list'),
+            fingerprint_file=dict(type='path'),
+            concurrency=dict(type='int', default=4),
+            transport=dict(type='str', default='threads', choices=TRANSPORTS)
         )
     )
 
-    endpoint = module.params['endpoint']
+    endpoint = register_nodes(module.params['endpoint'])
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     action = module.params['action']
@@ -317,6 +539,8 @@ def main():
         configuration_id = query_collector_configurations(module, configuration_url, headers, configuration_name)
         snippet_id = query_snippets(module, configuration_url, headers, configuration_id, snippet_name)
         status, message, content, url = update_snippet(module, configuration_url, headers, configuration_id, snippet_id)
+    elif action == "update_snippets":
+        status, message, content, url = update_snippets(module, configuration_url, headers)
     elif action == "query_collector_configurations":
         configuration_id = query_collector_configurations(module, configuration_url, headers, configuration_name)
         query = "yes"
@@ -335,6 +559,9 @@ def main():
     uresp['msg'] = message
     uresp['url'] = url
 
+    if action == "update_snippets":
+        uresp['changed'] = len(js['updated']) > 0
+
     module.exit_json(**uresp)
 
 
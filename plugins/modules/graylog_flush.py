@@ -0,0 +1,348 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_flush
+short_description: Apply the writes queued by the Graylog modules
+description:
+    - Applies the writes that M(graylog_streams) and M(graylog_pipelines) queued in I(queue_file), typically once at
+      the end of a play, so Graylog reloads its stream router and pipeline interpreter once per object instead of
+      once per task.
+    - The queue is coalesced first, the updates of an object are merged, objects created and deleted in the same
+      queue are never sent, and a delete drops the writes queued before it.
+    - Placeholder ids returned by queued creates are replaced by the real ids as the creates are applied.
+    - Queued updates are skipped when the object already has the given values.
+    - Only the writes queued for I(endpoint) are applied, the others stay in the queue. When a write fails, it and
+      the following ones stay in the queue too, with the ids of the objects created so far.
+    - Must run on the host the writes were queued on, usually the controller with C(delegate_to) localhost.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, writes are then sent to the leader and a node that can't be
+        reached fails over to the next one.
+    required: false
+    type: raw
+  clusters:
+    description:
+      - Endpoints of several clusters, each a host or the list of the nodes of a cluster, used instead of
+        I(endpoint).
+      - The module flushes the writes queued for every cluster concurrently, the results are then returned by
+        cluster in C(clusters) and the clusters that failed in C(failed_clusters).
+    required: false
+    type: list
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate
+    required: false
+    default: false
+    type: bool
+  rate_limit:
+    description:
+      - Maximum number of requests per second sent to the cluster, unlimited by default.
+    required: false
+    type: float
+  pressure_check:
+    description:
+      - Check the journal and buffer utilization of the cluster nodes before writing, and wait for the cluster to
+        catch up when they are too high.
+    required: false
+    default: false
+    type: bool
+  queue_file:
+    description:
+      - Queue file given to the modules with their I(queue_file) option.
+    required: true
+    type: path
+'''
+
+EXAMPLES = '''
+- hosts: localhost
+  vars:
+    graylog_queue: "{{ playbook_dir }}/.graylog-queue.jsonl"
+  tasks:
+    - name: Create the stream, the write is only queued
+      graylog_streams:
+        action: create
+        endpoint: "graylog.mydomain.com"
+        api_token: "{{ graylog_token }}"
+        title: "Client XYZ"
+        matching_type: "AND"
+        queue_file: "{{ graylog_queue }}"
+      register: stream
+
+    - name: Route its messages, using the placeholder id of the queued stream
+      graylog_streams:
+        action: create_rule
+        endpoint: "graylog.mydomain.com"
+        api_token: "{{ graylog_token }}"
+        stream_id: "{{ stream.json.stream_id }}"
+        field: "client"
+        type: 1
+        value: "xyz"
+        queue_file: "{{ graylog_queue }}"
+
+    - name: Update many pipeline rules, each one is written at most once
+      graylog_pipelines:
+        action: update_rule
+        endpoint: "graylog.mydomain.com"
+        api_token: "{{ graylog_token }}"
+        rule_id: "{{ item.id }}"
+        source: "{{ lookup('file', item.file) }}"
+        queue_file: "{{ graylog_queue }}"
+      loop: "{{ rules }}"
+
+    - name: Apply everything
+      graylog_flush:
+        endpoint: "graylog.mydomain.com"
+        api_token: "{{ graylog_token }}"
+        queue_file: "{{ graylog_queue }}"
+'''
+
+RETURN = '''
+json:
+  description: Flush summary
+  returned: always
+  type: dict
+  sample: {
+    "queued": 214,
+    "requests": 38,
+    "coalesced": 176,
+    "applied": 31,
+    "unchanged": 7,
+    "results": [{"kind": "stream", "op": "create", "method": "POST", "url": "https://graylog.mydomain.com/api/streams",
+                 "merged": 3, "status": 201, "result": "applied", "id": "5bc7666089675c7f7d7f08d7"}],
+    "ids": {"queued-3f2a9c1b7e40": "5bc7666089675c7f7d7f08d7"}
+  }
+'''
+
+
+# import module snippets
+import json
+import base64
+import fcntl
+import os
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_clusters import run_on_clusters
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_queue
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url
+
+
+def send(module, url, headers, method, payload=None):
+
+    data = module.jsonify(payload) if payload is not None else None
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method=method, data=data, timeout=20)
+
+    content = None
+    if 200 <= info['status'] < 300:
+        try:
+            content = to_text(response.read(), errors='surrogate_or_strict')
+        except AttributeError:
+            content = info.pop('body', '')
+
+    return info, content
+
+
+def apply_entry(module, headers, entry):
+
+    # Returns the result of the entry, or None when it failed along with the error message
+    result = {'kind': entry['kind'], 'op': entry['op'], 'method': entry['method'], 'url': entry['url'],
+              'merged': entry.get('merged', 1)}
+    payload = entry['payload']
+
+    if len(graylog_queue.placeholders(entry)) > 0:
+        return None, "Fail: %s refers to an object that was not created" % entry['url']
+
+    if entry['op'] == 'update':
+        info, content = send(module, entry['url'], headers, 'GET')
+        if content is None:
+            return None, "Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info.get('body')))
+        current = json.loads(content)
+        if all(current.get(key) == payload[key] for key in payload):
+            result['status'] = info['status']
+            result['result'] = "unchanged"
+            return result, None
+        # Queued updates only hold the given values, the others are the current ones
+        payload = dict((key, current.get(key)) for key in entry.get('keys', []))
+        payload.update(entry['payload'])
+
+    info, content = send(module, entry['url'], headers, entry['method'], payload)
+    if content is None:
+        return None, "Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info.get('body')))
+
+    result['status'] = info['status']
+    result['result'] = "applied"
+    if entry['op'] == 'create':
+        result['id'] = json.loads(content)[entry['id_field']]
+
+    return result, None
+
+
+def flush(module, endpoint, headers):
+
+    path = module.params['queue_file']
+    if not os.path.exists(path):
+        return {'queued': 0, 'requests': 0, 'coalesced': 0, 'applied': 0, 'unchanged': 0, 'results': [], 'ids': {}}
+
+    with open(path, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+        entries = graylog_queue.read_entries(f)
+        queued = [entry for entry in entries if entry['url'].startswith(endpoint + "/")]
+        others = [entry for entry in entries if not entry['url'].startswith(endpoint + "/")]
+
+        requests = graylog_queue.coalesce(queued)
+
+        ids = {}
+        results = []
+        error = None
+        for index, entry in enumerate(requests):
+            if module.check_mode:
+                results.append({'kind': entry['kind'], 'op': entry['op'], 'method': entry['method'], 'url': entry['url'],
+                                'merged': entry.get('merged', 1), 'result': "queued"})
+                continue
+
+            entry = graylog_queue.resolve(entry, ids)
+            result, error = apply_entry(module, headers, entry)
+            if result is None:
+                # The failed write and the following ones are kept for the next flush
+                others += [graylog_queue.resolve(remaining, ids) for remaining in requests[index:]]
+                break
+
+            results.append(result)
+            if 'id' in result:
+                ids[entry['ref']] = result['id']
+
+        if not module.check_mode:
+            graylog_queue.write_entries(f, others)
+
+    summary = {
+        'queued': len(queued),
+        'requests': len(requests),
+        'coalesced': len(queued) - len(requests),
+        'applied': len([result for result in results if result['result'] == "applied"]),
+        'unchanged': len([result for result in results if result['result'] == "unchanged"]),
+        'results': results,
+        'ids': ids
+    }
+
+    if error is not None:
+        module.fail_json(msg=error, json=summary, changed=summary['applied'] > 0)
+
+    return summary
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def run(module, endpoint):
+
+    graylog_user = module.params['graylog_user']
+    graylog_password = module.params['graylog_password']
+    allow_http = module.params['allow_http']
+
+    if allow_http == True:
+      endpoint = "http://" + endpoint
+    else:
+      endpoint = "https://" + endpoint
+
+    api_token = get_token(module, endpoint, graylog_user, graylog_password)
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+    js = flush(module, endpoint, headers)
+
+    uresp = {}
+    uresp['json'] = js
+    uresp['changed'] = js['applied'] > 0
+    uresp['msg'] = "OK"
+    uresp['url'] = endpoint
+
+    return uresp
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            clusters=dict(type='list'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            rate_limit=dict(type='float'),
+            pressure_check=dict(type='bool', default=False),
+            queue_file=dict(type='path', required=True)
+        ),
+        mutually_exclusive=[['endpoint', 'clusters']],
+        supports_check_mode=True
+    )
+
+    run_on_clusters(module, run)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,8 +20,18 @@ options:
   endpoint:
     description:
       - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
+  clusters:
+    description:
+      - Endpoints of several clusters, each a host or the list of the nodes of a cluster, used instead of
+        I(endpoint).
+      - The module runs the same action against every cluster concurrently, the results are then returned by
+        cluster in C(clusters) and the clusters that failed in C(failed_clusters).
+    required: false
+    type: list
   graylog_user:
     description:
       - Graylog privileged user username.
@@ -32,6 +42,12 @@ options:
       - Graylog privileged user password.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -44,18 +60,70 @@ options:
     required: false
     default: false
     type: bool      
+  rate_limit:
+    description:
+      - Maximum number of requests per second sent to the cluster, unlimited by default.
+    required: false
+    type: float
+  pressure_check:
+    description:
+      - Check the journal and buffer utilization of the cluster nodes before writing.
+      - Above half of I(max_journal_utilization) or I(max_buffer_utilization) writes go at half I(rate_limit),
+        above the limits they wait for the cluster to catch up.
+    required: false
+    default: false
+    type: bool
+  max_journal_utilization:
+    description:
+      - Journal utilization, in percent, above which writes wait when I(pressure_check) is enabled.
+    required: false
+    default: 50
+    type: int
+  max_buffer_utilization:
+    description:
+      - Input, process or output buffer utilization, in percent, above which writes wait when I(pressure_check)
+        is enabled.
+    required: false
+    default: 80
+    type: int
+  pressure_timeout:
+    description:
+      - Seconds to wait for the cluster to get under the limits before failing.
+    required: false
+    default: 300
+    type: int
   action:
     description:
       - Action to take against index API.
     required: false
     default: list
-    choices: [ create, update, list, delete, query_index_sets ]
+    choices: [ create, update, list, delete, query_index_sets, stats, advise, cycle, rebuild_ranges ]
     type: str
   id:
     description:
       - Index set id.
+      - With actions stats and advise, only this index set is returned, all of them otherwise.
     required: false
     type: str
+  ids:
+    description:
+      - With actions cycle and rebuild_ranges, index set ids handled in addition to I(id).
+      - The ranges of all the indices are rebuilt when neither I(id) nor I(ids) is given.
+    required: false
+    type: list
+  wait:
+    description:
+      - With actions cycle and rebuild_ranges, wait for the system jobs they start to complete, setting the
+        previous write index of every index set read-only and optimizing it, or rebuilding the index ranges.
+    required: false
+    default: false
+    type: bool
+  wait_timeout:
+    description:
+      - Seconds to wait for the system jobs before failing.
+    required: false
+    default: 600
+    type: int
   title:
     description:
       - Title.
@@ -150,6 +218,18 @@ options:
     required: false
     default: False
     type: bool
+  target_shard_size:
+    description:
+      - With action advise, size in GB aimed at for a primary shard.
+    required: false
+    default: 30
+    type: int
+  max_rotation_days:
+    description:
+      - With action advise, longest rotation period recommended for index sets with a low volume.
+    required: false
+    default: 7
+    type: int
 '''
 
 EXAMPLES = '''
@@ -175,6 +255,30 @@ EXAMPLES = '''
          let dns_query_intel = threat_intel_lookup_domain(to_string($message.dns_query), "dns_query");
          set_fields(dns_query_intel);
       end
+
+# Size, document and index count of every index set
+- graylog_index_sets:
+    action: stats
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+
+# Shard count and rotation period recommended from the observed daily volume
+- graylog_index_sets:
+    action: advise
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    target_shard_size: 40
+
+# Cycle the index sets after a rotation change and wait for the index ranges
+- graylog_index_sets:
+    action: cycle
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    ids: "{{ index_set_ids }}"
+    wait: true
 '''
 
 RETURN = '''
@@ -283,10 +387,29 @@ url:
 
 # import module snippets
 import json
+import math
+import re
+import time
 import datetime
 import base64
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_clusters import run_on_clusters
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url
+
+
+# Poll interval while waiting for the jobs a cycle or rebuild starts, until they were all seen
+SETTLE_POLL_INTERVAL = 2
+
+# System job classes started by a cycle and by a ranges rebuild
+READ_ONLY_JOB = "SetIndexReadOnlyAndCalculateRangeJob"
+
+OPTIMIZE_JOB = "OptimizeIndexJob"
+
+REBUILD_RANGES_JOB = "RebuildIndexRangesJob"
+
+# Seconds a job started at the end of another one takes to be listed
+CHAINED_JOB_SETTLE = 10
 
 
 def create(module, base_url, headers, creation_date):
@@ -409,8 +532,335 @@ def query_index_sets(module, base_url, headers, title):
     return id
 
 
+def stats(module, base_url, headers, id):
+
+    url = base_url + "?stats=true"
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        index_sets = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+        index_sets = {'index_sets': [], 'stats': {}}
+
+    result = []
+    for index_set in index_sets['index_sets']:
+        if id is not None and index_set['id'] != id:
+            continue
+        set_stats = index_sets['stats'].get(index_set['id']) or {}
+        result.append({
+            'id': index_set['id'],
+            'title': index_set['title'],
+            'index_prefix': index_set['index_prefix'],
+            'shards': index_set['shards'],
+            'replicas': index_set['replicas'],
+            'rotation_strategy': index_set['rotation_strategy'],
+            'retention_strategy': index_set['retention_strategy'],
+            'indices': set_stats.get('indices', 0),
+            'documents': set_stats.get('documents', 0),
+            'size': set_stats.get('size', 0)
+        })
+
+    return info['status'], info['msg'], module.jsonify(result), url
+
+
+def period_days(period):
+
+    # ISO 8601 periods as used by the time based rotation strategy, ie: P1D, P1W, PT6H
+    match = re.match(r'^P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$', period or "")
+    if match is None:
+        return None
+
+    years, months, weeks, days, hours, minutes, seconds = [int(value or 0) for value in match.groups()]
+
+    return years * 365 + months * 30 + weeks * 7 + days + hours / 24.0 + minutes / 1440.0 + seconds / 86400.0
+
+
+def parse_date(value):
+
+    return datetime.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
+
+def index_ranges(module, endpoint, headers):
+
+    url = endpoint + "/api/system/indices/ranges"
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        ranges = json.loads(content)['ranges']
+    except AttributeError:
+        content = info.pop('body', '')
+        ranges = []
+
+    # { index_prefix: (oldest message, newest message) }, empty indices have an epoch begin
+    spans = {}
+    for index_range in ranges:
+        begin = parse_date(index_range['begin'])
+        end = parse_date(index_range['end'])
+        if begin.year <= 1970:
+            continue
+        prefix = index_range['index_name'].rsplit('_', 1)[0]
+        if prefix in spans:
+            begin = min(begin, spans[prefix][0])
+            end = max(end, spans[prefix][1])
+        spans[prefix] = (begin, end)
+
+    return spans
+
+
+def recommend(index_set, daily_bytes, target_shard_size, max_rotation_days):
+
+    # Enough daily volume for a full shard: rotate daily, one shard per target size
+    if daily_bytes >= target_shard_size:
+        rotation_days = 1
+        shards = int(math.ceil(daily_bytes / float(target_shard_size)))
+    # Less: keep a single shard and let it fill up over several days
+    else:
+        rotation_days = max(1, min(max_rotation_days, int(target_shard_size // max(daily_bytes, 1))))
+        shards = 1
+
+    recommendation = {
+        'shards': shards,
+        'rotation_strategy_class': "org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategy",
+        'rotation_strategy': {'type': "org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategyConfig",
+                              'rotation_period': "P%dD" % rotation_days},
+        'shard_size': int(daily_bytes * rotation_days / shards)
+    }
+
+    # Keep the retention in days the index set has today
+    current_days = period_days(index_set['rotation_strategy'].get('rotation_period'))
+    max_indices = index_set['retention_strategy'].get('max_number_of_indices')
+    if current_days and max_indices:
+        retention = dict(index_set['retention_strategy'])
+        retention['max_number_of_indices'] = int(math.ceil(max_indices * current_days / rotation_days))
+        recommendation['retention_strategy'] = retention
+
+    return recommendation
+
+
+def advise(module, endpoint, base_url, headers, id):
+
+    status, message, content, url = stats(module, base_url, headers, id)
+    spans = index_ranges(module, endpoint, headers)
+
+    target_shard_size = module.params['target_shard_size'] * 1024 * 1024 * 1024
+
+    result = []
+    for index_set in json.loads(content):
+        advice = dict(index_set)
+        span = spans.get(index_set['index_prefix'])
+        if span is None or index_set['size'] == 0:
+            advice['msg'] = "No data in the index set yet, nothing to recommend"
+            result.append(advice)
+            continue
+
+        days = max((span[1] - span[0]).total_seconds() / 86400.0, 1 / 24.0)
+        # Replicas hold copies, the shard size is the one of the primaries
+        daily_bytes = index_set['size'] / float(1 + index_set['replicas']) / days
+        advice['observed_days'] = round(days, 2)
+        advice['daily_size'] = int(daily_bytes)
+        advice['daily_documents'] = int(index_set['documents'] / days)
+        advice['recommendation'] = recommend(index_set, daily_bytes, target_shard_size, module.params['max_rotation_days'])
+
+        current = {'shards': index_set['shards'], 'rotation_period': index_set['rotation_strategy'].get('rotation_period')}
+        recommended = {'shards': advice['recommendation']['shards'],
+                       'rotation_period': advice['recommendation']['rotation_strategy']['rotation_period']}
+        advice['changes'] = dict((key, {'current': current[key], 'recommended': recommended[key]})
+                                 for key in current if current[key] != recommended[key])
+        result.append(advice)
+
+    return status, message, module.jsonify(result), url
+
+
+def index_set_ids(module):
+
+    ids = module.params['ids'] or []
+    if module.params['id'] is not None:
+        ids = [module.params['id']] + ids
+
+    return ids
+
+
+def cluster_jobs(module, endpoint, headers):
+
+    url = endpoint + "/api/cluster/jobs"
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        nodes = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+        nodes = {}
+
+    # { node_id: { "jobs": [ job ] } }, nodes that didn't answer are null
+    jobs = {}
+    for node_id in nodes:
+        if nodes[node_id] is None:
+            continue
+        for job in nodes[node_id].get('jobs', []):
+            jobs[job['id']] = job
+
+    return jobs
+
+
+def job_matches(job, kind, index):
+
+    # Jobs are told apart by their class, and by the index named in their description
+    if not (job.get('name') or "").endswith("." + kind):
+        return False
+
+    return index is None or re.search(r'(?<![\w-])' + re.escape(index) + r'(?![\w-])', job.get('description') or "") is not None
+
+
+def wait_for_jobs(module, endpoint, headers, before, expected, settle):
+
+    # expected is a list of { kind, index, after }: the job class, the index it names (None for any) and,
+    # for a job that another one starts when it ends, the position of that one. Jobs started after the
+    # trigger are matched to them as they are listed. One that is still not listed settle seconds after
+    # the trigger, or CHAINED_JOB_SETTLE seconds after the end of the job starting it, ran between two polls.
+    start = time.time()
+    delay = SETTLE_POLL_INTERVAL
+    seen = {}
+    matched = [None] * len(expected)
+    finished = [None] * len(expected)
+    while True:
+        running = cluster_jobs(module, endpoint, headers)
+        seen.update((id, job) for id, job in running.items() if id not in before)
+        now = time.time()
+
+        for position, job in enumerate(expected):
+            if matched[position] is None:
+                for id in seen:
+                    if id not in matched and job_matches(seen[id], job['kind'], job['index']):
+                        matched[position] = id
+                        break
+            if matched[position] is not None and matched[position] not in running and finished[position] is None:
+                finished[position] = now
+
+        waiting = []
+        unseen = False
+        for position, job in enumerate(expected):
+            if matched[position] is not None:
+                if finished[position] is None:
+                    waiting.append(seen[matched[position]].get('description') or matched[position])
+                continue
+            due = start if job['after'] is None else finished[job['after']]
+            window = settle if job['after'] is None else CHAINED_JOB_SETTLE
+            if due is None or now - due < window:
+                waiting.append("%s of %s (not started yet)" % (job['kind'], job['index'] or "all indices"))
+                unseen = True
+            elif finished[position] is None:
+                finished[position] = now
+
+        elapsed = now - start
+        if len(waiting) == 0:
+            return [seen[id] for id in matched if id is not None], int(elapsed)
+
+        if elapsed + delay > module.params['wait_timeout']:
+            module.fail_json(msg="Fail: system jobs still running after %d seconds: %s"
+                             % (module.params['wait_timeout'], ", ".join(waiting)))
+        time.sleep(delay)
+        # A short lived job could start and finish between two long polls, poll often until all were seen
+        delay = SETTLE_POLL_INTERVAL if unseen else min(delay * 2, 30)
+
+
+def cycle_jobs(module, endpoint, headers, ids):
+
+    # The previous write index of each index set is set read-only, then optimized unless disabled
+    expected = []
+    for id in ids:
+        url = endpoint + "/api/system/deflector/%s" % (id)
+
+        response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+        if info['status'] != 200:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+        index = json.loads(to_text(response.read(), errors='surrogate_or_strict')).get('current_target')
+        if index is None:
+            continue
+
+        status, message, content, url = list(module, endpoint + "/api/system/indices/index_sets", headers, id)
+        index_set = json.loads(content)
+
+        expected.append({'kind': READ_ONLY_JOB, 'index': index, 'after': None})
+        if not index_set.get('index_optimization_disabled', False):
+            expected.append({'kind': OPTIMIZE_JOB, 'index': index, 'after': len(expected) - 1})
+
+    return expected
+
+
+def cycle(module, endpoint, headers):
+
+    ids = index_set_ids(module)
+    if len(ids) == 0:
+        module.fail_json(msg="Fail: id or ids is required to cycle index sets")
+
+    if module.params['wait']:
+        before = cluster_jobs(module, endpoint, headers)
+        expected = cycle_jobs(module, endpoint, headers, ids)
+
+    for id in ids:
+        url = endpoint + "/api/system/deflector/%s/cycle" % (id)
+
+        response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
+
+        if info['status'] not in [200, 204]:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    result = {'cycled': ids}
+    if module.params['wait']:
+        result['jobs'], result['waited'] = wait_for_jobs(module, endpoint, headers, before, expected, 35)
+
+    return info['status'], info['msg'], module.jsonify(result), url
+
+
+def rebuild_ranges(module, endpoint, headers):
+
+    ids = index_set_ids(module)
+
+    before = cluster_jobs(module, endpoint, headers) if module.params['wait'] else {}
+
+    # Without index sets, the ranges of all the indices are rebuilt
+    urls = [endpoint + "/api/system/indices/ranges/index_set/%s/rebuild" % (id) for id in ids]
+    if len(urls) == 0:
+        urls = [endpoint + "/api/system/indices/ranges/rebuild"]
+
+    for url in urls:
+        response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
+
+        if info['status'] != 202:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    result = {'rebuilt': ids or "all"}
+    if module.params['wait']:
+        expected = [{'kind': REBUILD_RANGES_JOB, 'index': None, 'after': None} for url in urls]
+        result['jobs'], result['waited'] = wait_for_jobs(module, endpoint, headers, before, expected, 5)
+
+    return info['status'], info['msg'], module.jsonify(result), url
+
+
 def get_token(module, endpoint, username, password):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -439,39 +889,8 @@ def get_token(module, endpoint, username, password):
     return session_token
 
 
-def main():
-    module = AnsibleModule(
-        argument_spec=dict(
-            endpoint=dict(type='str'),
-            graylog_user=dict(type='str'),
-            graylog_password=dict(type='str', no_log=True),
-            allow_http=dict(type='bool', required=False, default=False),
-            validate_certs=dict(type='bool', required=False, default=True),
-            action=dict(type='str', required=False, default='list', choices=['create', 'update', 'delete', 'list', 'query_index_sets']),
-            title=dict(type='str'),
-            description=dict(type='str'),
-            creation_date=dict(type='str', required=False),
-            id=dict(type='str'),
-            index_prefix=dict(type='str'),
-            index_analyzer=dict(type='str', default="standard"),
-            shards=dict(type='int', default=4),
-            replicas=dict(type='int', default=1),
-            field_type_refresh_interval=dict(type='int', default=5000),
-            rotation_strategy_class=dict(type='str',
-                                         default='org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategy'),
-            retention_strategy_class=dict(type='str', default='org.graylog2.indexer.retention.strategies.DeletionRetentionStrategy'),
-            rotation_strategy=dict(type='dict', default=dict(type='org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategyConfig',
-                                   rotation_period='P1D')),
-            retention_strategy=dict(type='dict', default=dict(type='org.graylog2.indexer.retention.strategies.DeletionRetentionStrategyConfig',
-                                    max_number_of_indices=14)),
-            index_optimization_max_num_segments=dict(type='int', default=1),
-            index_optimization_disabled=dict(type='bool', default=False),
-            writable=dict(type='bool', default=True),
-            default=dict(type='bool', default=False)
-        )
-    )
+def run(module, endpoint):
 
-    endpoint = module.params['endpoint']
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     action = module.params['action']
@@ -502,6 +921,14 @@ def main():
     elif action == "query_index_sets":
         id = query_index_sets(module, base_url, headers, title)
         status, message, content, url = list(module, base_url, headers, id)
+    elif action == "stats":
+        status, message, content, url = stats(module, base_url, headers, id)
+    elif action == "advise":
+        status, message, content, url = advise(module, endpoint, base_url, headers, id)
+    elif action == "cycle":
+        status, message, content, url = cycle(module, endpoint, headers)
+    elif action == "rebuild_ranges":
+        status, message, content, url = rebuild_ranges(module, endpoint, headers)
 
     uresp = {}
     content = to_text(content, encoding='UTF-8')
@@ -516,7 +943,56 @@ def main():
     uresp['msg'] = message
     uresp['url'] = url
 
-    module.exit_json(**uresp)
+    return uresp
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            clusters=dict(type='list'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            rate_limit=dict(type='float'),
+            pressure_check=dict(type='bool', default=False),
+            max_journal_utilization=dict(type='int', default=50),
+            max_buffer_utilization=dict(type='int', default=80),
+            pressure_timeout=dict(type='int', default=300),
+            action=dict(type='str', required=False, default='list', choices=['create', 'update', 'delete', 'list', 'query_index_sets',
+                                                                                       'stats', 'advise', 'cycle', 'rebuild_ranges']),
+            title=dict(type='str'),
+            description=dict(type='str'),
+            creation_date=dict(type='str', required=False),
+            id=dict(type='str'),
+            index_prefix=dict(type='str'),
+            index_analyzer=dict(type='str', default="standard"),
+            shards=dict(type='int', default=4),
+            replicas=dict(type='int', default=1),
+            field_type_refresh_interval=dict(type='int', default=5000),
+            rotation_strategy_class=dict(type='str',
+                                         default='org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategy'),
+            retention_strategy_class=dict(type='str', default='org.graylog2.indexer.retention.strategies.DeletionRetentionStrategy'),
+            rotation_strategy=dict(type='dict', default=dict(type='org.graylog2.indexer.rotation.strategies.TimeBasedRotationStrategyConfig',
+                                   rotation_period='P1D')),
+            retention_strategy=dict(type='dict', default=dict(type='org.graylog2.indexer.retention.strategies.DeletionRetentionStrategyConfig',
+                                    max_number_of_indices=14)),
+            index_optimization_max_num_segments=dict(type='int', default=1),
+            index_optimization_disabled=dict(type='bool', default=False),
+            writable=dict(type='bool', default=True),
+            default=dict(type='bool', default=False),
+            target_shard_size=dict(type='int', default=30),
+            max_rotation_days=dict(type='int', default=7),
+            ids=dict(type='list'),
+            wait=dict(type='bool', default=False),
+            wait_timeout=dict(type='int', default=600)
+        ),
+        mutually_exclusive=[['endpoint', 'clusters']]
+    )
+
+    run_on_clusters(module, run)
 
 
 if __name__ == '__main__':
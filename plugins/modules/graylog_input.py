@@ -18,8 +18,10 @@ options:
   endpoint:
     description:
       - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
   graylog_user:
     description:
       - Graylog privileged user username.
@@ -30,6 +32,12 @@ options:
       - Graylog privileged user password.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -45,15 +53,48 @@ options:
   action:
     description:
       - Action to take against LDAP API.
+      - C(metrics) returns the runtime state of every input and its throughput, sampled with one bulk
+        cluster metrics request at the start and one at the end of I(sample_window).
+      - C(advise) recommends the number_worker_threads, recv_buffer_size and max_message_size of every input from
+        its busiest node's message and byte rates over I(sample_window) and the CPU count of the nodes, and
+        applies them with I(apply).
     required: true
     default: list
-    choices: [ list, delete ]
+    choices: [ list, delete, metrics, advise ]
     type: str
   input_id:
     description:
       - ID of input to remove
+      - With actions metrics and advise, limit the result to this input
     required: false
     type: str
+  sample_window:
+    description:
+      - Number of seconds between the two metrics samples used to compute rates (actions metrics and advise)
+      - With 0, a single sample is taken and the one minute moving average reported by Graylog is used
+    required: false
+    default: 5
+    type: int
+  headroom:
+    description:
+      - With action advise, factor applied to the observed rates to leave room for peaks.
+    required: false
+    default: 2.0
+    type: float
+  cpu_count:
+    description:
+      - With action advise, number of cores of the Graylog nodes, read from the node answering the API by default.
+    required: false
+    type: int
+  apply:
+    description:
+      - With action advise, update the inputs whose settings differ from the recommendation. Graylog restarts an
+        input when it is updated.
+      - Inputs with a password set, such as a TLS key password, are not updated as the API returns it masked and
+        the update would overwrite it, they are returned with C(skipped) instead.
+    required: false
+    default: false
+    type: bool
 '''
 
 EXAMPLES = '''
@@ -75,13 +116,53 @@ EXAMPLES = '''
         validate_certs: "false"
         action: "delete"        
         input_id: "1df0f1234abcd0000d0adf20"
+
+    - name: Check that every input is running and receiving messages
+      graylog_input:
+        endpoint: "{{ graylog_endpoint }}"
+        graylog_user: "{{ graylog_user }}"
+        graylog_password: "{{ graylog_password }}"
+        action: "metrics"
+        sample_window: 10
+      register: input_metrics
+      failed_when: input_metrics.json.inputs | rejectattr('state', 'equalto', 'RUNNING') | list | length > 0
+
+    - name: Size the inputs from one minute of observed traffic
+      graylog_input:
+        endpoint: "{{ graylog_endpoint }}"
+        graylog_user: "{{ graylog_user }}"
+        graylog_password: "{{ graylog_password }}"
+        action: "advise"
+        sample_window: 60
+        apply: true
 '''
 
 # import module snippets
 import json
+import math
+import re
+import time
 import base64
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+# Messages per second one input worker thread is expected to decode
+MESSAGES_PER_WORKER = 20000
+
+# Seconds of traffic the receive buffer should absorb while the workers are busy
+BUFFER_SECONDS = 0.5
+
+MIN_RECV_BUFFER = 1048576
+
+MAX_RECV_BUFFER = 67108864
+
+# Ratio between max_message_size and the average message size
+MESSAGE_SIZE_MARGIN = 16
+
+# How the inputs API returns the secrets it doesn't disclose
+MASKED_VALUE_REGEX = re.compile(r'^\*+$')
 
 def delete(module, base_url, headers):
 
@@ -115,8 +196,370 @@ def list(module, base_url, headers):
 
     return info['status'], info['msg'], content, url
 
+def input_metric_names(graylog_input):
+
+    prefix = graylog_input['type'] + "." + graylog_input['id']
+
+    return {
+        'messages': prefix + ".incomingMessages",
+        'read_bytes': prefix + ".read_bytes_total",
+        'open_connections': prefix + ".open_connections"
+    }
+
+
+def metric_value(metric):
+
+    if metric is None:
+        return None
+
+    value = metric['metric']
+    if metric['type'] == "meter":
+        return value['rate']['total']
+    elif metric['type'] == "counter":
+        return value['count']
+    elif metric['type'] == "gauge":
+        return value['value']
+
+    return None
+
+
+def metric_one_minute(metric):
+
+    if metric is not None and metric['type'] == "meter":
+        return metric['metric']['rate']['one_minute']
+
+    return None
+
+
+def fetch_metrics(module, endpoint, headers, names):
+
+    url = endpoint + "/api/cluster/metrics/multiple"
+
+    payload = {}
+    payload['metrics'] = names
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        nodes = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+        nodes = {}
+
+    # { node_id: { metric_name: metric } }
+    metrics = {}
+    for node_id in nodes:
+        metrics[node_id] = {}
+        if nodes[node_id] is None:
+            continue
+        for metric in nodes[node_id]['metrics']:
+            metrics[node_id][metric['full_name']] = metric
+
+    return metrics, time.time()
+
+
+def sum_nodes(metrics, name, extract):
+
+    total = None
+    for node_id in metrics:
+        value = extract(metrics[node_id].get(name))
+        if value is not None:
+            total = (total or 0) + value
+
+    return total
+
+
+def metrics(module, endpoint, base_url, headers):
+
+    status, message, content, url = list(module, base_url, headers)
+    graylog_inputs = json.loads(content)['inputs']
+
+    if module.params['input_id'] is not None:
+        graylog_inputs = [i for i in graylog_inputs if i['id'] == module.params['input_id']]
+
+    url = endpoint + "/api/cluster/inputstates"
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        node_states = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+        node_states = {}
+
+    # { input_id: { node_id: state } }
+    states = {}
+    for node_id in node_states:
+        for input_state in node_states[node_id] or []:
+            states.setdefault(input_state['id'], {})[node_id] = input_state['state']
+
+    buffer_names = []
+    for buffer in ['input', 'process', 'output']:
+        buffer_names.append("org.graylog2.buffers." + buffer + ".usage")
+        buffer_names.append("org.graylog2.buffers." + buffer + ".size")
+
+    names = [] + buffer_names
+    for graylog_input in graylog_inputs:
+        names.extend(input_metric_names(graylog_input).values())
+
+    first, first_time = fetch_metrics(module, endpoint, headers, names)
+    last, last_time = first, first_time
+
+    sample_window = module.params['sample_window']
+    if sample_window > 0:
+        time.sleep(sample_window)
+        last, last_time = fetch_metrics(module, endpoint, headers, names)
+    elapsed = last_time - first_time
+
+    result = {}
+    result['sample_window'] = round(elapsed, 3)
+    result['inputs'] = []
+
+    for graylog_input in graylog_inputs:
+        names = input_metric_names(graylog_input)
+        input_states = states.get(graylog_input['id'], {})
+
+        entry = {}
+        entry['id'] = graylog_input['id']
+        entry['title'] = graylog_input['title']
+        entry['type'] = graylog_input['type']
+        entry['nodes'] = input_states
+        # Worst state across the nodes the input runs on, so a single FAILED node is visible
+        entry['state'] = "NOT_RUNNING"
+        for state in input_states.values():
+            if entry['state'] in ["NOT_RUNNING", "RUNNING"] or state == "FAILED":
+                entry['state'] = state
+        entry['total_messages'] = sum_nodes(last, names['messages'], metric_value)
+        entry['total_bytes'] = sum_nodes(last, names['read_bytes'], metric_value)
+        entry['open_connections'] = sum_nodes(last, names['open_connections'], metric_value)
+
+        if elapsed > 0:
+            for key, name in [('messages_per_second', 'messages'), ('bytes_per_second', 'read_bytes')]:
+                before = sum_nodes(first, names[name], metric_value)
+                after = sum_nodes(last, names[name], metric_value)
+                if before is None or after is None:
+                    entry[key] = None
+                else:
+                    entry[key] = round(max(after - before, 0) / elapsed, 2)
+        else:
+            entry['messages_per_second'] = sum_nodes(last, names['messages'], metric_one_minute)
+            entry['bytes_per_second'] = None
+
+        result['inputs'].append(entry)
+
+    result['buffers'] = {}
+    for node_id in last:
+        result['buffers'][node_id] = {}
+        for name in buffer_names:
+            result['buffers'][node_id][name.replace("org.graylog2.buffers.", "")] = metric_value(last[node_id].get(name))
+
+    return 200, "OK", module.jsonify(result), endpoint + "/api/cluster/metrics/multiple"
+
+
+def node_cpu_count(module, endpoint, headers):
+
+    if module.params['cpu_count'] is not None:
+        return module.params['cpu_count']
+
+    url = endpoint + "/api/system/stats/os"
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        stats = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+        stats = {}
+
+    return max(1, int(stats.get('processor', {}).get('total_cores') or 1))
+
+
+def power_of_two(value):
+
+    return 1 << max(int(math.ceil(value)) - 1, 0).bit_length()
+
+
+def node_rates(first, last, elapsed, name):
+
+    # { node_id: rate } of a meter or counter between the two samples, or its one minute rate without a window
+    rates = {}
+    for node_id in last:
+        if elapsed > 0:
+            before = metric_value(first.get(node_id, {}).get(name))
+            after = metric_value(last[node_id].get(name))
+            if before is not None and after is not None:
+                rates[node_id] = max(after - before, 0) / elapsed
+        else:
+            rate = metric_one_minute(last[node_id].get(name))
+            if rate is not None:
+                rates[node_id] = rate
+
+    return rates
+
+
+def recommend(module, graylog_input, messages_rate, bytes_rate, average_size, cpu_count):
+
+    attributes = graylog_input.get('attributes') or {}
+    headroom = module.params['headroom']
+    recommended = {}
+
+    if 'number_worker_threads' in attributes and messages_rate is not None:
+        workers = min(max(int(math.ceil(messages_rate * headroom / MESSAGES_PER_WORKER)), 1), cpu_count)
+        # Spare threads cost little, only add missing ones or remove those the node can't run
+        if workers > attributes['number_worker_threads'] or attributes['number_worker_threads'] > cpu_count:
+            recommended['number_worker_threads'] = workers
+
+    # Undersized buffers drop messages silently, only ever grow them
+    if 'recv_buffer_size' in attributes and bytes_rate is not None:
+        size = min(max(power_of_two(bytes_rate * headroom * BUFFER_SECONDS), MIN_RECV_BUFFER), MAX_RECV_BUFFER)
+        if size > attributes['recv_buffer_size']:
+            recommended['recv_buffer_size'] = size
+
+    if 'max_message_size' in attributes and average_size is not None:
+        size = power_of_two(average_size * MESSAGE_SIZE_MARGIN)
+        if size > attributes['max_message_size']:
+            recommended['max_message_size'] = size
+
+    return recommended
+
+
+def secret_attributes(module, base_url, headers, graylog_input):
+
+    # The attributes the input type marks as passwords, and those returned masked whatever their type
+    url = base_url + "/types/" + graylog_input['type']
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    requested = json.loads(to_text(response.read(), errors='surrogate_or_strict')).get('requested_configuration') or {}
+    attributes = graylog_input.get('attributes') or {}
+
+    secrets = []
+    for name, value in attributes.items():
+        if value is None or value == "":
+            continue
+        if 'is_password' in ((requested.get(name) or {}).get('attributes') or []) or isinstance(value, dict) or \
+                MASKED_VALUE_REGEX.match("%s" % value):
+            secrets.append(name)
+
+    return sorted(secrets)
+
+
+def update_input(module, base_url, headers, graylog_input, changes):
+
+    url = base_url + "/" + graylog_input['id']
+
+    configuration = dict(graylog_input['attributes'])
+    configuration.update(changes)
+
+    payload = {}
+    payload['title'] = graylog_input['title']
+    payload['type'] = graylog_input['type']
+    payload['global'] = graylog_input['global']
+    payload['node'] = graylog_input.get('node')
+    payload['configuration'] = configuration
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT', data=module.jsonify(payload))
+
+    if info['status'] not in [200, 201, 204]:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+
+def advise(module, endpoint, base_url, headers):
+
+    status, message, content, url = list(module, base_url, headers)
+    graylog_inputs = json.loads(content)['inputs']
+
+    if module.params['input_id'] is not None:
+        graylog_inputs = [i for i in graylog_inputs if i['id'] == module.params['input_id']]
+
+    cpu_count = node_cpu_count(module, endpoint, headers)
+
+    names = []
+    for graylog_input in graylog_inputs:
+        names.extend(input_metric_names(graylog_input).values())
+
+    first, first_time = fetch_metrics(module, endpoint, headers, names)
+    last, last_time = first, first_time
+
+    sample_window = module.params['sample_window']
+    if sample_window > 0:
+        time.sleep(sample_window)
+        last, last_time = fetch_metrics(module, endpoint, headers, names)
+    elapsed = last_time - first_time
+
+    result = {}
+    result['sample_window'] = round(elapsed, 3)
+    result['cpu_count'] = cpu_count
+    result['inputs'] = []
+    result['applied'] = []
+
+    for graylog_input in graylog_inputs:
+        names = input_metric_names(graylog_input)
+        attributes = graylog_input.get('attributes') or {}
+
+        # Global inputs run on every node, size them for the busiest one
+        messages_rates = node_rates(first, last, elapsed, names['messages'])
+        bytes_rates = node_rates(first, last, elapsed, names['read_bytes']) if elapsed > 0 else {}
+        total_messages = sum_nodes(last, names['messages'], metric_value)
+        total_bytes = sum_nodes(last, names['read_bytes'], metric_value)
+        average_size = float(total_bytes) / total_messages if total_messages and total_bytes else None
+
+        messages_rate = max(messages_rates.values()) if messages_rates else None
+        bytes_rate = max(bytes_rates.values()) if bytes_rates else None
+        if bytes_rate is None and messages_rate is not None and average_size is not None:
+            bytes_rate = messages_rate * average_size
+
+        recommended = recommend(module, graylog_input, messages_rate, bytes_rate, average_size, cpu_count)
+
+        entry = {}
+        entry['id'] = graylog_input['id']
+        entry['title'] = graylog_input['title']
+        entry['type'] = graylog_input['type']
+        entry['messages_per_second'] = round(messages_rate, 2) if messages_rate is not None else None
+        entry['bytes_per_second'] = round(bytes_rate, 2) if bytes_rate is not None else None
+        entry['average_message_size'] = round(average_size, 1) if average_size is not None else None
+        entry['current'] = dict((key, attributes[key]) for key in ['number_worker_threads', 'recv_buffer_size', 'max_message_size']
+                                if key in attributes)
+        entry['recommended'] = recommended
+        if 'recv_buffer_size' in recommended and "UDP" in graylog_input['type'].upper():
+            entry['note'] = "net.core.rmem_max must be at least %d on the Graylog nodes for the UDP buffer to be granted" % \
+                recommended['recv_buffer_size']
+
+        if module.params['apply'] and len(recommended) > 0:
+            # The configuration is written back whole, a masked secret would replace the real one
+            secrets = secret_attributes(module, base_url, headers, graylog_input)
+            if len(secrets) > 0:
+                entry['skipped'] = "not applied, the update would overwrite the masked %s" % ", ".join(secrets)
+            else:
+                update_input(module, base_url, headers, graylog_input, recommended)
+                result['applied'].append(graylog_input['id'])
+
+        result['inputs'].append(entry)
+
+    return 200, "OK", module.jsonify(result), endpoint + "/api/cluster/metrics/multiple"
+
+
 def get_token(module, endpoint, username, password, allow_http):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -146,18 +589,23 @@ def get_token(module, endpoint, username, password, allow_http):
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            endpoint=dict(type='str'),
+            endpoint=dict(type='raw'),
             graylog_user=dict(type='str'),
             graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
             validate_certs=dict(type='bool', required=False, default=True),
             allow_http=dict(type='bool', required=False, default=False),
             action=dict(type='str', required=False, default='list', 
-                        choices=[ 'list' , 'delete' ]),
+                        choices=[ 'list' , 'delete', 'metrics', 'advise' ]),
             input_id=dict(type='str', required=False ),
+            sample_window=dict(type='int', required=False, default=5),
+            headroom=dict(type='float', required=False, default=2.0),
+            cpu_count=dict(type='int', required=False),
+            apply=dict(type='bool', required=False, default=False),
         )
     )
 
-    endpoint = module.params['endpoint']
+    endpoint = register_nodes(module.params['endpoint'])
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     action = module.params['action']
@@ -178,6 +626,10 @@ def main():
         status, message, content, url = list(module, base_url, headers)                
     elif action == "delete":
         status, message, content, url = delete(module, base_url, headers)
+    elif action == "metrics":
+        status, message, content, url = metrics(module, endpoint, base_url, headers)
+    elif action == "advise":
+        status, message, content, url = advise(module, endpoint, base_url, headers)
        
     uresp = {}
     content = to_text(content, encoding='UTF-8')
@@ -192,6 +644,9 @@ def main():
     uresp['msg'] = message
     uresp['url'] = url
 
+    if action == "advise":
+        uresp['changed'] = len(js['applied']) > 0
+
     module.exit_json(**uresp)
 
 
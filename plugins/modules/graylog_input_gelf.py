@@ -18,8 +18,10 @@ options:
   endpoint:
     description:
       - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
   graylog_user:
     description:
       - Graylog privileged user username.
@@ -30,6 +32,12 @@ options:
       - Graylog privileged user password.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -204,7 +212,8 @@ EXAMPLES = '''
 import json
 import base64
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
 import re
 
 def search_by_name(module, base_url, headers, title):
@@ -275,6 +284,10 @@ def action(module, base_url, headers):
 
 def get_token(module, endpoint, username, password, allow_http):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -304,9 +317,10 @@ def get_token(module, endpoint, username, password, allow_http):
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            endpoint=dict(type='str'),
+            endpoint=dict(type='raw'),
             graylog_user=dict(type='str'),
             graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
             validate_certs=dict(type='bool', required=False, default=True),
             allow_http=dict(type='bool', required=False, default=False),
             action=dict(type='str', required=False, default='create',
@@ -338,7 +352,7 @@ def main():
         )
     )
 
-    endpoint = module.params['endpoint']
+    endpoint = register_nodes(module.params['endpoint'])
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     allow_http = module.params['allow_http']
@@ -18,8 +18,10 @@ options:
   endpoint:
     description:
       - Graylog endpoint. (i.e. graylog.mydomain.com:9000).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
   graylog_user:
     description:
       - Graylog privileged user username, used to auth with Graylog API.
@@ -30,6 +32,12 @@ options:
       - Graylog privileged user password, used to auth with Graylog API.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -45,9 +53,13 @@ options:
   action:
     description:
       - Action to take against LDAP API.
+      - C(update) compares the settings with the current ones first and only writes them when they differ, the
+        before and after values are returned in C(diff).
+      - C(test_users) looks up every user of I(test_users) with the given settings, I(concurrency) at a time, and
+        reports the result and latency of each lookup along with the bind and search times.
     required: true
     default: get
-    choices: [ get, update, delete, test ]
+    choices: [ get, update, delete, test, test_users ]
     type: str
   enabled:
     description:
@@ -132,8 +144,29 @@ options:
   group_mapping:
     description:
       - Additional roles assigned to LDAP group
+      - A dict of group to role name, or a list of C({group: role}) or C({group: ..., role: ...}) dicts.
+    required: false
+    type: raw
+  fingerprint_file:
+    description:
+      - Local JSON file recording a salted PBKDF2 hash of the system_password last written by action update.
+      - Graylog never returns the password, without this file a given I(system_password) is always written.
+    required: false
+    type: path
+  test_users:
+    description:
+      - Users looked up by action test_users, either principals or dicts with C(principal) and C(password), the
+        login is tested as well when a password is given.
+      - The passwords are masked in the module output.
     required: false
     type: list
+    elements: raw
+  concurrency:
+    description:
+      - Number of lookups run at the same time by action test_users.
+    required: false
+    default: 4
+    type: int
 '''
 
 EXAMPLES = '''
@@ -186,13 +219,60 @@ EXAMPLES = '''
     system_password_set: "true"
     system_username: "ldapbind@mydomain.com"
     system_password: "bindPassw0rd"
+    fingerprint_file: "{{ playbook_dir }}/.graylog-ldap.json"
+
+# Validate a new LDAP server with sample users before switching to it
+- graylog_ldap:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    action: "test_users"
+    active_directory: "true"
+    ldap_uri: "ldaps://newdc.mydomain.com:636"
+    system_username: "ldapbind@mydomain.com"
+    system_password: "bindPassw0rd"
+    search_base: "cn=users,dc=mydomain,dc=com"
+    search_pattern: "(&(objectClass=user)(sAMAccountName={0}))"
+    test_users: "{{ lookup('file', 'sample_analysts.txt').splitlines() + [ldap_check_user] }}"
+    concurrency: 16
+  vars:
+    ldap_check_user:
+      principal: "svc-graylog-check"
+      password: "{{ vault_ldap_check_password }}"
+  register: ldap_test
+  failed_when: ldap_test.json.not_found > 0 or ldap_test.json.lookup_ms.p95 > 500
 '''
 
 # import module snippets
 import json
 import base64
+import binascii
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_stats
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_fingerprint import UNCHANGED, load_state, save_state
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+# Connection only tests run to measure the bind time
+BIND_SAMPLES = 3
+
+TEST_KEYS = [ 'system_username', 'system_password', 'ldap_uri', 'use_start_tls', 'trust_all_certificates', \
+              'active_directory', 'search_base', 'search_pattern', 'group_search_base', 'group_id_attribute', \
+              'group_search_pattern' ]
+
+UPDATE_KEYS = [ 'enabled', 'active_directory', 'ldap_uri', 'use_start_tls', 'trust_all_certificates', \
+                'system_password_set', 'system_username', 'system_password', 'search_base', 'search_pattern', \
+                'display_name_attribute', 'group_search_base', 'group_search_pattern', 'group_id_attribute', \
+                'default_group', 'group_mapping' ]
+
+MASKED = "********"
+
+PASSWORD_HASH_ITERATIONS = 200000
 
 
 def get(module, base_url, headers):
@@ -233,14 +313,7 @@ def test(module, base_url, headers):
 
     url = base_url + "/test"
 
-    payload = {}
-
-    for key in [ 'system_username', 'system_password', 'ldap_uri', 'use_start_tls', 'trust_all_certificates', \
-                 'active_directory', 'search_base', 'search_pattern', 'group_search_base', 'group_id_attribute', \
-                 'group_search_pattern' ]:
-        if module.params[key] is not None:
-            payload[key] = module.params[key]
-
+    payload = test_payload(module)
     payload['test_connect_only'] = "true"
 
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
@@ -261,33 +334,209 @@ def test(module, base_url, headers):
     return info['status'], info['msg'], content, url
 
 
+def test_payload(module):
+
+    payload = {}
+
+    for key in TEST_KEYS:
+        if module.params[key] is not None:
+            payload[key] = module.params[key]
+
+    return payload
+
+
+def timed_test(module, url, headers, payload):
+
+    started = time.time()
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+    elapsed = time.time() - started
+
+    result = None
+    if info['status'] == 200:
+        try:
+            result = json.loads(to_text(response.read(), errors='surrogate_or_strict'))
+        except (AttributeError, ValueError):
+            result = None
+
+    return result, info, elapsed
+
+
+def test_users(module, base_url, headers):
+
+    url = base_url + "/test"
+
+    users = []
+    for user in module.params['test_users'] or []:
+        if isinstance(user, dict):
+            if not user.get('principal'):
+                module.fail_json(msg="Fail: test_users entry without principal, keys: %s" % ", ".join(sorted(user)))
+            users.append({'principal': user['principal'], 'password': user.get('password')})
+        else:
+            users.append({'principal': "%s" % user, 'password': None})
+
+    def bind(index):
+        payload = test_payload(module)
+        payload['test_connect_only'] = True
+        return timed_test(module, url, headers, payload)
+
+    def lookup(user):
+        payload = test_payload(module)
+        payload['test_connect_only'] = False
+        payload['principal'] = user['principal']
+        if user['password'] is not None:
+            payload['password'] = user['password']
+        return timed_test(module, url, headers, payload)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, module.params['concurrency']))
+    try:
+        binds = [bind_result for bind_result in executor.map(bind, range(BIND_SAMPLES))]
+        lookups = [lookup_result for lookup_result in executor.map(lookup, users)]
+    finally:
+        executor.shutdown(wait=True)
+
+    result = {}
+    result['users'] = []
+    for user, (test_result, info, elapsed) in zip(users, lookups):
+        entry = {}
+        entry['principal'] = user['principal']
+        entry['latency_ms'] = round(elapsed * 1000, 1)
+        if test_result is None:
+            entry['connected'] = False
+            entry['found'] = False
+            entry['error'] = "Status: " + str(info['msg']) + ", Message: " + str(info.get('body'))
+        else:
+            entry['connected'] = test_result.get('connected', False)
+            entry['found'] = bool(test_result.get('entry'))
+            entry['groups'] = len(test_result.get('groups') or [])
+            entry['error'] = test_result.get('exception')
+            if user['password'] is not None:
+                entry['login_authenticated'] = test_result.get('login_authenticated', False)
+        result['users'].append(entry)
+
+    bind_times = [elapsed for test_result, info, elapsed in binds if test_result is not None and test_result.get('connected')]
+    lookup_times = [elapsed for test_result, info, elapsed in lookups if test_result is not None and test_result.get('connected')]
+
+    result['tested'] = len(users)
+    result['found'] = len([entry for entry in result['users'] if entry['found']])
+    result['not_found'] = len([entry for entry in result['users'] if entry['connected'] and not entry['found']])
+    result['errors'] = len([entry for entry in result['users'] if not entry['connected']])
+    result['failed_logins'] = len([entry for entry in result['users'] if entry.get('login_authenticated') is False])
+    result['bind_ms'] = graylog_stats.summarize(bind_times)
+    result['lookup_ms'] = graylog_stats.summarize(lookup_times)
+    # A lookup is a bind followed by the user and group searches
+    if result['bind_ms'] is not None and result['lookup_ms'] is not None:
+        result['search_ms'] = round(max(result['lookup_ms']['p50'] - result['bind_ms']['p50'], 0), 3)
+    else:
+        result['search_ms'] = None
+
+    return 200, "OK", module.jsonify(result), url
+
+
+def differs(value, current_value):
+
+    if isinstance(value, list) and isinstance(current_value, list):
+        return sorted(value, key=json.dumps) != sorted(current_value, key=json.dumps)
+
+    return value != current_value
+
+
+def group_mapping(value):
+
+    # Graylog returns the mapping as a dict of group to role, the module also takes it as a list
+    if value is None or isinstance(value, dict):
+        return value
+
+    mapping = {}
+    for item in value:
+        if 'group' in item and 'role' in item:
+            mapping[item['group']] = item['role']
+        else:
+            mapping.update(item)
+
+    return mapping
+
+
+def password_hash(password, salt):
+
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PASSWORD_HASH_ITERATIONS)
+
+    return binascii.hexlify(digest).decode('ascii')
+
+
+def password_matches(recorded, password):
+
+    # recorded is the salt and PBKDF2 hash stored when the password was last written
+    if not isinstance(recorded, dict) or 'salt' not in recorded or 'hash' not in recorded:
+        return False
+
+    return password_hash(password, binascii.unhexlify(recorded['salt'])) == recorded['hash']
+
+
 def update(module, base_url, headers):
 
     url = base_url + "/settings"
 
     payload = {}
 
-    for key in ['enabled', 'active_directory', 'ldap_uri', 'use_start_tls', 'trust_all_certificates', \
-                'system_password_set', 'system_username', 'system_password', 'search_base', 'search_pattern', \
-                'display_name_attribute', 'group_search_base', 'group_search_pattern', 'group_id_attribute', \
-                'default_group', 'group_mapping', 'enabled', 'active_directory' ]:
+    for key in UPDATE_KEYS:
         if module.params[key] is not None:
             payload[key] = module.params[key]
-    
+
+    if 'group_mapping' in payload:
+        payload['group_mapping'] = group_mapping(payload['group_mapping'])
+
+    # No content when LDAP was never configured
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] not in [200, 204]:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    current = {}
+    if info['status'] == 200:
+        current = json.loads(to_text(response.read(), errors='surrogate_or_strict') or "{}") or {}
+
+    state = load_state(module.params['fingerprint_file'])
+    state_key = base_url + "/system_password"
+
+    before = {}
+    after = {}
+    for key in payload:
+        if key in ['system_password', 'system_password_set']:
+            continue
+        if differs(payload[key], current.get(key)):
+            before[key] = current.get(key)
+            after[key] = payload[key]
+
+    # The password is write-only, it is compared with the hash recorded when it was last written
+    if 'system_password' in payload:
+        if not current.get('system_password_set') or not password_matches(state.get(state_key), payload['system_password']):
+            before['system_password'] = MASKED if current.get('system_password_set') else None
+            after['system_password'] = MASKED + " (changed)"
+
+    diff = {'before': before, 'after': after}
+
+    if len(after) == 0:
+        return 200, UNCHANGED, module.jsonify(diff), url
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT', data=module.jsonify(payload))
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
 
-    try:
-        content = to_text(response.read(), errors='surrogate_or_strict')
-    except AttributeError:
-        content = info.pop('body', '')
+    if module.params['fingerprint_file'] is not None and 'system_password' in payload:
+        salt = os.urandom(16)
+        state[state_key] = {'salt': binascii.hexlify(salt).decode('ascii'), 'hash': password_hash(payload['system_password'], salt)}
+        save_state(module.params['fingerprint_file'], state)
+
+    return info['status'], info['msg'], module.jsonify(diff), url
 
-    return info['status'], info['msg'], content, url
 
 def get_token(module, endpoint, username, password, allow_http):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -318,11 +567,12 @@ def get_token(module, endpoint, username, password, allow_http):
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            endpoint=dict(type='str'),
+            endpoint=dict(type='raw'),
             graylog_user=dict(type='str'),
             graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
             action=dict(type='str', required=False, default='get', 
-                        choices=['get', 'update', 'delete', 'test']),
+                        choices=['get', 'update', 'delete', 'test', 'test_users']),
             allow_http=dict(type='bool', required=False, default=False),
             validate_certs=dict(type='bool', required=False, default=True),
             enabled=dict(type='bool', required=False, default=False),
@@ -340,11 +590,19 @@ def main():
             group_search_pattern=dict(type='str', required=False),
             group_id_attribute=dict(type='str', required=False),
             default_group=dict(type='str', required=False, default='Reader'),
-            group_mapping=dict(type='list', required=False)
+            group_mapping=dict(type='raw', required=False),
+            fingerprint_file=dict(type='path', required=False),
+            test_users=dict(type='list', elements='raw', required=False),
+            concurrency=dict(type='int', required=False, default=4)
         )
     )
 
-    endpoint = module.params['endpoint']
+    # test_users mixes principals and dicts, their passwords can't be marked no_log in the argument spec
+    for user in module.params['test_users'] or []:
+        if isinstance(user, dict) and user.get('password'):
+            module.no_log_values.add(user['password'])
+
+    endpoint = register_nodes(module.params['endpoint'])
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     action = module.params['action']
@@ -369,6 +627,8 @@ def main():
         status, message, content, url = delete(module, base_url, headers)
     elif action == "test":
         status, message, content, url = test(module, base_url, headers)
+    elif action == "test_users":
+        status, message, content, url = test_users(module, base_url, headers)
        
     uresp = {}
     content = to_text(content, encoding='UTF-8')
@@ -383,6 +643,10 @@ def main():
     uresp['msg'] = message
     uresp['url'] = url
 
+    if action == "update":
+        uresp['changed'] = message != UNCHANGED
+        uresp['diff'] = js
+
     module.exit_json(**uresp)
 
 
@@ -0,0 +1,334 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_loadgen_gelf
+short_description: Send synthetic GELF traffic to a Graylog input
+description:
+    - Generates GELF messages at a target rate from several worker processes to check that an input created with
+      M(graylog_input_gelf) sustains it, and reports the achieved throughput, send latencies and drops.
+    - Drops are counted on a local stand-in receiver with I(local_receiver), or from the incomingMessages counter of
+      the Graylog input given with I(input_id).
+    - Send latency is the time spent in the socket send for UDP and TCP, and the request round trip for HTTP.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
+      - Only used to read the counter of I(input_id).
+    required: false
+    type: raw
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate, for the Graylog API and the TLS connections to the input.
+    required: false
+    default: false
+    type: bool
+  host:
+    description:
+      - Address of the GELF input. Required unless I(local_receiver) is set.
+    required: false
+    type: str
+  port:
+    description:
+      - Port of the GELF input.
+    required: false
+    default: 12201
+    type: int
+  protocol:
+    description:
+      - UDP chunks the datagrams bigger than I(chunk_size), TCP sends null delimited frames and HTTP posts one
+        message per request on a kept alive connection.
+    required: false
+    default: UDP
+    choices: [ UDP, TCP, HTTP ]
+    type: str
+  tls:
+    description:
+      - Use TLS for the TCP and HTTP protocols.
+    required: false
+    default: false
+    type: bool
+  compression:
+    description:
+      - Compression of the UDP datagrams or HTTP bodies. GELF TCP does not support compression.
+    required: false
+    default: none
+    choices: [ none, gzip, zlib ]
+    type: str
+  chunk_size:
+    description:
+      - Maximum UDP datagram size, header included, bigger messages are sent in up to 128 chunks.
+    required: false
+    default: 8192
+    type: int
+  message_size:
+    description:
+      - Number of padding characters added to the short_message of each message.
+    required: false
+    default: 200
+    type: int
+  source:
+    description:
+      - Host field of the messages.
+    required: false
+    default: graylog-loadgen
+    type: str
+  template:
+    description:
+      - GELF fields added to every message, or replacing the generated ones. String values are formatted with
+        C({seq}), C({worker}), C({random}), C({pid}) and C({host}).
+    required: false
+    type: dict
+  rate:
+    description:
+      - Target messages per second over all the workers, 0 sends as fast as possible.
+    required: false
+    default: 1000
+    type: int
+  duration:
+    description:
+      - Seconds to send for, unless I(count) is given.
+    required: false
+    default: 10
+    type: int
+  count:
+    description:
+      - Total number of messages to send.
+    required: false
+    type: int
+  workers:
+    description:
+      - Number of sending processes, each sends its share of I(rate) on its own connection.
+    required: false
+    default: 2
+    type: int
+  timeout:
+    description:
+      - Connection and request timeout, in seconds.
+    required: false
+    default: 10
+    type: int
+  local_receiver:
+    description:
+      - Send to a stand-in receiver started on 127.0.0.1 instead of I(host), which counts the complete messages
+        it gets. TLS is not used with the local receiver.
+    required: false
+    default: false
+    type: bool
+  input_id:
+    description:
+      - ID of the Graylog input under test, its message counter is read before and after the run to count drops.
+    required: false
+    type: str
+  drain_timeout:
+    description:
+      - Seconds to wait after the run for the receiver or the input counter to catch up.
+    required: false
+    default: 10
+    type: int
+'''
+
+EXAMPLES = '''
+# Check a GELF UDP input sustains 20k msg/s, counting the drops on the Graylog side
+- graylog_loadgen_gelf:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    input_id: "{{ gelf_input.json.id }}"
+    host: "graylog.mydomain.com"
+    protocol: "UDP"
+    compression: "gzip"
+    rate: 20000
+    workers: 4
+    duration: 60
+  register: load
+  failed_when: load.json.drop_rate > 0.001
+
+# Check the generator itself against a local receiver
+- graylog_loadgen_gelf:
+    local_receiver: true
+    protocol: "TCP"
+    count: 100000
+    rate: 0
+'''
+
+RETURN = '''
+json:
+  description: Load test report
+  returned: always
+  type: dict
+  sample: {
+    "target": "graylog.mydomain.com:12201/UDP",
+    "target_rate": 20000,
+    "sent": 1199871,
+    "bytes": 301167621,
+    "errors": 0,
+    "last_error": null,
+    "elapsed": 60.012,
+    "messages_per_second": 19993.8,
+    "megabytes_per_second": 4.786,
+    "latency_ms": {"p50": 0.011, "p95": 0.024, "p99": 0.051, "max": 2.113},
+    "workers": [{"worker": 0, "sent": 299968, "errors": 0, "messages_per_second": 4998.5}],
+    "received": 1199012,
+    "dropped": 859,
+    "drop_rate": 0.00072
+  }
+'''
+
+
+# import module snippets
+import json
+import base64
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_loadgen
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            host=dict(type='str'),
+            port=dict(type='int', default=12201),
+            protocol=dict(type='str', default='UDP', choices=['UDP', 'TCP', 'HTTP']),
+            tls=dict(type='bool', default=False),
+            compression=dict(type='str', default='none', choices=['none', 'gzip', 'zlib']),
+            chunk_size=dict(type='int', default=8192),
+            message_size=dict(type='int', default=200),
+            source=dict(type='str', default='graylog-loadgen'),
+            template=dict(type='dict'),
+            rate=dict(type='int', default=1000),
+            duration=dict(type='int', default=10),
+            count=dict(type='int'),
+            workers=dict(type='int', default=2),
+            timeout=dict(type='int', default=10),
+            local_receiver=dict(type='bool', default=False),
+            input_id=dict(type='str'),
+            drain_timeout=dict(type='int', default=10)
+        ),
+        required_if=[['local_receiver', False, ['host']]],
+        required_by={'input_id': ['endpoint']}
+    )
+
+    if module.params['protocol'] == 'TCP' and module.params['compression'] != 'none':
+        module.fail_json(msg="Fail: GELF TCP does not support compression")
+    if module.params['chunk_size'] <= graylog_loadgen.GELF_CHUNK_HEADER:
+        module.fail_json(msg="Fail: chunk_size must be bigger than the %d bytes chunk header" % graylog_loadgen.GELF_CHUNK_HEADER)
+
+    config = {
+        'kind': 'gelf',
+        'host': module.params['host'],
+        'port': module.params['port'],
+        'protocol': module.params['protocol'],
+        'path': "/gelf",
+        'tls': module.params['tls'],
+        'validate_certs': module.params['validate_certs'],
+        'timeout': module.params['timeout'],
+        'compression': module.params['compression'],
+        'chunk_size': module.params['chunk_size'],
+        'message_size': module.params['message_size'],
+        'source': module.params['source'],
+        'template': module.params['template']
+    }
+
+    endpoint = None
+    headers = None
+    if module.params['input_id'] is not None and not module.params['local_receiver']:
+        endpoint = register_nodes(module.params['endpoint'])
+        graylog_user = module.params['graylog_user']
+        graylog_password = module.params['graylog_password']
+        allow_http = module.params['allow_http']
+
+        if allow_http == True:
+          endpoint = "http://" + endpoint
+        else:
+          endpoint = "https://" + endpoint
+
+        api_token = get_token(module, endpoint, graylog_user, graylog_password)
+        headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+    report = graylog_loadgen.measure(module, config, endpoint, headers)
+
+    uresp = {}
+    uresp['json'] = report
+    uresp['msg'] = "OK"
+    uresp['url'] = report['target']
+
+    module.exit_json(**uresp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_loadgen_syslog
+short_description: Send synthetic syslog traffic to a Graylog input
+description:
+    - Generates RFC3164 or RFC5424 syslog messages at a target rate from several worker processes to check that an
+      input created with M(graylog_input_rsyslog) sustains it, and reports the achieved throughput, send latencies
+      and drops.
+    - Drops are counted on a local stand-in receiver with I(local_receiver), or from the incomingMessages counter of
+      the Graylog input given with I(input_id).
+    - Send latency is the time spent in the socket send.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
+      - Only used to read the counter of I(input_id).
+    required: false
+    type: raw
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate, for the Graylog API and the TLS connections to the input.
+    required: false
+    default: false
+    type: bool
+  host:
+    description:
+      - Address of the syslog input. Required unless I(local_receiver) is set.
+    required: false
+    type: str
+  port:
+    description:
+      - Port of the syslog input.
+    required: false
+    default: 514
+    type: int
+  protocol:
+    description:
+      - UDP sends one message per datagram, TCP frames the messages according to I(framing).
+    required: false
+    default: UDP
+    choices: [ UDP, TCP ]
+    type: str
+  framing:
+    description:
+      - TCP framing, C(octet_counting) prefixes each message with its length (RFC6587), C(newline) and C(null)
+        terminate it with a line feed or a null byte, C(null) matches inputs with C(use_null_delimiter).
+    required: false
+    default: octet_counting
+    choices: [ octet_counting, newline, null ]
+    type: str
+  tls:
+    description:
+      - Use TLS for the TCP protocol.
+    required: false
+    default: false
+    type: bool
+  format:
+    description:
+      - Syslog message format.
+    required: false
+    default: rfc5424
+    choices: [ rfc3164, rfc5424 ]
+    type: str
+  facility:
+    description:
+      - Syslog facility code, local0 by default.
+    required: false
+    default: 16
+    type: int
+  severity:
+    description:
+      - Syslog severity code, informational by default.
+    required: false
+    default: 6
+    type: int
+  source:
+    description:
+      - Hostname of the messages.
+    required: false
+    default: graylog-loadgen
+    type: str
+  app_name:
+    description:
+      - Application name (RFC5424) or tag (RFC3164) of the messages.
+    required: false
+    default: loadgen
+    type: str
+  msg_id:
+    description:
+      - MSGID of the RFC5424 messages.
+    required: false
+    default: "-"
+    type: str
+  message_size:
+    description:
+      - Number of padding characters added to the generated message text.
+    required: false
+    default: 200
+    type: int
+  template:
+    description:
+      - Message text replacing the generated one, formatted with C({seq}), C({worker}), C({random}), C({pid})
+        and C({host}), for instance to replay firewall lines.
+    required: false
+    type: str
+  rate:
+    description:
+      - Target messages per second over all the workers, 0 sends as fast as possible.
+    required: false
+    default: 1000
+    type: int
+  duration:
+    description:
+      - Seconds to send for, unless I(count) is given.
+    required: false
+    default: 10
+    type: int
+  count:
+    description:
+      - Total number of messages to send.
+    required: false
+    type: int
+  workers:
+    description:
+      - Number of sending processes, each sends its share of I(rate) on its own connection.
+    required: false
+    default: 2
+    type: int
+  timeout:
+    description:
+      - Connection and request timeout, in seconds.
+    required: false
+    default: 10
+    type: int
+  local_receiver:
+    description:
+      - Send to a stand-in receiver started on 127.0.0.1 instead of I(host), which counts the complete messages
+        it gets. TLS is not used with the local receiver.
+    required: false
+    default: false
+    type: bool
+  input_id:
+    description:
+      - ID of the Graylog input under test, its message counter is read before and after the run to count drops.
+    required: false
+    type: str
+  drain_timeout:
+    description:
+      - Seconds to wait after the run for the receiver or the input counter to catch up.
+    required: false
+    default: 10
+    type: int
+'''
+
+EXAMPLES = '''
+# Size a syslog TCP input for 80k msg/s of firewall logs, counting the drops on the Graylog side
+- graylog_loadgen_syslog:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    input_id: "{{ syslog_input.json.id }}"
+    host: "graylog.mydomain.com"
+    port: 1514
+    protocol: "TCP"
+    tls: true
+    format: "rfc3164"
+    app_name: "filterlog"
+    template: "5,,,1000000103,igb0,match,block,in,4,0x0,,64,{seq},0,none,6,tcp,60,10.0.{worker}.1,10.1.0.{random}"
+    rate: 80000
+    workers: 8
+    duration: 120
+  register: load
+  failed_when: load.json.drop_rate > 0.001
+
+# Check the generator itself against a local receiver
+- graylog_loadgen_syslog:
+    local_receiver: true
+    protocol: "TCP"
+    framing: "null"
+    count: 100000
+    rate: 0
+'''
+
+RETURN = '''
+json:
+  description: Load test report
+  returned: always
+  type: dict
+  sample: {
+    "target": "graylog.mydomain.com:1514/TCP",
+    "target_rate": 80000,
+    "sent": 9598812,
+    "bytes": 1641396852,
+    "errors": 0,
+    "last_error": null,
+    "elapsed": 120.008,
+    "messages_per_second": 79984.1,
+    "megabytes_per_second": 13.043,
+    "latency_ms": {"p50": 0.004, "p95": 0.012, "p99": 0.033, "max": 4.201},
+    "workers": [{"worker": 0, "sent": 1199851, "errors": 0, "messages_per_second": 9998.1}],
+    "received": 9598812,
+    "dropped": 0,
+    "drop_rate": 0.0
+  }
+'''
+
+
+# import module snippets
+import json
+import base64
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_loadgen
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            host=dict(type='str'),
+            port=dict(type='int', default=514),
+            protocol=dict(type='str', default='UDP', choices=['UDP', 'TCP']),
+            framing=dict(type='str', default='octet_counting', choices=['octet_counting', 'newline', 'null']),
+            tls=dict(type='bool', default=False),
+            format=dict(type='str', default='rfc5424', choices=['rfc3164', 'rfc5424']),
+            facility=dict(type='int', default=16),
+            severity=dict(type='int', default=6),
+            source=dict(type='str', default='graylog-loadgen'),
+            app_name=dict(type='str', default='loadgen'),
+            msg_id=dict(type='str', default='-'),
+            message_size=dict(type='int', default=200),
+            template=dict(type='str'),
+            rate=dict(type='int', default=1000),
+            duration=dict(type='int', default=10),
+            count=dict(type='int'),
+            workers=dict(type='int', default=2),
+            timeout=dict(type='int', default=10),
+            local_receiver=dict(type='bool', default=False),
+            input_id=dict(type='str'),
+            drain_timeout=dict(type='int', default=10)
+        ),
+        required_if=[['local_receiver', False, ['host']]],
+        required_by={'input_id': ['endpoint']}
+    )
+
+    if module.params['protocol'] == 'UDP' and module.params['tls']:
+        module.fail_json(msg="Fail: TLS needs the TCP protocol")
+    if not 0 <= module.params['facility'] <= 23 or not 0 <= module.params['severity'] <= 7:
+        module.fail_json(msg="Fail: facility must be between 0 and 23 and severity between 0 and 7")
+
+    config = {
+        'kind': 'syslog',
+        'host': module.params['host'],
+        'port': module.params['port'],
+        'protocol': module.params['protocol'],
+        'framing': module.params['framing'],
+        'tls': module.params['tls'],
+        'validate_certs': module.params['validate_certs'],
+        'timeout': module.params['timeout'],
+        'format': module.params['format'],
+        'facility': module.params['facility'],
+        'severity': module.params['severity'],
+        'source': module.params['source'],
+        'app_name': module.params['app_name'],
+        'msg_id': module.params['msg_id'],
+        'message_size': module.params['message_size'],
+        'template': module.params['template']
+    }
+
+    endpoint = None
+    headers = None
+    if module.params['input_id'] is not None and not module.params['local_receiver']:
+        endpoint = register_nodes(module.params['endpoint'])
+        graylog_user = module.params['graylog_user']
+        graylog_password = module.params['graylog_password']
+        allow_http = module.params['allow_http']
+
+        if allow_http == True:
+          endpoint = "http://" + endpoint
+        else:
+          endpoint = "https://" + endpoint
+
+        api_token = get_token(module, endpoint, graylog_user, graylog_password)
+        headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+    report = graylog_loadgen.measure(module, config, endpoint, headers)
+
+    uresp = {}
+    uresp['json'] = report
+    uresp['msg'] = "OK"
+    uresp['url'] = report['target']
+
+    module.exit_json(**uresp)
+
+
+if __name__ == '__main__':
+    main()
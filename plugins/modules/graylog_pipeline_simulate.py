@@ -0,0 +1,329 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_pipeline_simulate
+short_description: Run Graylog processing pipelines over sample messages
+description:
+    - Runs pipelines stage by stage over a file of sample messages, without sending anything to Graylog, and
+      reports the processed messages and what each rule costs.
+    - The rules, pipelines and grok patterns are read from the Graylog API, or given with I(rules) and
+      I(pipelines) to check changes before applying them.
+    - Rules are compiled once. In each stage the conditions of all the rules are evaluated before the actions
+      of the matching ones and the match mode of the stage decides if the pipeline goes on, as on the server.
+    - Only a subset of the functions is supported (has_field, set_field, set_fields, remove_field,
+      rename_field, drop_message, route_to_stream, to_string, to_long, to_double, to_bool, to_map, is_null,
+      is_not_null, is_string, is_number, is_bool, contains, starts_with, ends_with, lowercase, uppercase,
+      capitalize, abbreviate, substring, concat, split, regex, regex_replace, grok, key_value, parse_json,
+      cidr_match, to_ip, now and debug). A rule of the simulated pipelines calling another function fails the
+      module, the rules no simulated pipeline uses are not compiled.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
+      - Only used when I(rules) or I(pipelines) is not given.
+    required: false
+    type: raw
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate
+    required: false
+    default: false
+    type: bool
+  rules:
+    description:
+      - Sources of the rules.
+    required: false
+    type: list
+  pipelines:
+    description:
+      - Sources of the pipelines.
+    required: false
+    type: list
+  pipeline_titles:
+    description:
+      - Only run the pipelines with these titles.
+    required: false
+    type: list
+  grok_patterns:
+    description:
+      - Grok patterns added to the built-in ones, by name.
+    required: false
+    type: dict
+  messages_file:
+    description:
+      - Sample messages, one JSON object per line.
+    required: true
+    type: path
+  output_file:
+    description:
+      - File the processed messages are written to, one JSON object per line. Dropped messages are left out
+        and the streams a message is routed to are in its C(streams) field.
+    required: false
+    type: path
+  sample_outputs:
+    description:
+      - Number of processed messages returned.
+    required: false
+    default: 5
+    type: int
+'''
+
+EXAMPLES = '''
+# Measure the current pipelines
+- graylog_pipeline_simulate:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    messages_file: "/data/sample-1M.jsonl"
+
+# Check a rule before deploying it
+- graylog_pipeline_simulate:
+    rules:
+      - "{{ lookup('file', 'rules/parse_nginx.rule') }}"
+    pipelines:
+      - |
+        pipeline "nginx"
+        stage 0 match either
+        rule "parse nginx";
+        end
+    messages_file: "/data/nginx-sample.jsonl"
+    output_file: "/tmp/nginx-parsed.jsonl"
+  register: simulation
+  failed_when: simulation.json.rules | selectattr('errors', 'gt', 0) | list | length > 0
+'''
+
+RETURN = '''
+json:
+  description: Processing results, rules are sorted by total time
+  returned: always
+  type: dict
+  sample: {
+    "messages": 1000000,
+    "dropped": 12034,
+    "rules": [{"rule": "parse nginx", "evaluations": 1000000, "matches": 412034, "errors": 0, "last_error": null,
+               "when_ms": 812.2, "then_ms": 5120.7, "total_ms": 5932.9, "ns_per_evaluation": 5932}],
+    "stages": [{"pipeline": "nginx", "stage": 0, "entered": 1000000, "passed": 412034}],
+    "samples": [{"message": "GET /api/users 200", "method": "GET", "path": "/api/users", "status": 200}],
+    "elapsed": 7.31,
+    "messages_per_second": 136798
+  }
+'''
+
+
+# import module snippets
+import json
+import base64
+import time
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_pipeline_interpreter, graylog_pipeline_rules
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+def fetch(module, url, headers):
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+    except AttributeError:
+        content = info.pop('body', '')
+
+    return json.loads(content or "null")
+
+
+def fetch_sources(module, endpoint, headers):
+
+    rules = module.params['rules']
+    if rules is None:
+        rules = [rule['source'] for rule in fetch(module, endpoint + "/api/system/pipelines/rule", headers)]
+
+    pipelines = module.params['pipelines']
+    if pipelines is None:
+        pipelines = [pipeline['source'] for pipeline in fetch(module, endpoint + "/api/system/pipelines/pipeline", headers)]
+
+    grok_patterns = dict((pattern['name'], pattern['pattern'])
+                         for pattern in (fetch(module, endpoint + "/api/system/grok", headers) or {}).get('patterns', []))
+
+    return rules, pipelines, grok_patterns
+
+
+def read_messages(module, path):
+
+    with open(path) as f:
+        for number, line in enumerate(f):
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                module.fail_json(msg="Fail: %s line %d is not a JSON message: %s" % (path, number + 1, e))
+
+
+def interpreter(module, rules, pipelines, grok_patterns):
+
+    grok_patterns.update(module.params['grok_patterns'] or {})
+
+    try:
+        if module.params['pipeline_titles'] is not None:
+            pipelines = [source for source in pipelines
+                         if graylog_pipeline_rules.parse_pipeline(source)['name'] in module.params['pipeline_titles']]
+        return graylog_pipeline_interpreter.Interpreter(rules, pipelines, grok_patterns)
+    except graylog_pipeline_rules.RuleSyntaxError as e:
+        module.fail_json(msg="Fail: %s" % ("Syntax error: " + str(e)), line=e.line, column=e.column)
+    except (graylog_pipeline_interpreter.UnsupportedFunction, graylog_pipeline_interpreter.EvaluationError) as e:
+        module.fail_json(msg="Fail: %s" % str(e))
+
+
+def simulate(module, rules, pipelines, grok_patterns):
+
+    pipeline_interpreter = interpreter(module, rules, pipelines, grok_patterns)
+    samples = []
+    output = open(module.params['output_file'], 'w') if module.params['output_file'] else None
+
+    started = time.time()
+    try:
+        for message in read_messages(module, module.params['messages_file']):
+            message = pipeline_interpreter.process(message)
+            if message is None:
+                continue
+            if len(samples) < module.params['sample_outputs']:
+                samples.append(message)
+            if output is not None:
+                output.write(json.dumps(message, default=str) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.time() - started
+
+    result = pipeline_interpreter.result()
+    result['samples'] = samples
+    result['elapsed'] = round(elapsed, 3)
+    result['messages_per_second'] = int(pipeline_interpreter.messages / elapsed) if elapsed > 0 else 0
+
+    return result
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            rules=dict(type='list'),
+            pipelines=dict(type='list'),
+            pipeline_titles=dict(type='list'),
+            grok_patterns=dict(type='dict'),
+            messages_file=dict(type='path', required=True),
+            output_file=dict(type='path'),
+            sample_outputs=dict(type='int', default=5)
+        ),
+        supports_check_mode=True
+    )
+
+    url = module.params['messages_file']
+
+    if module.params['rules'] is not None and module.params['pipelines'] is not None:
+        rules, pipelines, grok_patterns = module.params['rules'], module.params['pipelines'], {}
+    else:
+        endpoint = register_nodes(module.params['endpoint'])
+        graylog_user = module.params['graylog_user']
+        graylog_password = module.params['graylog_password']
+        allow_http = module.params['allow_http']
+
+        if allow_http == True:
+          endpoint = "http://" + endpoint
+        else:
+          endpoint = "https://" + endpoint
+
+        api_token = get_token(module, endpoint, graylog_user, graylog_password)
+        headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+        rules, pipelines, grok_patterns = fetch_sources(module, endpoint, headers)
+        url = endpoint + "/api/system/pipelines"
+
+    uresp = {}
+    uresp['json'] = simulate(module, rules, pipelines, grok_patterns)
+    uresp['msg'] = "OK"
+    uresp['url'] = url
+
+    module.exit_json(**uresp)
+
+
+if __name__ == '__main__':
+    main()
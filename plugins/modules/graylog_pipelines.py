@@ -20,8 +20,18 @@ options:
   endpoint:
     description:
       - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
+  clusters:
+    description:
+      - Endpoints of several clusters, each a host or the list of the nodes of a cluster, used instead of
+        I(endpoint).
+      - The module runs the same action against every cluster concurrently, the results are then returned by
+        cluster in C(clusters) and the clusters that failed in C(failed_clusters).
+    required: false
+    type: list
   graylog_user:
     description:
       - Graylog privileged user username.
@@ -32,6 +42,12 @@ options:
       - Graylog privileged user password.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -44,13 +60,46 @@ options:
     required: false
     default: false
     type: bool
+  rate_limit:
+    description:
+      - Maximum number of requests per second sent to the cluster, unlimited by default.
+    required: false
+    type: float
+  pressure_check:
+    description:
+      - Check the journal and buffer utilization of the cluster nodes before writing.
+      - Above half of I(max_journal_utilization) or I(max_buffer_utilization) writes go at half I(rate_limit),
+        above the limits they wait for the cluster to catch up.
+    required: false
+    default: false
+    type: bool
+  max_journal_utilization:
+    description:
+      - Journal utilization, in percent, above which writes wait when I(pressure_check) is enabled.
+    required: false
+    default: 50
+    type: int
+  max_buffer_utilization:
+    description:
+      - Input, process or output buffer utilization, in percent, above which writes wait when I(pressure_check)
+        is enabled.
+    required: false
+    default: 80
+    type: int
+  pressure_timeout:
+    description:
+      - Seconds to wait for the cluster to get under the limits before failing.
+    required: false
+    default: 300
+    type: int
   action:
     description:
       - Action to take against pipeline API.
     required: false
     default: list
     choices: [ create, create_connection, parse_pipeline, parse_rule, create_rule, update,
-                update_connection, update_rule, delete, delete_rule, list, list_rules, query_rules, query_pipelines ]
+                update_connection, update_rule, delete, delete_rule, list, list_rules, query_rules, query_pipelines,
+                reconcile_connections, rule_metrics ]
     type: str
   pipeline_id:
     description:
@@ -92,6 +141,60 @@ options:
       - Rule source.
     required: false
     type: str
+  fingerprint:
+    description:
+      - With actions create, create_rule, update and update_rule, store a hash of the desired title, description and
+        source at the end of the description as C([fingerprint:<hash>]).
+      - Updates of objects that already have the desired title, description and source are skipped.
+    required: false
+    default: false
+    type: bool
+  queue_file:
+    description:
+      - Queue the writes of the create, create_rule, create_connection, update, update_rule, update_connection,
+        delete and delete_rule actions in this local file instead of sending them. M(graylog_flush) coalesces and
+        applies the queue.
+      - A queued create returns a placeholder id that the following tasks can use until the queue is flushed.
+      - Queued updates only hold the given values and are skipped at flush time when the pipeline or rule already
+        has them, I(fingerprint) is not checked.
+    required: false
+    type: path
+  local_validation:
+    description:
+      - With actions parse_rule and parse_pipeline, check the syntax of I(source) locally first and fail
+        without contacting Graylog when it is invalid.
+    required: false
+    default: true
+    type: bool
+  server_validation:
+    description:
+      - With actions parse_rule and parse_pipeline, send I(source) to Graylog for the semantic checks
+        (unknown functions, argument types, ...) once the local syntax check passed.
+      - When false, no request is made to Graylog and the result of the local parse is returned.
+    required: false
+    default: true
+    type: bool
+  connections:
+    description:
+      - Desired stream to pipelines topology for action reconcile_connections.
+      - List of dicts with C(stream_id) and C(pipeline_ids), streams that are not listed keep their current pipelines.
+      - Current connections are fetched once and only streams (or pipelines) whose connections differ are posted,
+        using whichever of the to_stream or to_pipeline endpoints needs the fewest requests.
+    required: false
+    type: list
+  sort_by:
+    description:
+      - With action rule_metrics, rank the rules by total time spent (evaluating the conditions and running the
+        actions) or by match rate, highest first.
+    required: false
+    default: total_time
+    choices: [ total_time, match_rate ]
+    type: str
+  top:
+    description:
+      - With action rule_metrics, only return the first I(top) rules of the ranking.
+    required: false
+    type: int
 '''
 
 EXAMPLES = '''
@@ -116,6 +219,14 @@ EXAMPLES = '''
          set_fields(dns_query_intel);
       end
 
+# Check the syntax of many rules without loading the Graylog server
+- graylog_pipelines:
+    action: parse_rule
+    server_validation: false
+    source: "{{ lookup('file', item) }}"
+  with_fileglob:
+    - "rules/*.rule"
+
 # Create pipeline rule
 - graylog_pipelines:
     action: create_rule
@@ -145,6 +256,18 @@ EXAMPLES = '''
     rule "test_rule_domain_threat_intel
     end
 
+# Update a rule only when its content changed
+- graylog_pipelines:
+    action: update_rule
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    rule_id: "{{ rule.json.id }}"
+    title: "test_rule"
+    description: "test"
+    fingerprint: true
+    source: "{{ lookup('file', 'rules/test_rule.rule') }}"
+
 # Create pipeline with new rule
 - graylog_pipelines:
     action: create
@@ -196,6 +319,29 @@ EXAMPLES = '''
     graylog_password: "password"
     pipeline_id: "{{ pipeline.json.id }}"
     stream_ids: []
+
+# Reconcile the connections of several streams at once, nothing is posted when already in place
+- graylog_pipelines:
+    action: reconcile_connections
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    connections:
+      - stream_id: "{{ windows_stream.json.id }}"
+        pipeline_ids:
+          - "{{ threat_pipeline.json.id }}"
+          - "{{ enrichment_pipeline.json.id }}"
+      - stream_id: "{{ linux_stream.json.id }}"
+        pipeline_ids: []
+
+# The 20 rules that cost the most processing time across the cluster
+- graylog_pipelines:
+    action: rule_metrics
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    top: 20
+  register: slow_rules
 '''
 
 RETURN = '''
@@ -256,7 +402,38 @@ url:
 import json
 import base64
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_clusters import run_on_clusters
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_pipeline_rules, graylog_queue
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_fingerprint import (UNCHANGED, fingerprint, strip_fingerprint,
+                                                                                       with_fingerprint)
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url
+
+
+RULE_METRICS = "org.graylog.plugins.pipelineprocessor.ast.Rule"
+
+PIPELINE_KEYS = ['title', 'description', 'source']
+
+
+def apply_fingerprint(module, payload, current):
+
+    # Returns True when current already matches payload, otherwise stamps the fingerprint of payload in its description
+    if not module.params['fingerprint']:
+        return False
+
+    desired = dict(payload)
+    desired['description'] = strip_fingerprint(desired.get('description'))
+    value = fingerprint(desired)
+
+    # The stored fingerprint is not trusted, the object may have been changed since it was written
+    if current is not None:
+        if strip_fingerprint(current.get('description')) == desired['description'] and \
+                all(current.get(key) == desired[key] for key in desired if key != 'description'):
+            return True
+
+    payload['description'] = with_fingerprint(desired['description'], value)
+
+    return False
 
 
 def create(module, pipeline_url, headers):
@@ -269,6 +446,11 @@ def create(module, pipeline_url, headers):
         if module.params[key] is not None:
             payload[key] = module.params[key]
 
+    apply_fingerprint(module, payload, None)
+
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'pipeline', 'create', 'POST', url, payload)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), timeout=20, method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
@@ -292,6 +474,9 @@ def create_connection(module, connection_url, headers):
         if module.params[key] is not None:
             payload[key] = module.params[key]
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'pipeline_connection', 'set', 'POST', url, payload, ref=module.params['pipeline_id'])
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
@@ -305,10 +490,25 @@ def create_connection(module, connection_url, headers):
     return info['status'], info['msg'], content, url
 
 
+def parse_locally(module, parse):
+
+    try:
+        return parse(module.params['source'] or "")
+    except graylog_pipeline_rules.RuleSyntaxError as e:
+        module.fail_json(msg="Fail: %s" % ("Syntax error: " + str(e)), line=e.line, column=e.column)
+
+
 def parse_rule(module, rule_url, headers):
 
     url = "/".join([rule_url, "parse"])
 
+    if module.params['local_validation']:
+        rule = parse_locally(module, graylog_pipeline_rules.parse_rule)
+
+        if not module.params['server_validation']:
+            payload = {'title': rule['name'], 'source': module.params['source']}
+            return 200, "OK (local)", module.jsonify(payload), url
+
     payload = {}
 
     for key in ['source']:
@@ -332,6 +532,16 @@ def parse_pipeline(module, pipeline_url, headers):
 
     url = "/".join([pipeline_url, "parse"])
 
+    if module.params['local_validation']:
+        pipeline = parse_locally(module, graylog_pipeline_rules.parse_pipeline)
+
+        if not module.params['server_validation']:
+            stages = []
+            for stage in pipeline['stages']:
+                stages.append({'stage': stage['stage'], 'match_all': stage['match'] == "all", 'rules': stage['rules']})
+            payload = {'title': pipeline['name'], 'source': module.params['source'], 'stages': stages}
+            return 200, "OK (local)", module.jsonify(payload), url
+
     payload = {}
 
     for key in ['source']:
@@ -361,6 +571,11 @@ def create_rule(module, rule_url, headers):
         if module.params[key] is not None:
             payload[key] = module.params[key]
 
+    apply_fingerprint(module, payload, None)
+
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'pipeline_rule', 'create', 'POST', url, payload)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), timeout=20, method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
@@ -383,6 +598,12 @@ def update(module, pipeline_url, headers):
     else:
         url = pipeline_url
 
+    if module.params['queue_file'] is not None:
+        for key in PIPELINE_KEYS:
+            if module.params[key] is not None:
+                payload[key] = module.params[key]
+        return graylog_queue.enqueue(module, 'pipeline', 'update', 'PUT', url, payload, ref=module.params['pipeline_id'], keys=PIPELINE_KEYS)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
 
     if info['status'] != 200:
@@ -403,6 +624,13 @@ def update(module, pipeline_url, headers):
     if module.params['source'] is None:
         payload['source'] = payload_current['source']
 
+    if module.params['fingerprint']:
+        for key in ['title', 'description']:
+            if key not in payload:
+                payload[key] = strip_fingerprint(payload_current.get(key))
+        if apply_fingerprint(module, payload, payload_current):
+            return info['status'], UNCHANGED, content, url
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), timeout=20, method='PUT', data=module.jsonify(payload))
 
     if info['status'] != 200:
@@ -426,6 +654,9 @@ def update_connection(module, connection_url, headers):
         if module.params[key] is not None:
             payload[key] = module.params[key]
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'pipeline_connection', 'set', 'POST', url, payload, ref=module.params['pipeline_id'])
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
@@ -449,6 +680,24 @@ def update_rule(module, rule_url, headers):
         if module.params[key] is not None:
             payload[key] = module.params[key]
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'pipeline_rule', 'update', 'PUT', url, payload, ref=module.params['rule_id'], keys=PIPELINE_KEYS)
+
+    if module.params['fingerprint']:
+        response, info = fetch_url(module=module, url=url, headers=json.loads(headers), timeout=20, method='GET')
+
+        if info['status'] != 200:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        payload_current = json.loads(content)
+
+        for key in ['title', 'description', 'source']:
+            if key not in payload:
+                payload[key] = strip_fingerprint(payload_current.get(key)) if key == 'description' else payload_current.get(key)
+        if apply_fingerprint(module, payload, payload_current):
+            return info['status'], UNCHANGED, content, url
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT', timeout=20, data=module.jsonify(payload))
 
     if info['status'] != 200:
@@ -462,10 +711,77 @@ def update_rule(module, rule_url, headers):
     return info['status'], info['msg'], content, url
 
 
+def reconcile_connections(module, connection_url, headers):
+
+    url = connection_url
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), timeout=20, method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        connections = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+        connections = []
+
+    current_streams = {}
+    for connection in connections:
+        current_streams[connection['stream_id']] = set(connection['pipeline_ids'])
+
+    desired_streams = {}
+    for connection in module.params['connections']:
+        desired_streams[connection['stream_id']] = set(connection.get('pipeline_ids') or [])
+
+    # Streams whose pipeline set changes, for the to_stream endpoint
+    changed_streams = [stream_id for stream_id in sorted(desired_streams)
+                       if desired_streams[stream_id] != current_streams.get(stream_id, set())]
+
+    # The same changes seen from the pipelines side, for the to_pipeline endpoint
+    final_streams = dict(current_streams)
+    final_streams.update(desired_streams)
+    current_pipelines = {}
+    final_pipelines = {}
+    for streams, pipelines in [(current_streams, current_pipelines), (final_streams, final_pipelines)]:
+        for stream_id in streams:
+            for pipeline_id in streams[stream_id]:
+                pipelines.setdefault(pipeline_id, set()).add(stream_id)
+    changed_pipelines = [pipeline_id for pipeline_id in sorted(set(current_pipelines) | set(final_pipelines))
+                         if current_pipelines.get(pipeline_id, set()) != final_pipelines.get(pipeline_id, set())]
+
+    requests = []
+    if len(changed_pipelines) < len(changed_streams):
+        for pipeline_id in changed_pipelines:
+            requests.append(("/".join([connection_url, "to_pipeline"]),
+                             {'pipeline_id': pipeline_id, 'stream_ids': sorted(final_pipelines.get(pipeline_id, set()))}))
+    else:
+        for stream_id in changed_streams:
+            requests.append(("/".join([connection_url, "to_stream"]),
+                             {'stream_id': stream_id, 'pipeline_ids': sorted(desired_streams[stream_id])}))
+
+    posted = []
+    for request_url, payload in requests:
+        response, info = fetch_url(module=module, url=request_url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+        if info['status'] != 200:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])), posted=posted)
+
+        posted.append(payload)
+
+    content = module.jsonify({'changed_streams': changed_streams, 'posted': posted})
+
+    return 200, "OK", content, url
+
+
 def delete(module, pipeline_url, headers, pipeline_id):
 
     url = "/".join([pipeline_url, pipeline_id])
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'pipeline', 'delete', 'DELETE', url, ref=pipeline_id)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
 
     if info['status'] != 204:
@@ -483,6 +799,9 @@ def delete_rule(module, rule_url, headers, rule_id):
 
     url = "/".join([rule_url, rule_id])
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'pipeline_rule', 'delete', 'DELETE', url, ref=rule_id)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
 
     if info['status'] != 204:
@@ -598,8 +917,123 @@ def query_rules(module, rule_url, headers, rule_name):
     return rule_id
 
 
+def metric_total(metric):
+
+    if metric is None:
+        return None
+
+    if metric['type'] in ["meter", "timer"]:
+        return metric['metric']['rate']['total']
+    elif metric['type'] == "counter":
+        return metric['metric']['count']
+
+    return None
+
+
+def rule_metric_names(rule_id):
+
+    base = RULE_METRICS + "." + rule_id
+    return {
+        'executed': base + ".executed",
+        'matched': base + ".matched",
+        'not_matched': base + ".not-matched",
+        'failed': base + ".failed",
+        'evaluate': base + ".trace.evaluate.duration",
+        'execute': base + ".trace.execute.duration"
+    }
+
+
+def rule_metrics(module, endpoint, rule_url, headers):
+
+    status, message, content, url = list_rules(module, rule_url, headers, module.params['rule_id'], "no")
+    rules = json.loads(content)
+    if isinstance(rules, dict):
+        rules = [rules]
+
+    names = []
+    for rule in rules:
+        names.extend(rule_metric_names(rule['id']).values())
+
+    url = endpoint + "/api/cluster/metrics/multiple"
+
+    payload = {}
+    payload['metrics'] = names
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload), timeout=60)
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        nodes = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+        nodes = {}
+
+    # { metric_name: [metric of each node] }
+    metrics = {}
+    for node_id in nodes:
+        if nodes[node_id] is None:
+            continue
+        for metric in nodes[node_id]['metrics']:
+            metrics.setdefault(metric['full_name'], []).append(metric)
+
+    timing_enabled = False
+    result = []
+    for rule in rules:
+        names = rule_metric_names(rule['id'])
+
+        entry = {}
+        entry['id'] = rule['id']
+        entry['title'] = rule['title']
+        for key in ['executed', 'matched', 'not_matched', 'failed']:
+            entry[key] = sum(metric_total(metric) or 0 for metric in metrics.get(names[key], []))
+        evaluated = entry['matched'] + entry['not_matched']
+        entry['evaluated'] = evaluated
+        entry['match_rate'] = round(float(entry['matched']) / evaluated, 4) if evaluated > 0 else None
+
+        # Timers are only registered when rule metrics are enabled in the pipeline configuration, their
+        # durations are in microseconds and a node's total is its mean times its count
+        for key in ['evaluate', 'execute']:
+            total = 0.0
+            for metric in metrics.get(names[key], []):
+                timing_enabled = True
+                total += metric['metric']['time']['mean'] * metric_total(metric)
+            entry[key + '_time_ms'] = round(total / 1000, 3)
+        entry['total_time_ms'] = round(entry['evaluate_time_ms'] + entry['execute_time_ms'], 3)
+        entry['mean_evaluate_us'] = round(entry['evaluate_time_ms'] * 1000 / evaluated, 3) if evaluated > 0 else None
+
+        result.append(entry)
+
+    if module.params['sort_by'] == "match_rate":
+        result.sort(key=lambda entry: (entry['match_rate'] or 0, entry['total_time_ms']), reverse=True)
+    else:
+        result.sort(key=lambda entry: (entry['total_time_ms'], entry['evaluated']), reverse=True)
+
+    total_time = sum(entry['total_time_ms'] for entry in result)
+    for rank, entry in enumerate(result):
+        entry['rank'] = rank + 1
+        entry['time_share'] = round(entry['total_time_ms'] / total_time, 4) if total_time > 0 else None
+
+    if module.params['top'] is not None:
+        result = result[:module.params['top']]
+
+    summary = {}
+    summary['nodes'] = len([node_id for node_id in nodes if nodes[node_id] is not None])
+    summary['timing_enabled'] = timing_enabled
+    summary['total_time_ms'] = round(total_time, 3)
+    summary['rules'] = result
+
+    return 200, "OK", module.jsonify(summary), url
+
+
 def get_token(module, endpoint, username, password):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -628,29 +1062,8 @@ def get_token(module, endpoint, username, password):
     return session_token
 
 
-def main():
-    module = AnsibleModule(
-        argument_spec=dict(
-            endpoint=dict(type='str'),
-            graylog_user=dict(type='str'),
-            graylog_password=dict(type='str', no_log=True),
-            allow_http=dict(type='bool', required=False, default=False),
-            validate_certs=dict(type='bool', required=False, default=True),
-            action=dict(type='str', required=False, default='list',
-                        choices=['create', 'create_connection', 'parse_pipeline', 'parse_rule', 'create_rule', 'update', 'update_connection',
-                                 'update_rule', 'delete', 'delete_rule', 'list', 'list_rules', 'query_rules', 'query_pipelines']),
-            pipeline_id=dict(type='str'),
-            pipeline_name=dict(type='str'),
-            rule_id=dict(type='str'),
-            rule_name=dict(type='str'),
-            stream_ids=dict(type='list'),
-            title=dict(type='str'),
-            description=dict(type='str'),
-            source=dict(type='str')
-        )
-    )
+def run(module, endpoint):
 
-    endpoint = module.params['endpoint']
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     action = module.params['action']
@@ -669,8 +1082,12 @@ def main():
     rule_url = endpoint + "/api/system/pipelines/rule"
     connection_url = endpoint + "/api/system/pipelines/connections"
 
-    api_token = get_token(module, endpoint, graylog_user, graylog_password)
-    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+    # A local only parse does not talk to Graylog, don't open a session for it
+    if action in ["parse_rule", "parse_pipeline"] and module.params['local_validation'] and not module.params['server_validation']:
+        headers = None
+    else:
+        api_token = get_token(module, endpoint, graylog_user, graylog_password)
+        headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
                 "Authorization": "Basic ' + api_token.decode() + '" }'
 
     if action == "create":
@@ -687,6 +1104,8 @@ def main():
         status, message, content, url = update(module, pipeline_url, headers)
     elif action == "update_connection":
         status, message, content, url = update_connection(module, connection_url, headers)
+    elif action == "reconcile_connections":
+        status, message, content, url = reconcile_connections(module, connection_url, headers)
     elif action == "update_rule":
         status, message, content, url = update_rule(module, rule_url, headers)
     elif action == "delete":
@@ -707,6 +1126,8 @@ def main():
         rule_id = query_rules(module, rule_url, headers, rule_name)
         query = "yes"
         status, message, content, url = list_rules(module, rule_url, headers, rule_id, query)
+    elif action == "rule_metrics":
+        status, message, content, url = rule_metrics(module, endpoint, rule_url, headers)
 
     uresp = {}
     content = to_text(content, encoding='UTF-8')
@@ -721,7 +1142,53 @@ def main():
     uresp['msg'] = message
     uresp['url'] = url
 
-    module.exit_json(**uresp)
+    if action == "reconcile_connections":
+        uresp['changed'] = len(js['posted']) > 0
+    elif module.params['fingerprint'] and action in ["update", "update_rule"]:
+        uresp['changed'] = message != UNCHANGED
+
+    return uresp
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            clusters=dict(type='list'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            rate_limit=dict(type='float'),
+            pressure_check=dict(type='bool', default=False),
+            max_journal_utilization=dict(type='int', default=50),
+            max_buffer_utilization=dict(type='int', default=80),
+            pressure_timeout=dict(type='int', default=300),
+            action=dict(type='str', required=False, default='list',
+                        choices=['create', 'create_connection', 'parse_pipeline', 'parse_rule', 'create_rule', 'update', 'update_connection',
+                                 'update_rule', 'delete', 'delete_rule', 'list', 'list_rules', 'query_rules', 'query_pipelines',
+                                 'reconcile_connections', 'rule_metrics']),
+            pipeline_id=dict(type='str'),
+            pipeline_name=dict(type='str'),
+            rule_id=dict(type='str'),
+            rule_name=dict(type='str'),
+            stream_ids=dict(type='list'),
+            title=dict(type='str'),
+            description=dict(type='str'),
+            source=dict(type='str'),
+            fingerprint=dict(type='bool', default=False),
+            queue_file=dict(type='path'),
+            local_validation=dict(type='bool', default=True),
+            server_validation=dict(type='bool', default=True),
+            connections=dict(type='list'),
+            sort_by=dict(type='str', default='total_time', choices=['total_time', 'match_rate']),
+            top=dict(type='int')
+        ),
+        mutually_exclusive=[['endpoint', 'clusters']]
+    )
+
+    run_on_clusters(module, run)
 
 
 if __name__ == '__main__':
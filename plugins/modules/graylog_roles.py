@@ -20,8 +20,10 @@ options:
   endpoint:
     description:
       - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
   graylog_user:
     description:
       - Graylog privileged user username.
@@ -32,6 +34,12 @@ options:
       - Graylog privileged user password.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -44,6 +52,38 @@ options:
     required: false
     default: false
     type: bool          
+  rate_limit:
+    description:
+      - Maximum number of requests per second sent to the cluster, unlimited by default.
+    required: false
+    type: float
+  pressure_check:
+    description:
+      - Check the journal and buffer utilization of the cluster nodes before writing.
+      - Above half of I(max_journal_utilization) or I(max_buffer_utilization) writes go at half I(rate_limit),
+        above the limits they wait for the cluster to catch up.
+    required: false
+    default: false
+    type: bool
+  max_journal_utilization:
+    description:
+      - Journal utilization, in percent, above which writes wait when I(pressure_check) is enabled.
+    required: false
+    default: 50
+    type: int
+  max_buffer_utilization:
+    description:
+      - Input, process or output buffer utilization, in percent, above which writes wait when I(pressure_check)
+        is enabled.
+    required: false
+    default: 80
+    type: int
+  pressure_timeout:
+    description:
+      - Seconds to wait for the cluster to get under the limits before failing.
+    required: false
+    default: 300
+    type: int
   action:
     description:
       - Action to take against role API.
@@ -158,7 +198,8 @@ url:
 import json
 import base64
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
 
 
 def create(module, base_url, headers):
@@ -243,6 +284,10 @@ def list(module, base_url, headers):
 
 def get_token(module, endpoint, username, password):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -274,11 +319,17 @@ def get_token(module, endpoint, username, password):
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            endpoint=dict(type='str'),
+            endpoint=dict(type='raw'),
             graylog_user=dict(type='str'),
             graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
             allow_http=dict(type='bool', required=False, default=False),
             validate_certs=dict(type='bool', required=False, default=True),
+            rate_limit=dict(type='float'),
+            pressure_check=dict(type='bool', default=False),
+            max_journal_utilization=dict(type='int', default=50),
+            max_buffer_utilization=dict(type='int', default=80),
+            pressure_timeout=dict(type='int', default=300),
             action=dict(type='str', default='list', choices=['create', 'update', 'delete', 'list']),
             name=dict(type='str'),
             description=dict(type='str'),
@@ -287,7 +338,7 @@ def main():
         )
     )
 
-    endpoint = module.params['endpoint']
+    endpoint = register_nodes(module.params['endpoint'])
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     allow_http = module.params['allow_http']
@@ -0,0 +1,309 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_search_benchmark
+short_description: Measure how expensive Graylog searches are
+description:
+    - Runs a list of searches over their time ranges and streams several times and reports, per search, the
+      round trip latency percentiles, the time Elasticsearch took and the hit count.
+    - Running it before and after changing the C(shards), C(replicas) or C(index_optimization_max_num_segments) of
+      index sets with M(graylog_index_sets), with the first result given as I(baseline) to the second run, shows the
+      effect of the change.
+    - Relative time ranges are pinned to absolute times at the start, so every run of a search covers the same
+      messages.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
+    required: false
+    type: raw
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate
+    required: false
+    default: false
+    type: bool
+  queries:
+    description:
+      - Searches to run, dicts with C(name), C(query) and optionally C(streams) (IDs), C(range) (seconds before
+        now, 3600 by default) or C(from_time) and C(to_time).
+    required: true
+    type: list
+  repeat:
+    description:
+      - Number of measured runs of each search.
+    required: false
+    default: 5
+    type: int
+  warmup:
+    description:
+      - Number of runs of each search before measuring, to load the caches.
+    required: false
+    default: 1
+    type: int
+  limit:
+    description:
+      - Number of messages returned by each search.
+    required: false
+    default: 100
+    type: int
+  baseline:
+    description:
+      - C(json) result of a previous run, the change of the median latency and took time is then reported
+        for the searches of the same name.
+    required: false
+    type: dict
+  timeout:
+    description:
+      - Timeout of each search, in seconds.
+    required: false
+    default: 60
+    type: int
+'''
+
+EXAMPLES = '''
+- name: Benchmark the common searches before the shard change
+  graylog_search_benchmark:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    repeat: 10
+    queries:
+      - name: "failed logins, last day"
+        query: "event_id:4625"
+        range: 86400
+      - name: "firewall blocks, one week"
+        query: "action:block AND NOT src_ip:10.0.0.0/8"
+        streams: [ "5bc7666089675c7f7d7f08d7" ]
+        from_time: "2024-03-01T00:00:00.000Z"
+        to_time: "2024-03-08T00:00:00.000Z"
+  register: before
+
+- name: Halve the shards of the busiest index set
+  graylog_index_sets:
+    action: update
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    id: "{{ firewall_index_set.json.id }}"
+    shards: 2
+
+- name: Benchmark them again
+  graylog_search_benchmark:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    repeat: 10
+    queries: "{{ common_queries }}"
+    baseline: "{{ before.json }}"
+'''
+
+RETURN = '''
+json:
+  description: Benchmark results
+  returned: always
+  type: dict
+  sample: {
+    "searches": [{
+      "name": "failed logins, last day",
+      "query": "event_id:4625",
+      "from": "2024-03-07T10:00:00.000Z",
+      "to": "2024-03-08T10:00:00.000Z",
+      "runs": 10,
+      "hits": 18332,
+      "hits_stable": true,
+      "used_indices": 2,
+      "latency_ms": {"min": 81.2, "p50": 95.4, "p95": 140.1, "p99": 140.1, "max": 140.1, "mean": 99.8},
+      "took_ms": {"min": 60.0, "p50": 72.0, "p95": 118.0, "p99": 118.0, "max": 118.0, "mean": 77.3},
+      "change": {"latency_p50": -0.31, "took_p50": -0.38}
+    }],
+    "elapsed": 12.4
+  }
+'''
+
+
+# import module snippets
+import json
+import base64
+import time
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_search, graylog_stats
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+def change(after, before):
+
+    if after is None or not before:
+        return None
+
+    return round((after - before) / before, 3)
+
+
+def benchmark(module, endpoint, headers, search):
+
+    params = module.params
+    from_time, to_time = graylog_search.time_range(search.get('range', 3600), search.get('from_time'), search.get('to_time'))
+    query = graylog_search.build_query(search.get('query'), search.get('streams'))
+
+    latencies = []
+    took = []
+    hits = []
+    used_indices = 0
+    for run in range(params['warmup'] + params['repeat']):
+        result, elapsed = graylog_search.search(module, endpoint, headers, query, from_time, to_time, params['limit'],
+                                                timeout=params['timeout'])
+        if run < params['warmup']:
+            continue
+        latencies.append(elapsed)
+        # Graylog reports the time Elasticsearch took in milliseconds
+        took.append(result.get('time', 0) / 1000.0)
+        hits.append(result.get('total_results'))
+        used_indices = len(result.get('used_indices') or [])
+
+    entry = {}
+    entry['name'] = search.get('name') or search.get('query')
+    entry['query'] = query
+    entry['from'] = from_time
+    entry['to'] = to_time
+    entry['runs'] = len(latencies)
+    entry['hits'] = hits[-1] if hits else None
+    entry['hits_stable'] = len(set(hits)) <= 1
+    entry['used_indices'] = used_indices
+    entry['latency_ms'] = graylog_stats.summarize(latencies)
+    entry['took_ms'] = graylog_stats.summarize(took)
+
+    return entry
+
+
+def compare(searches, baseline):
+
+    previous = dict((search['name'], search) for search in (baseline or {}).get('searches', []))
+    for entry in searches:
+        before = previous.get(entry['name'])
+        if before is None or entry['latency_ms'] is None:
+            continue
+        entry['change'] = {
+            'latency_p50': change(entry['latency_ms']['p50'], (before.get('latency_ms') or {}).get('p50')),
+            'took_p50': change(entry['took_ms']['p50'], (before.get('took_ms') or {}).get('p50'))
+        }
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            queries=dict(type='list', required=True),
+            repeat=dict(type='int', default=5),
+            warmup=dict(type='int', default=1),
+            limit=dict(type='int', default=100),
+            baseline=dict(type='dict'),
+            timeout=dict(type='int', default=60)
+        ),
+        supports_check_mode=True
+    )
+
+    endpoint = register_nodes(module.params['endpoint'])
+    graylog_user = module.params['graylog_user']
+    graylog_password = module.params['graylog_password']
+    allow_http = module.params['allow_http']
+
+    if allow_http == True:
+      endpoint = "http://" + endpoint
+    else:
+      endpoint = "https://" + endpoint
+
+    api_token = get_token(module, endpoint, graylog_user, graylog_password)
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+    started = time.time()
+    searches = [benchmark(module, endpoint, headers, search) for search in module.params['queries']]
+    compare(searches, module.params['baseline'])
+
+    result = {}
+    result['searches'] = searches
+    result['elapsed'] = round(time.time() - started, 3)
+
+    uresp = {}
+    uresp['json'] = result
+    uresp['msg'] = "OK"
+    uresp['url'] = endpoint + "/api/search/universal/absolute"
+
+    module.exit_json(**uresp)
+
+
+if __name__ == '__main__':
+    main()
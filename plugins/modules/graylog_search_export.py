@@ -0,0 +1,359 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_search_export
+short_description: Export the messages matching a Graylog search to a file
+description:
+    - Streams the messages matching a query over a time range, optionally limited to some streams, to a local file.
+    - Memory stays bounded whatever the number of messages, results are written page by page or copied from the
+      export response in chunks.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
+    required: false
+    type: raw
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate
+    required: false
+    default: false
+    type: bool
+  query:
+    description:
+      - Search query, in the Graylog search syntax.
+    required: false
+    default: "*"
+    type: str
+  streams:
+    description:
+      - IDs of the streams to search in, all the streams by default.
+    required: false
+    type: list
+  range:
+    description:
+      - Relative time range, in seconds before now. Ignored when I(from_time) is given.
+    required: false
+    default: 3600
+    type: int
+  from_time:
+    description:
+      - Start of an absolute time range, e.g. C(2024-03-01T00:00:00.000Z).
+    required: false
+    type: str
+  to_time:
+    description:
+      - End of the absolute time range, now by default.
+    required: false
+    type: str
+  fields:
+    description:
+      - Fields to export, all of them by default. Required with I(format) csv and I(method) csv or views.
+    required: false
+    type: list
+  method:
+    description:
+      - C(paginate) walks the universal search API page by page in timestamp order and works on any number of
+        messages. C(csv) streams the legacy universal search CSV export, C(views) the CSV export of the
+        views API (Graylog 4 and later).
+    required: false
+    default: paginate
+    choices: [ paginate, csv, views ]
+    type: str
+  format:
+    description:
+      - Format of the file with I(method) paginate, one JSON message per line or CSV. The other methods
+        always write CSV.
+    required: false
+    default: jsonl
+    choices: [ jsonl, csv ]
+    type: str
+  dest:
+    description:
+      - File the messages are written to.
+    required: true
+    type: path
+  page_size:
+    description:
+      - Messages per search request with I(method) paginate, chunk size of the views export.
+    required: false
+    default: 1000
+    type: int
+  limit:
+    description:
+      - Maximum number of messages exported.
+    required: false
+    type: int
+  timeout:
+    description:
+      - Timeout of each search request, or of the whole export with the csv and views methods, in seconds.
+    required: false
+    default: 60
+    type: int
+'''
+
+EXAMPLES = '''
+# Incident response, every authentication message of the firewall streams during the incident
+- graylog_search_export:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    query: "event_type:authentication AND NOT user:svc_*"
+    streams:
+      - "5bc7666089675c7f7d7f08d7"
+      - "5bc7666089675c7f7d7f08d8"
+    from_time: "2024-03-01T00:00:00.000Z"
+    to_time: "2024-03-04T00:00:00.000Z"
+    dest: "/data/incident-4211/auth.jsonl"
+
+# Last hour of some fields, as CSV
+- graylog_search_export:
+    endpoint: "graylog.mydomain.com"
+    api_token: "{{ graylog_token }}"
+    query: "source:fw*"
+    range: 3600
+    fields: [ "timestamp", "source", "src_ip", "dst_ip", "action" ]
+    format: csv
+    dest: "/tmp/fw.csv"
+'''
+
+RETURN = '''
+json:
+  description: Export summary
+  returned: always
+  type: dict
+  sample: {
+    "dest": "/data/incident-4211/auth.jsonl",
+    "method": "paginate",
+    "query": "(event_type:authentication AND NOT user:svc_*) AND streams:(5bc7666089675c7f7d7f08d7 OR 5bc7666089675c7f7d7f08d8)",
+    "from": "2024-03-01T00:00:00.000Z",
+    "to": "2024-03-04T00:00:00.000Z",
+    "messages": 1204331,
+    "pages": 1205,
+    "bytes": 987244120,
+    "elapsed": 412.9,
+    "messages_per_second": 2916.7
+  }
+'''
+
+
+# import module snippets
+import csv
+import json
+import base64
+import time
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_search
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+def export_pages(module, endpoint, headers, query, from_time, to_time):
+
+    fields = module.params['fields']
+    messages = 0
+    pages = 0
+
+    with open(module.params['dest'], 'w') as f:
+        writer = None
+        if module.params['format'] == 'csv':
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+
+        for page in graylog_search.paginate(module, endpoint, headers, query, from_time, to_time, module.params['page_size'],
+                                            module.params['limit'], fields, module.params['timeout']):
+            pages += 1
+            messages += len(page)
+            for message in page:
+                if writer is not None:
+                    writer.writerow(message)
+                    continue
+                if fields:
+                    message = dict((field, message.get(field)) for field in fields)
+                f.write(json.dumps(message) + "\n")
+            f.flush()
+
+        size = f.tell()
+
+    return {'messages': messages, 'pages': pages, 'bytes': size}
+
+
+def export_csv(module, endpoint, headers, query, from_time, to_time):
+
+    params = [('query', query), ('from', from_time), ('to', to_time), ('fields', ",".join(module.params['fields']))]
+    if module.params['limit'] is not None:
+        params.append(('limit', module.params['limit']))
+
+    url = endpoint + "/api/search/universal/absolute/export?" + urlencode(params)
+
+    request_headers = json.loads(headers)
+    request_headers['Accept'] = "text/csv"
+
+    size, lines = graylog_search.download(module, url, request_headers, module.params['dest'], timeout=module.params['timeout'])
+
+    # The first line is the header
+    return {'messages': max(lines - 1, 0), 'pages': 1, 'bytes': size}
+
+
+def export_views(module, endpoint, headers, from_time, to_time):
+
+    payload = {}
+    payload['query_string'] = {'type': "elasticsearch", 'query_string': module.params['query'] or "*"}
+    payload['timerange'] = {'type': "absolute", 'from': from_time, 'to': to_time}
+    payload['streams'] = module.params['streams'] or []
+    payload['fields_in_order'] = module.params['fields']
+    payload['chunk_size'] = module.params['page_size']
+    if module.params['limit'] is not None:
+        payload['limit'] = module.params['limit']
+
+    url = endpoint + "/api/views/search/messages"
+
+    request_headers = json.loads(headers)
+    request_headers['Accept'] = "text/csv"
+
+    size, lines = graylog_search.download(module, url, request_headers, module.params['dest'], method='POST',
+                                          data=module.jsonify(payload), timeout=module.params['timeout'])
+
+    return {'messages': max(lines - 1, 0), 'pages': 1, 'bytes': size}
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            query=dict(type='str', default='*'),
+            streams=dict(type='list'),
+            range=dict(type='int', default=3600),
+            from_time=dict(type='str'),
+            to_time=dict(type='str'),
+            fields=dict(type='list'),
+            method=dict(type='str', default='paginate', choices=['paginate', 'csv', 'views']),
+            format=dict(type='str', default='jsonl', choices=['jsonl', 'csv']),
+            dest=dict(type='path', required=True),
+            page_size=dict(type='int', default=1000),
+            limit=dict(type='int'),
+            timeout=dict(type='int', default=60)
+        )
+    )
+
+    if module.params['fields'] is None and (module.params['method'] != 'paginate' or module.params['format'] == 'csv'):
+        module.fail_json(msg="Fail: fields is required to export CSV")
+
+    endpoint = register_nodes(module.params['endpoint'])
+    graylog_user = module.params['graylog_user']
+    graylog_password = module.params['graylog_password']
+    allow_http = module.params['allow_http']
+
+    if allow_http == True:
+      endpoint = "http://" + endpoint
+    else:
+      endpoint = "https://" + endpoint
+
+    api_token = get_token(module, endpoint, graylog_user, graylog_password)
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+    from_time, to_time = graylog_search.time_range(module.params['range'], module.params['from_time'], module.params['to_time'])
+    query = graylog_search.build_query(module.params['query'], module.params['streams'])
+
+    started = time.time()
+    if module.params['method'] == 'csv':
+        result = export_csv(module, endpoint, headers, query, from_time, to_time)
+    elif module.params['method'] == 'views':
+        result = export_views(module, endpoint, headers, from_time, to_time)
+    else:
+        result = export_pages(module, endpoint, headers, query, from_time, to_time)
+    elapsed = time.time() - started
+
+    result['dest'] = module.params['dest']
+    result['method'] = module.params['method']
+    result['query'] = query
+    result['from'] = from_time
+    result['to'] = to_time
+    result['elapsed'] = round(elapsed, 3)
+    result['messages_per_second'] = round(result['messages'] / elapsed, 1) if elapsed > 0 else 0
+
+    uresp = {}
+    uresp['json'] = result
+    uresp['changed'] = True
+    uresp['msg'] = "OK"
+    uresp['url'] = endpoint + "/api/search/universal/absolute"
+
+    module.exit_json(**uresp)
+
+
+if __name__ == '__main__':
+    main()
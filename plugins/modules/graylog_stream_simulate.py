@@ -0,0 +1,305 @@
+#!/usr/bin/python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+module: graylog_stream_simulate
+short_description: Simulate the Graylog stream routing of sample messages
+description:
+    - Evaluates stream rules against a file of sample messages, without sending anything to Graylog, and
+      reports which streams the messages land in and what each rule costs.
+    - The streams are read from the Graylog API, or given with I(streams) or I(streams_file) to check
+      routing changes before applying them.
+    - Messages are processed in batches. Each distinct rule is evaluated once per batch over the values of
+      its field and regexes are compiled once.
+version_added: "2.9"
+options:
+  endpoint:
+    description:
+      - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
+      - Only used when neither I(streams) nor I(streams_file) is given.
+    required: false
+    type: raw
+  graylog_user:
+    description:
+      - Graylog privileged user username.
+    required: false
+    type: str
+  graylog_password:
+    description:
+      - Graylog privileged user password.
+    required: false
+    type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
+  allow_http:
+    description:
+      - Allow non HTTPS connexion
+    required: false
+    default: false
+    type: bool
+  validate_certs:
+    description:
+      - Allow untrusted certificate
+    required: false
+    default: false
+    type: bool
+  streams:
+    description:
+      - Streams to simulate, in the format of the Graylog API (title, matching_type, rules, ...).
+    required: false
+    type: list
+  streams_file:
+    description:
+      - JSON or YAML file with the streams to simulate, either a list of streams or a document with a
+        C(streams) key such as the state of M(graylog_apply).
+    required: false
+    type: path
+  messages_file:
+    description:
+      - Sample messages, one JSON object per line.
+    required: true
+    type: path
+  batch_size:
+    description:
+      - Number of messages routed at a time.
+    required: false
+    default: 100000
+    type: int
+  include_disabled:
+    description:
+      - Also route to the paused streams.
+    required: false
+    default: false
+    type: bool
+  sample_matches:
+    description:
+      - Number of matching message line numbers (starting at 0) returned per stream.
+    required: false
+    default: 5
+    type: int
+'''
+
+EXAMPLES = '''
+# Check the routing of the current streams
+- graylog_stream_simulate:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    messages_file: "/data/sample-1M.jsonl"
+
+# Check a routing change before applying it
+- graylog_stream_simulate:
+    streams_file: "graylog/state.yml"
+    messages_file: "/data/sample-1M.jsonl"
+  register: routing
+  failed_when: (routing.json.streams | selectattr('title', 'equalto', 'Windows') | first).matches == 0
+'''
+
+RETURN = '''
+json:
+  description: Routing results
+  returned: always
+  type: dict
+  sample: {
+    "messages": 1000000,
+    "streams": [{"id": "5bc7666089675c7f7d7f08d7", "title": "Windows", "matches": 412034, "samples": [0, 3, 4, 7, 9]}],
+    "default_stream": 587966,
+    "unrouted": 587966,
+    "rules": [{"field": "source", "type": "regex", "value": "^win", "inverted": false, "streams": ["Windows"],
+               "matches": 412034, "time_ms": 210.4, "ns_per_message": 210}],
+    "field_extraction_ms": 95.1,
+    "elapsed": 1.52,
+    "messages_per_second": 657894
+  }
+'''
+
+
+# import module snippets
+import json
+import base64
+import time
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_stream_rules
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import fetch_url, register_nodes
+
+
+def fetch_streams(module, endpoint, headers):
+
+    url = endpoint + "/api/streams"
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        streams = json.loads(content)['streams']
+    except AttributeError:
+        content = info.pop('body', '')
+        streams = []
+
+    return streams
+
+
+def load_streams(module, path):
+
+    with open(path) as f:
+        content = f.read()
+
+    if path.endswith('.json'):
+        document = json.loads(content)
+    else:
+        import yaml
+        document = yaml.safe_load(content)
+
+    if isinstance(document, dict):
+        document = document.get('streams') or []
+
+    return document
+
+
+def read_batches(module, path, batch_size):
+
+    batch = []
+    with open(path) as f:
+        for number, line in enumerate(f):
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                batch.append(json.loads(line))
+            except ValueError as e:
+                module.fail_json(msg="Fail: %s line %d is not a JSON message: %s" % (path, number + 1, e))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+
+def simulate(module, streams):
+
+    if not module.params['include_disabled']:
+        streams = [stream for stream in streams if not stream.get('disabled', False)]
+
+    stats = graylog_stream_rules.RoutingStats(streams, module.params['sample_matches'])
+
+    started = time.time()
+    try:
+        for batch in read_batches(module, module.params['messages_file'], max(1, module.params['batch_size'])):
+            graylog_stream_rules.route(streams, batch, stats)
+    except graylog_stream_rules.UnsupportedRegex as e:
+        module.fail_json(msg="Fail: %s" % e)
+    elapsed = time.time() - started
+
+    result = stats.result()
+    result['elapsed'] = round(elapsed, 3)
+    result['messages_per_second'] = int(stats.messages / elapsed) if elapsed > 0 else 0
+
+    return result
+
+
+def get_token(module, endpoint, username, password):
+
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
+    headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
+
+    url = endpoint + "/api/system/sessions"
+
+    payload = {
+        'username': username,
+        'password': password,
+        'host': endpoint
+    }
+
+    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = to_text(response.read(), errors='surrogate_or_strict')
+        session = json.loads(content)
+    except AttributeError:
+        content = info.pop('body', '')
+
+    session_string = session['session_id'] + ":session"
+    session_bytes = session_string.encode('utf-8')
+    session_token = base64.b64encode(session_bytes)
+
+    return session_token
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            streams=dict(type='list'),
+            streams_file=dict(type='path'),
+            messages_file=dict(type='path', required=True),
+            batch_size=dict(type='int', default=100000),
+            include_disabled=dict(type='bool', default=False),
+            sample_matches=dict(type='int', default=5)
+        ),
+        mutually_exclusive=[['streams', 'streams_file']],
+        supports_check_mode=True
+    )
+
+    url = module.params['messages_file']
+
+    if module.params['streams'] is not None:
+        streams = module.params['streams']
+    elif module.params['streams_file'] is not None:
+        streams = load_streams(module, module.params['streams_file'])
+    else:
+        endpoint = register_nodes(module.params['endpoint'])
+        graylog_user = module.params['graylog_user']
+        graylog_password = module.params['graylog_password']
+        allow_http = module.params['allow_http']
+
+        if allow_http == True:
+          endpoint = "http://" + endpoint
+        else:
+          endpoint = "https://" + endpoint
+
+        api_token = get_token(module, endpoint, graylog_user, graylog_password)
+        headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json", \
+                "Authorization": "Basic ' + api_token.decode() + '" }'
+
+        streams = fetch_streams(module, endpoint, headers)
+        url = endpoint + "/api/streams"
+
+    uresp = {}
+    uresp['json'] = simulate(module, streams)
+    uresp['msg'] = "OK"
+    uresp['url'] = url
+
+    module.exit_json(**uresp)
+
+
+if __name__ == '__main__':
+    main()
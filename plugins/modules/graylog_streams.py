@@ -20,8 +20,18 @@ options:
   endpoint:
     description:
       - Graylog endoint. (i.e. graylog.mydomain.com).
+      - Or the list of the nodes of the cluster, reads are then spread over the healthy nodes, writes are sent
+        to the leader and a node that can't be reached fails over to the next one.
     required: false
-    type: str
+    type: raw
+  clusters:
+    description:
+      - Endpoints of several clusters, each a host or the list of the nodes of a cluster, used instead of
+        I(endpoint).
+      - The module runs the same action against every cluster concurrently, the results are then returned by
+        cluster in C(clusters) and the clusters that failed in C(failed_clusters).
+    required: false
+    type: list
   graylog_user:
     description:
       - Graylog privileged user username.
@@ -32,6 +42,12 @@ options:
       - Graylog privileged user password.
     required: false
     type: str
+  api_token:
+    description:
+      - Graylog access token, used instead of graylog_user and graylog_password.
+      - Requests authenticate with the token directly, no session is created.
+    required: false
+    type: str
   allow_http:
     description:
       - Allow non HTTPS connexion
@@ -44,12 +60,44 @@ options:
     required: false
     default: false
     type: bool      
+  rate_limit:
+    description:
+      - Maximum number of requests per second sent to the cluster, unlimited by default.
+    required: false
+    type: float
+  pressure_check:
+    description:
+      - Check the journal and buffer utilization of the cluster nodes before writing.
+      - Above half of I(max_journal_utilization) or I(max_buffer_utilization) writes go at half I(rate_limit),
+        above the limits they wait for the cluster to catch up.
+    required: false
+    default: false
+    type: bool
+  max_journal_utilization:
+    description:
+      - Journal utilization, in percent, above which writes wait when I(pressure_check) is enabled.
+    required: false
+    default: 50
+    type: int
+  max_buffer_utilization:
+    description:
+      - Input, process or output buffer utilization, in percent, above which writes wait when I(pressure_check)
+        is enabled.
+    required: false
+    default: 80
+    type: int
+  pressure_timeout:
+    description:
+      - Seconds to wait for the cluster to get under the limits before failing.
+    required: false
+    default: 300
+    type: int
   action:
     description:
       - Action to take against stream API.
     required: false
     default: list
-    choices: [ create, create_rule, start, pause, update, update_rule, delete, delete_rule, list, query_streams ]
+    choices: [ create, create_rule, start, pause, update, update_rule, delete, delete_rule, list, query_streams, analyze ]
     type: str
   title:
     description:
@@ -99,7 +147,7 @@ options:
     type: str
   type:
     description:
-      - Rule type for the stream rule, 1-7.
+      - Rule type for the stream rule, 1-8.
     required: false
     default: 1
     type: int
@@ -119,6 +167,42 @@ options:
       - List of rules associated with a stream.
     required: false
     type: list
+  stream_ids:
+    description:
+      - With action list, list of stream IDs whose details are fetched concurrently and returned as a list.
+    required: false
+    type: list
+  concurrency:
+    description:
+      - Maximum number of requests sent at the same time when listing I(stream_ids).
+    required: false
+    default: 8
+    type: int
+  transport:
+    description:
+      - How the concurrent requests are sent, C(asyncio) requires the aiohttp python library.
+    required: false
+    default: threads
+    choices: [ threads, asyncio ]
+    type: str
+  fingerprint:
+    description:
+      - With actions create and update, store a hash of the desired stream settings and rules at the end of the
+        description as C([fingerprint:<hash>]).
+      - Updates are skipped when the current stream already has the desired settings, its rules are not compared
+        as the update doesn't write them.
+    required: false
+    default: false
+    type: bool
+  queue_file:
+    description:
+      - Queue the writes of the create, update, delete, start and pause actions, and of their rule counterparts,
+        in this local file instead of sending them. M(graylog_flush) coalesces and applies the queue.
+      - A queued create returns a placeholder id that the following tasks can use until the queue is flushed.
+      - Queued updates only hold the given values and are skipped at flush time when the stream or rule already
+        has them, I(fingerprint) is not checked.
+    required: false
+    type: path
 '''
 
 EXAMPLES = '''
@@ -144,6 +228,15 @@ EXAMPLES = '''
     graylog_password: "password"
     stream_id: "{{ stream.json.id }}"
 
+# List the details of many streams with concurrent requests
+- graylog_streams:
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    stream_ids: "{{ stream_ids }}"
+    concurrency: 32
+    transport: asyncio
+
 # Create stream
 - graylog_streams:
     action: create
@@ -166,6 +259,17 @@ EXAMPLES = '''
     stream_id: "{{ stream.json.id }}"
     remove_matches_from_default_stream: True
 
+# Update stream, skipped when nothing changed since the last fingerprinted run
+- graylog_streams:
+    action: update
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+    stream_id: "{{ stream.json.id }}"
+    description: "Windows and IIS logs"
+    matching_type: "AND"
+    fingerprint: true
+
 # Create stream rule
 - graylog_streams:
     action: create_rule
@@ -221,6 +325,14 @@ EXAMPLES = '''
     graylog_user: "username"
     graylog_password: "password"
     stream_id: "{{ stream.json.id }}"
+
+# Rank the streams and rules by their estimated cost to the stream router
+- graylog_streams:
+    action: analyze
+    endpoint: "graylog.mydomain.com"
+    graylog_user: "username"
+    graylog_password: "password"
+  register: stream_analysis
 '''
 
 RETURN = '''
@@ -338,7 +450,28 @@ url:
 import json
 import base64
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.urls import fetch_url, to_text
+from ansible.module_utils.urls import to_text
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_clusters import run_on_clusters
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_queue, graylog_stream_rules
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_fingerprint import (UNCHANGED, fingerprint, strip_fingerprint,
+                                                                                       with_fingerprint)
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_transport import TRANSPORTS, fetch_url, fetch_urls
+
+
+STREAM_KEYS = ['title', 'description', 'remove_matches_from_default_stream', 'matching_type', 'index_set_id']
+
+STREAM_RULE_KEYS = ['field', 'type', 'value', 'inverted', 'description']
+
+
+def stream_fingerprint(payload):
+
+    desired = dict(payload)
+    desired['description'] = strip_fingerprint(desired.get('description'))
+    # Rules are compared on what they match, not on their ids
+    desired['rules'] = sorted([json.dumps(dict((key, rule.get(key)) for key in ['field', 'type', 'value', 'inverted']), sort_keys=True)
+                               for rule in desired.get('rules') or []])
+
+    return fingerprint(desired)
 
 
 def create(module, base_url, headers, index_set_id):
@@ -353,6 +486,12 @@ def create(module, base_url, headers, index_set_id):
 
     payload['index_set_id'] = index_set_id
 
+    if module.params['fingerprint']:
+        payload['description'] = with_fingerprint(payload.get('description'), stream_fingerprint(payload))
+
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'stream', 'create', 'POST', url, payload, id_field='stream_id')
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
 
     if info['status'] != 201:
@@ -376,6 +515,9 @@ def create_rule(module, base_url, headers):
         if module.params[key] is not None:
             payload[key] = module.params[key]
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'stream_rule', 'create', 'POST', url, payload, id_field='streamrule_id')
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
 
     if info['status'] != 201:
@@ -395,6 +537,12 @@ def update(module, base_url, headers, stream_id, title, description, remove_matc
 
     payload = {}
 
+    if module.params['queue_file'] is not None:
+        given = {'title': title, 'description': description, 'matching_type': matching_type, 'rules': rules,
+                 'remove_matches_from_default_stream': remove_matches_from_default_stream, 'index_set_id': index_set_id}
+        payload = dict((key, given[key]) for key in given if given[key] is not None)
+        return graylog_queue.enqueue(module, 'stream', 'update', 'PUT', url, payload, ref=stream_id, keys=STREAM_KEYS)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
 
     if info['status'] != 200:
@@ -431,6 +579,17 @@ def update(module, base_url, headers, stream_id, title, description, remove_matc
     else:
         payload['index_set_id'] = payload_current['index_set_id']
 
+    if module.params['fingerprint']:
+        payload['description'] = strip_fingerprint(payload['description'])
+        # The stream was just read, compare with it so changes made elsewhere are not missed. Rules are left out,
+        # the update doesn't write them.
+        settings = dict((key, payload[key]) for key in payload if key != 'rules')
+        current = dict((key, payload_current.get(key)) for key in settings)
+        value = stream_fingerprint(settings)
+        if value == stream_fingerprint(current):
+            return info['status'], UNCHANGED, content, url
+        payload['description'] = with_fingerprint(payload['description'], value)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT', data=module.jsonify(payload))
 
     if info['status'] != 200:
@@ -450,6 +609,11 @@ def update_rule(module, base_url, headers, stream_id, rule_id, field, type, valu
 
     url = "/".join([base_url, stream_id, "rules", rule_id])
 
+    if module.params['queue_file'] is not None:
+        given = {'field': field, 'type': type, 'value': value, 'inverted': inverted, 'description': description}
+        payload = dict((key, given[key]) for key in given if given[key] is not None)
+        return graylog_queue.enqueue(module, 'stream_rule', 'update', 'PUT', url, payload, ref=rule_id, keys=STREAM_RULE_KEYS)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
 
     if info['status'] != 200:
@@ -499,6 +663,9 @@ def delete(module, base_url, headers, stream_id):
 
     url = "/".join([base_url, stream_id])
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'stream', 'delete', 'DELETE', url, ref=stream_id)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
 
     if info['status'] != 204:
@@ -516,6 +683,9 @@ def delete_rule(module, base_url, headers, stream_id, rule_id):
 
     url = "/".join([base_url, stream_id, "rules", rule_id])
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'stream_rule', 'delete', 'DELETE', url, ref=rule_id)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
 
     if info['status'] != 204:
@@ -533,6 +703,9 @@ def start(module, base_url, headers, stream_id):
 
     url = "/".join([base_url, stream_id, "resume"])
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'stream_state', 'set', 'POST', url, ref=stream_id)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
 
     if info['status'] != 200:
@@ -550,6 +723,9 @@ def pause(module, base_url, headers, stream_id):
 
     url = "/".join([base_url, stream_id, "pause"])
 
+    if module.params['queue_file'] is not None:
+        return graylog_queue.enqueue(module, 'stream_state', 'set', 'POST', url, ref=stream_id)
+
     response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
 
     if info['status'] != 200:
@@ -583,6 +759,29 @@ def list(module, base_url, headers, stream_id):
     return info['status'], info['msg'], content, url
 
 
+def analyze(module, base_url, headers):
+
+    status, message, content, url = list(module, base_url, headers, None)
+
+    result = graylog_stream_rules.analyze(json.loads(content)['streams'])
+
+    return status, message, module.jsonify(result), url
+
+
+def list_many(module, base_url, headers, stream_ids):
+
+    requests = [{'url': "/".join([base_url, stream_id])} for stream_id in stream_ids]
+    responses = fetch_urls(module, requests, json.loads(headers), module.params['concurrency'], module.params['transport'])
+
+    streams = []
+    for response, info in responses:
+        if info['status'] != 200:
+            module.fail_json(msg="Fail: %s" % ("Status: " + str(info['msg']) + ", Message: " + str(info['body'])))
+        streams.append(json.loads(to_text(response.read(), errors='surrogate_or_strict')))
+
+    return 200, "OK", module.jsonify(streams), base_url
+
+
 def query_streams(module, base_url, headers, stream_name):
 
     url = base_url
@@ -636,6 +835,10 @@ def default_index_set(module, endpoint, base_url, headers):
 
 def get_token(module, endpoint, username, password):
 
+    # Access tokens authenticate directly, without opening a session
+    if module.params['api_token'] is not None:
+        return base64.b64encode((module.params['api_token'] + ":token").encode('utf-8'))
+
     headers = '{ "Content-Type": "application/json", "X-Requested-By": "Graylog API", "Accept": "application/json" }'
 
     url = endpoint + "/api/system/sessions"
@@ -664,33 +867,8 @@ def get_token(module, endpoint, username, password):
     return session_token
 
 
-def main():
-    module = AnsibleModule(
-        argument_spec=dict(
-            endpoint=dict(type='str'),
-            graylog_user=dict(type='str'),
-            graylog_password=dict(type='str', no_log=True),
-            allow_http=dict(type='bool', required=False, default=False),
-            validate_certs=dict(type='bool', required=False, default=True),
-            action=dict(type='str', required=False, default='list', choices=['create', 'create_rule', 'start', 'pause',
-                        'update', 'update_rule', 'delete', 'delete_rule', 'list', 'query_streams']),
-            stream_id=dict(type='str'),
-            stream_name=dict(type='str'),
-            rule_id=dict(type='str'),
-            title=dict(type='str'),
-            field=dict(type='str'),
-            type=dict(type='int', default=1),
-            value=dict(type='str'),
-            index_set_id=dict(type='str'),
-            inverted=dict(type='bool', default=False),
-            description=dict(type='str'),
-            remove_matches_from_default_stream=dict(type='bool', default=False),
-            matching_type=dict(type='str'),
-            rules=dict(type='list')
-        )
-    )
+def run(module, endpoint):
 
-    endpoint = module.params['endpoint']
     graylog_user = module.params['graylog_user']
     graylog_password = module.params['graylog_password']
     action = module.params['action']
@@ -738,11 +916,15 @@ def main():
         status, message, content, url = start(module, base_url, headers, stream_id)
     elif action == "pause":
         status, message, content, url = pause(module, base_url, headers, stream_id)
+    elif action == "list" and module.params['stream_ids']:
+        status, message, content, url = list_many(module, base_url, headers, module.params['stream_ids'])
     elif action == "list":
         status, message, content, url = list(module, base_url, headers, stream_id)
     elif action == "query_streams":
         stream_id = query_streams(module, base_url, headers, stream_name)
         status, message, content, url = list(module, base_url, headers, stream_id)
+    elif action == "analyze":
+        status, message, content, url = analyze(module, base_url, headers)
 
     uresp = {}
     content = to_text(content, encoding='UTF-8')
@@ -757,7 +939,52 @@ def main():
     uresp['msg'] = message
     uresp['url'] = url
 
-    module.exit_json(**uresp)
+    if module.params['fingerprint'] and action == "update":
+        uresp['changed'] = message != UNCHANGED
+
+    return uresp
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            endpoint=dict(type='raw'),
+            clusters=dict(type='list'),
+            graylog_user=dict(type='str'),
+            graylog_password=dict(type='str', no_log=True),
+            api_token=dict(type='str', no_log=True),
+            allow_http=dict(type='bool', required=False, default=False),
+            validate_certs=dict(type='bool', required=False, default=True),
+            rate_limit=dict(type='float'),
+            pressure_check=dict(type='bool', default=False),
+            max_journal_utilization=dict(type='int', default=50),
+            max_buffer_utilization=dict(type='int', default=80),
+            pressure_timeout=dict(type='int', default=300),
+            action=dict(type='str', required=False, default='list', choices=['create', 'create_rule', 'start', 'pause',
+                        'update', 'update_rule', 'delete', 'delete_rule', 'list', 'query_streams', 'analyze']),
+            stream_id=dict(type='str'),
+            stream_name=dict(type='str'),
+            rule_id=dict(type='str'),
+            title=dict(type='str'),
+            field=dict(type='str'),
+            type=dict(type='int', default=1),
+            value=dict(type='str'),
+            index_set_id=dict(type='str'),
+            inverted=dict(type='bool', default=False),
+            description=dict(type='str'),
+            remove_matches_from_default_stream=dict(type='bool', default=False),
+            matching_type=dict(type='str'),
+            rules=dict(type='list'),
+            stream_ids=dict(type='list'),
+            concurrency=dict(type='int', default=8),
+            transport=dict(type='str', default='threads', choices=TRANSPORTS),
+            fingerprint=dict(type='bool', default=False),
+            queue_file=dict(type='path')
+        ),
+        mutually_exclusive=[['endpoint', 'clusters']]
+    )
+
+    run_on_clusters(module, run)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible_collections.bauk.graylog.plugins.module_utils import graylog_queue
+
+
+STREAMS_URL = "https://graylog.mydomain.com/api/streams"
+
+PIPELINES_URL = "https://graylog.mydomain.com/api/system/pipelines"
+
+
+def entry(kind, op, method, url, payload=None, ref=None, id_field='id'):
+
+    queued = {'kind': kind, 'op': op, 'method': method, 'url': url, 'payload': payload, 'ref': ref}
+    if op == 'create':
+        queued['id_field'] = id_field
+
+    return queued
+
+
+def requests(entries):
+
+    return [(queued['method'], queued['url']) for queued in graylog_queue.coalesce(entries)]
+
+
+def test_created_then_deleted_is_never_sent():
+
+    ref = graylog_queue.REF_PREFIX + "stream"
+    entries = [
+        entry('stream', 'create', 'POST', STREAMS_URL, {'title': "Client XYZ"}, ref=ref, id_field='stream_id'),
+        entry('stream_rule', 'create', 'POST', "/".join([STREAMS_URL, ref, "rules"]), {'field': "client"},
+              ref=graylog_queue.REF_PREFIX + "rule"),
+        entry('stream', 'update', 'PUT', "/".join([STREAMS_URL, ref]), {'description': "XYZ"}, ref=ref),
+        entry('stream', 'delete', 'DELETE', "/".join([STREAMS_URL, ref]), ref=ref),
+        entry('stream', 'update', 'PUT', "/".join([STREAMS_URL, "other"]), {'title': "Other"}, ref="other")
+    ]
+
+    assert requests(entries) == [('PUT', STREAMS_URL + "/other")]
+
+
+def test_delete_drops_the_writes_below_it():
+
+    entries = [
+        entry('stream', 'update', 'PUT', STREAMS_URL + "/X", {'title': "X"}, ref="X"),
+        entry('stream_rule', 'delete', 'DELETE', STREAMS_URL + "/X/rules/X2", ref="X2"),
+        entry('stream_rule', 'update', 'PUT', STREAMS_URL + "/X/rules/X3", {'value': "3"}, ref="X3"),
+        entry('stream', 'delete', 'DELETE', STREAMS_URL + "/X", ref="X")
+    ]
+
+    assert requests(entries) == [('DELETE', STREAMS_URL + "/X")]
+
+
+def test_delete_keeps_its_queue_position():
+
+    entries = [
+        entry('stream', 'update', 'PUT', STREAMS_URL + "/X", {'title': "X"}, ref="X"),
+        entry('stream', 'update', 'PUT', STREAMS_URL + "/Y", {'title': "Y"}, ref="Y"),
+        entry('stream', 'delete', 'DELETE', STREAMS_URL + "/X", ref="X")
+    ]
+
+    assert requests(entries) == [('PUT', STREAMS_URL + "/Y"), ('DELETE', STREAMS_URL + "/X")]
+
+
+def test_delete_does_not_drop_a_sibling_with_a_longer_id():
+
+    entries = [
+        entry('stream', 'delete', 'DELETE', STREAMS_URL + "/X", ref="X"),
+        entry('stream', 'update', 'PUT', STREAMS_URL + "/X1", {'title': "X1"}, ref="X1")
+    ]
+
+    assert requests(entries) == [('DELETE', STREAMS_URL + "/X"), ('PUT', STREAMS_URL + "/X1")]
+
+
+def test_updates_are_merged_into_the_create():
+
+    ref = graylog_queue.REF_PREFIX + "rule"
+    entries = [
+        entry('pipeline_rule', 'create', 'POST', PIPELINES_URL + "/rule", {'title': "a", 'source': "s1"}, ref=ref),
+        entry('pipeline_rule', 'update', 'PUT', "/".join([PIPELINES_URL, "rule", ref]), {'source': "s2"}, ref=ref)
+    ]
+
+    coalesced = graylog_queue.coalesce(entries)
+
+    assert len(coalesced) == 1
+    assert coalesced[0]['op'] == 'create'
+    assert coalesced[0]['payload'] == {'title': "a", 'source': "s2"}
+    assert coalesced[0]['merged'] == 2
+
+
+def test_placeholders_are_used_after_their_create():
+
+    pipeline = graylog_queue.REF_PREFIX + "pipeline"
+    stream = graylog_queue.REF_PREFIX + "stream"
+    entries = [
+        entry('pipeline', 'create', 'POST', PIPELINES_URL + "/pipeline", {'title': "p"}, ref=pipeline),
+        entry('pipeline_connection', 'set', 'POST', PIPELINES_URL + "/connections/to_pipeline",
+              {'pipeline_id': pipeline, 'stream_ids': [stream]}, ref=pipeline),
+        entry('stream', 'create', 'POST', STREAMS_URL, {'title': "s"}, ref=stream, id_field='stream_id')
+    ]
+
+    assert requests(entries) == [('POST', PIPELINES_URL + "/pipeline"), ('POST', STREAMS_URL),
+                                 ('POST', PIPELINES_URL + "/connections/to_pipeline")]
+
+
+def test_placeholders_match_whole_values():
+
+    ref = graylog_queue.REF_PREFIX + "ab"
+    queued = entry('stream', 'update', 'PUT', STREAMS_URL + "/" + ref + "cd", {'description': "copy of " + ref}, ref="other")
+
+    assert graylog_queue.placeholders(queued) == set([ref + "cd"])
+    assert not graylog_queue.refers_to(queued, set([ref]))
+
+
+def test_resolve_replaces_placeholders():
+
+    ref = graylog_queue.REF_PREFIX + "stream"
+    queued = entry('stream_rule', 'create', 'POST', "/".join([STREAMS_URL, ref, "rules"]), {'stream_ids': [ref]},
+                   ref=graylog_queue.REF_PREFIX + "rule")
+
+    resolved = graylog_queue.resolve(queued, {ref: "5bc7666089675c7f7d7f08d7"})
+
+    assert resolved['url'] == STREAMS_URL + "/5bc7666089675c7f7d7f08d7/rules"
+    assert resolved['payload'] == {'stream_ids': ["5bc7666089675c7f7d7f08d7"]}
+    assert resolved['ref'] == graylog_queue.REF_PREFIX + "rule"
@@ -0,0 +1,115 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+
+import pytest
+
+from ansible_collections.bauk.graylog.plugins.module_utils.graylog_fingerprint import UNCHANGED
+from ansible_collections.bauk.graylog.plugins.modules import graylog_ldap
+
+
+BASE_URL = "https://graylog.mydomain.com/api/system/ldap"
+
+CURRENT = {
+    'enabled': True,
+    'active_directory': True,
+    'ldap_uri': "ldaps://dc.mydomain.com:636",
+    'use_start_tls': False,
+    'trust_all_certificates': False,
+    'system_username': "ldapbind@mydomain.com",
+    'system_password_set': True,
+    'search_base': "cn=users,dc=mydomain,dc=com",
+    'search_pattern': "(&(objectClass=user)(sAMAccountName={0}))",
+    'default_group': "Reader",
+    'group_mapping': {'Graylog Admins': "Admin", 'Graylog Analysts': "Reader"}
+}
+
+
+class FakeResponse(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body.encode('utf-8')
+
+
+class FakeModule(object):
+
+    def __init__(self, params):
+        self.params = dict((key, None) for key in graylog_ldap.UPDATE_KEYS)
+        self.params['fingerprint_file'] = None
+        self.params.update(params)
+
+    def jsonify(self, data):
+        return json.dumps(data)
+
+    def fail_json(self, **kwargs):
+        raise AssertionError(kwargs['msg'])
+
+
+@pytest.fixture
+def server(monkeypatch):
+
+    requests = []
+
+    def fetch_url(module, url, headers=None, method='GET', data=None, timeout=10):
+        requests.append(method)
+        if method == 'GET':
+            return FakeResponse(json.dumps(CURRENT)), {'status': 200, 'msg': "OK"}
+        return FakeResponse(""), {'status': 204, 'msg': "No Content"}
+
+    monkeypatch.setattr(graylog_ldap, 'fetch_url', fetch_url)
+
+    return requests
+
+
+def desired(**changes):
+
+    params = dict((key, CURRENT[key]) for key in CURRENT if key != 'system_password_set')
+    params.update(changes)
+
+    return params
+
+
+@pytest.mark.parametrize('mapping', [
+    {'Graylog Analysts': "Reader", 'Graylog Admins': "Admin"},
+    [{'Graylog Admins': "Admin"}, {'Graylog Analysts': "Reader"}],
+    [{'group': "Graylog Analysts", 'role': "Reader"}, {'group': "Graylog Admins", 'role': "Admin"}],
+])
+def test_update_skips_same_group_mapping(server, mapping):
+
+    module = FakeModule(desired(group_mapping=mapping))
+
+    status, message, content, url = graylog_ldap.update(module, BASE_URL, "{}")
+
+    assert message == UNCHANGED
+    assert server == ['GET']
+
+
+def test_update_writes_changed_group_mapping(server):
+
+    module = FakeModule(desired(group_mapping=[{'Graylog Admins': "Admin"}, {'Graylog Analysts': "Admin"}]))
+
+    status, message, content, url = graylog_ldap.update(module, BASE_URL, "{}")
+
+    assert message != UNCHANGED
+    assert server == ['GET', 'PUT']
+    assert json.loads(content)['after'] == {'group_mapping': {'Graylog Admins': "Admin", 'Graylog Analysts': "Admin"}}
+
+
+def test_update_records_and_checks_password(server, tmp_path):
+
+    state_file = str(tmp_path / "ldap.json")
+    module = FakeModule(desired(system_password="bindPassw0rd", fingerprint_file=state_file))
+
+    assert graylog_ldap.update(module, BASE_URL, "{}")[1] != UNCHANGED
+    assert graylog_ldap.update(module, BASE_URL, "{}")[1] == UNCHANGED
+    assert "bindPassw0rd" not in open(state_file).read()
+
+    module.params['system_password'] = "newPassw0rd"
+    assert graylog_ldap.update(module, BASE_URL, "{}")[1] != UNCHANGED
+    assert server == ['GET', 'PUT', 'GET', 'GET', 'PUT']